@@ -0,0 +1,23 @@
+from fastapi import APIRouter, HTTPException
+from services.firestore import get_analytics_summary, get_analytics_histogram
+from datetime import datetime
+from typing import Literal
+
+router = APIRouter(tags=["Analytics"]) # precomputed dashboard numbers, a few KB instead of every incident
+
+@router.get("/api/analytics/summary") # StatCards plus the severity/status/source/category breakdowns
+def fetch_analytics_summary(since: datetime | None = None, until: datetime | None = None):
+    """Counts for incidents between since and until (whole hours, UTC unless they carry an offset), all time without them."""
+    try:
+        return get_analytics_summary(since, until)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/api/analytics/histogram") # Threat Activity Trend data
+def fetch_analytics_histogram(granularity: Literal["minute", "hour", "day", "month"] = "hour",
+                              since: datetime | None = None, until: datetime | None = None):
+    """Incidents per UTC time bucket ("minute" means 5 minutes), only buckets with incidents are listed."""
+    try:
+        return get_analytics_histogram(granularity, since, until)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,42 +1,144 @@
-from fastapi import APIRouter, HTTPException, Body
-from services.firestore import get_incidents, get_users, db 
-from pydantic import BaseModel, Field
+from fastapi import APIRouter, HTTPException, Body, Query, Request
+from fastapi.responses import StreamingResponse
+from services.firestore import get_incidents_versioned, query_incidents, get_users_versioned, incident_broadcaster, update_incident, update_incidents, search_incidents 
+from services.responses import VersionedPayload, send_payload, send_json
+from api.models import NoteRequest, AssignRequest, BulkSelection, BulkAssignRequest, BulkNoteRequest, MAX_BULK_INCIDENTS
+from datetime import datetime
+from typing import Literal
 import firebase_admin.firestore as firestore
 from security.crypto import encrypt_payload
+from security.auth import issue_stream_token
 
 router = APIRouter(tags=["API Routes"])  # Initialize the router and group these endpoints under "API Routes" 
+stream_router = APIRouter(tags=["API Routes"]) # the SSE stream, included with its own auth check (see main.py)
 
-class NoteRequest(BaseModel):
-    """Defines the expected JSON payload for adding a note to an incident."""
-    note: str = Field(..., max_length=1000)
+# API Endpoints
 
-class AssignRequest(BaseModel):
-    """Defines the expected JSON payload for assigning an incident to a user."""
-    assigned_to: str = Field(..., max_length=100)
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
-# API Endpoints
+# the full listings are serialised (and compressed) once per cache version, repeat polls get a 304
+incidents_payload = VersionedPayload()
+users_payload = VersionedPayload()
+
+@router.get("/api/incidents") # retrieves incidents, a page at a time when any paging/filter parameter is given
+def fetch_incidents(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str | None = None, # next_cursor from the previous page
+    status: str | None = None, # analysis_status, e.g. pending, AI_Analysis_Complete, resolved
+    assigned_to: str | None = None,
+    risk_min: int | None = Query(None, ge=1, le=10),
+    risk_max: int | None = Query(None, ge=1, le=10),
+    since: datetime | None = None,
+    until: datetime | None = None,
+    filename: str | None = None, # the raw log the event came from
+    order: Literal["newest", "oldest"] = "newest"
+):
+    filters = {
+        "cursor": cursor, "status": status, "assigned_to": assigned_to, "filename": filename,
+        "risk_min": risk_min, "risk_max": risk_max, "since": since, "until": until
+    }
+    if limit is None and order == "newest" and all(value is None for value in filters.values()):
+        # plain GET keeps returning the full list the dashboard already expects
+        version, incidents = get_incidents_versioned()
+        return send_payload(request, incidents_payload.get(version, lambda: incidents))
+
+    try:
+        items, next_cursor = query_incidents(limit=limit or DEFAULT_PAGE_SIZE, newest_first=order == "newest", **filters)
+    except ValueError as e: # bad cursor
+        raise HTTPException(status_code=400, detail=str(e))
+    return send_json(request, {"items": items, "next_cursor": next_cursor})
+
+@router.get("/api/incidents/search") # full-text search over log text, AI summaries and notes
+def search_incident_text(request: Request, q: str = Query(..., min_length=1, max_length=200), limit: int = Query(20, ge=1, le=100)):
+    """Every word has to match, the last one as a prefix (search-as-you-type). Best matches first,
+    summary hits above note hits above log text hits, newest first on ties."""
+    try:
+        return send_json(request, {"items": search_incidents(q, limit)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/api/incidents/stream/token") # short lived token for opening the stream with EventSource
+def create_stream_token():
+    token, expires_in = issue_stream_token()
+    return {"token": token, "expires_in": expires_in}
+
+@stream_router.get("/api/incidents/stream") # live incident changes as Server-Sent Events
+async def stream_incidents(request: Request, last_event_id: str | None = None):
+    """Sends an "upsert" or "remove" event per changed incident. Reconnecting with the last event id
+    (Last-Event-ID header, or ?last_event_id= for fetch based clients) replays what was missed. A
+    "reset" event means that wasn't possible, reload the list and carry on.
+
+    Takes the X-API-Key header or ?token= from POST /api/incidents/stream/token, the token is only
+    checked on connect so get a fresh one before reconnecting after it expires."""
+    return StreamingResponse(
+        incident_broadcaster.stream(request.headers.get("last-event-id") or last_event_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # no proxy buffering either
+    )
+
+# the mutations await update_incident, which writes on a dedicated thread pool and updates the RAM cache
+# straight away, so the next GET already shows the change
+
+def select_incidents(selection: BulkSelection):
+    """The doc ids a bulk request covers, 400 if it names none or matches too many."""
+    if selection.ids is not None:
+        return list(dict.fromkeys(selection.ids)) # duplicates once, order kept
+    filters = selection.filter.model_dump(exclude_none=True) if selection.filter else {}
+    if not filters:
+        raise HTTPException(status_code=400, detail="Give ids or at least one filter") # no accidental "resolve everything"
+    matches, _ = query_incidents(limit=MAX_BULK_INCIDENTS + 1, **filters)
+    if len(matches) > MAX_BULK_INCIDENTS:
+        raise HTTPException(status_code=400, detail=f"Filter matches more than {MAX_BULK_INCIDENTS} incidents, narrow it down")
+    return [incident["id"] for incident in matches]
+
+async def run_bulk(request: Request, action: str, ids: list[str], fields: dict, local=None):
+    """Batched write for every id, plus one audit entry for the lot (picked up by the audit middleware)."""
+    try:
+        results = await update_incidents([(doc_id, fields, local) for doc_id in ids])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    updated = sum(result == "ok" for result in results.values())
+    request.state.audit = {"action": f"bulk_{action}", "requested": len(ids), "updated": updated, "ids": ids}
+    return {"status": "success" if updated == len(ids) else "partial", "updated": updated, "results": results}
+
+# bulk versions of the mutations below, declared first so "bulk" isn't taken for a doc_id
+
+@router.patch("/api/incidents/bulk/resolve") # Resolves every selected incident
+async def bulk_resolve(request: Request, selection: BulkSelection):
+    return await run_bulk(request, "resolve", select_incidents(selection), {"analysis_status": "resolved"})
+
+@router.patch("/api/incidents/bulk/assign") # Assigns every selected incident to one user
+async def bulk_assign(request: Request, body: BulkAssignRequest):
+    return await run_bulk(request, "assign", select_incidents(body), {"assigned_to": body.assigned_to})
 
-@router.get("/api/incidents") # retrieves all incidents
-def fetch_incidents():
-    return get_incidents() 
+@router.post("/api/incidents/bulk/notes") # Appends the same note to every selected incident
+async def bulk_add_note(request: Request, body: BulkNoteRequest):
+    encrypted_note = encrypt_payload(body.note) # encrypted once, the same token goes on every incident
+    return await run_bulk(
+        request, "notes", select_incidents(body),
+        {"user_notes": firestore.ArrayUnion([encrypted_note])},
+        lambda incident: {"user_notes": incident["user_notes"] + [body.note]}
+    )
 
 @router.patch("/api/incidents/{doc_id}/resolve") # Updates the status of a specific incident to "resolved".
-def resolve_incident(doc_id: str):
+async def resolve_incident(doc_id: str):
     try:
-        db.collection("incidents").document(doc_id).update({
-            "analysis_status": "resolved"
-        })
+        await update_incident(doc_id, {"analysis_status": "resolved"})
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/api/incidents/{doc_id}/notes") # Appends a note to a specific incident
-def add_note(doc_id: str, request: NoteRequest):
+async def add_note(doc_id: str, request: NoteRequest):
     try:
         encrypted_note = encrypt_payload(request.note)
-        db.collection("incidents").document(doc_id).update({
-            "user_notes": firestore.ArrayUnion([encrypted_note])
-        })
+        await update_incident(
+            doc_id,
+            {"user_notes": firestore.ArrayUnion([encrypted_note])},
+            lambda incident: {"user_notes": incident["user_notes"] + [request.note]} # the cache holds notes decrypted
+        )
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -45,28 +147,26 @@ def add_note(doc_id: str, request: NoteRequest):
 async def update_mitigation_progress(doc_id: str, completed_steps: list[int] = Body(..., embed=True)):
     """Saves the list of checked boxes (by index) to Firestore"""
     try:
-        doc_ref = db.collection("incidents").document(doc_id)
-        doc_ref.update({"completed_steps": completed_steps})
+        await update_incident(doc_id, {"completed_steps": completed_steps})
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.patch("/api/incidents/{doc_id}/assign") # Appends a user to an incident
-def assign_incident(doc_id: str, request: AssignRequest):
+async def assign_incident(doc_id: str, request: AssignRequest):
     """Saves the assigned user to Firestore"""
     try:
-        db.collection("incidents").document(doc_id).update({
-            "assigned_to": request.assigned_to
-        })
+        await update_incident(doc_id, {"assigned_to": request.assigned_to})
         return {"status": "success"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/api/users") # Retrieves all users
-def fetch_users():
+def fetch_users(request: Request):
     """Fetches all users from the Python RAM cache (0 reads)"""
     try:
-        # no longer query Firebase here, just return the cache
-        return get_users()
+        # no longer query Firebase here, just return the cache (serialised once per version)
+        version, users = get_users_versioned()
+        return send_payload(request, users_payload.get(version, lambda: users))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,44 @@
+#models.py holds the request bodies for api/incidents.py, kept apart so they can be imported without Firebase
+from pydantic import BaseModel, Field, model_validator
+from datetime import datetime
+
+class NoteRequest(BaseModel):
+    """Defines the expected JSON payload for adding a note to an incident."""
+    note: str = Field(..., max_length=1000)
+
+class AssignRequest(BaseModel):
+    """Defines the expected JSON payload for assigning an incident to a user."""
+    assigned_to: str = Field(..., max_length=100)
+
+MAX_BULK_INCIDENTS = 5000 # per bulk request, about 10 batch commits
+
+class IncidentFilter(BaseModel):
+    """Same filters as GET /api/incidents, evaluated against the RAM cache."""
+    status: str | None = None
+    assigned_to: str | None = None
+    filename: str | None = None
+    risk_min: int | None = Field(None, ge=1, le=10)
+    risk_max: int | None = Field(None, ge=1, le=10)
+    since: datetime | None = None
+    until: datetime | None = None
+
+class BulkSelection(BaseModel):
+    """Which incidents a bulk action applies to: explicit ids, or every incident matching a filter."""
+    ids: list[str] | None = Field(None, max_length=MAX_BULK_INCIDENTS)
+    filter: IncidentFilter | None = None
+
+    @model_validator(mode="after")
+    def ids_or_filter(self):
+        # one or the other, a filter sent alongside ids would otherwise be ignored without a word
+        if self.ids is not None and self.filter is not None:
+            raise ValueError("Give ids or a filter, not both")
+        if self.ids is not None and not self.ids:
+            raise ValueError("ids is empty")
+        return self
+
+class BulkAssignRequest(BulkSelection):
+    assigned_to: str = Field(..., max_length=100)
+
+class BulkNoteRequest(BulkSelection):
+    note: str = Field(..., max_length=1000)
+
@@ -1,8 +1,21 @@
-import os, datetime, sys, json, re, uuid, firebase_admin, time
+import os, datetime, sys, json, uuid, firebase_admin, time, argparse
 from firebase_admin import credentials, firestore
 from dotenv import load_dotenv
 from google import genai
-from security.crypto import encrypt_payload 
+from security.crypto import encrypt_payload, encrypt_many
+from processing.pipeline import prepare_lines # line parsing, noise filtering and PII sanitisation
+from processing.workers import SanitiserPool # optional multi-process version of prepare_lines (--workers)
+from processing.watcher import make_watcher # inotify/polling change notifications for src_dir
+from processing.ndjson import NDJSONWriter, segment_paths, output_base, legacy_json_name # append-only cleaned-logs output
+from processing.spool import EventSpool, MAX_ATTEMPTS # on-disk queue of events waiting for the LLM
+from processing.clustering import cluster_events # one LLM analysis per repeated log pattern
+from processing.batcher import AdaptiveBatcher, is_high_priority # token sized batches and the wait window
+from services.bulk_writer import IncidentWriter, stable_doc_id # batched Firestore writes with pre-allocated doc IDs
+from services.analysis_cache import AnalysisCache, cache_key # skips the API for patterns seen before
+from services.settings_cache import SettingsCache # settings/users kept in RAM by snapshot listeners
+from services.dispatcher import BatchDispatcher, is_rate_limited # background LLM queue with RPM/TPM limits
+from services.fake_llm import FakeLLMClient # offline stand-in for the Gemini client (--fake-llm)
+from services.json_stream import JSONObjectStream # per-object parsing of the (streamed) reply
 from google.genai.types import GenerateContentConfig, SafetySetting, HarmCategory, HarmBlockThreshold
 from services.notifications import send_consolidated_email
 
@@ -11,14 +24,11 @@ ENV_PATH = os.path.join(current_dir, ".env")
 load_dotenv(ENV_PATH)
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Create a single client object
-client = genai.Client(api_key=GEMINI_API_KEY)
-
-# Initialise Firebase 
-
-cred = credentials.Certificate(os.path.join(current_dir, "serviceAccountKey.json"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Clients, caches and files are opened in main(), not on import. SanitiserPool's spawned workers
+# import this file as __mp_main__ and must not open their own Firestore channels or SQLite handles.
+client = None # single Gemini client (or the fake one with --fake-llm)
+db = None # Firestore
+settings_cache = None # settings/users listeners
 
 local_time = datetime.datetime.now().isoformat() # timestamp for cleaned logs
 
@@ -28,89 +38,48 @@ dst_dir = os.path.join(current_dir, "..", "cleaned-logs")
 
 # Config for sanitisation 
 acc_ext = [".log", ".txt", ".ids", ".fast", ".ndjson"] # accepted file extensions
-pattern_ip = re.compile(r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b")
-pattern_ipv6 = re.compile(r"(?:(?:[0-9a-fA-F]{1,4}:){7,7}[0-9a-fA-F]{1,4}|(?:[0-9a-fA-F]{1,4}:){1,7}:|(?:[0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}|(?:[0-9a-fA-F]{1,4}:){1,5}(?::[0-9a-fA-F]{1,4}){1,2}|(?:[0-9a-fA-F]{1,4}:){1,4}(?::[0-9a-fA-F]{1,4}){1,3}|(?:[0-9a-fA-F]{1,4}:){1,3}(?::[0-9a-fA-F]{1,4}){1,4}|(?:[0-9a-fA-F]{1,4}:){1,2}(?::[0-9a-fA-F]{1,4}){1,5}|[0-9a-fA-F]{1,4}:(?::[0-9a-fA-F]{1,4}){1,6}|:(?::[0-9a-fA-F]{1,4}){1,7}|::1)")
-pattern_mac = re.compile(r"(?:[0-9A-Fa-f]{2}[:-]){5}(?:[0-9A-Fa-f]{2})")
-pattern_email = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
-pattern_win_user_path = re.compile(r"(?i)(C:\\Users\\[a-z0-9_-]+)")
-pattern_passwords = re.compile(r"(?i)(--password|-p|password=)\s*['\"]?([^\s'\"]+)['\"]?")
-
-# Define keywords for suspicious prediction
-class ThreatDictionary:
-    # 1. Web Application Attacks (SQLi, XSS, Path Traversal)
-    WEB_ATTACKS = [
-        "<script>", "alert(", "onerror=", "onload=", "eval(", "src=",  # XSS
-        "union select", "select *", "drop table", "insert into", "order by", "--", " ' or '1'='1", # SQLi
-        "../", "..\\", "etc/passwd", "windows/system32", "boot.ini", ".env", ".git", # Path Traversal / Info Leak
-        "jndi:ldap", "jndi:rmi", #Log4j exploits
-        "wp-admin", "wp-login",  # WordPress brute force/scanning
-        "whoami", "ifconfig", "ipconfig" # Command execution output
-    ]
-    
-    # 2. Authentication & Account Security (Brute Force)
-    AUTH_ATTACKS = [
-        "failed password", "invalid user", "authentication failure", "unauthorized",
-        "login failed", "access denied", "bad password", "locked out", "user not found", "4625", # Windows Failed Logon
-        "maximum authentication attempts exceeded", # Linux aggressive brute force
-        "preauth", # SSH pre-authentication failures
-        "4740" # Windows: User Account Locked Out
-    ]
-    
-    # 3. System & Malware Indicators (Post-Exploitation)
-    SYSTEM_ATTACKS = [
-        "rm -rf", "sudo", "chmod", "chown", "wget ", "curl ", "netcat", "nc -e", # Command Injection
-        "compromised", "unexpected service", "malicious", "backdoor", "shell",
-        "powershell", "base64", "python -c", "perl -e", # Common script execution
-        "4720", "4732", "1102", "7045", "vssadmin delete shadows", 
-        "lsass.exe", "invoke-expression", # Windows specific
-        "certutil.exe -urlcache", "certutil.exe -split", # Often used by malware to download payloads
-        "schtasks /create", "bitsadmin", #  Windows persistence mechanisms
-        "disableantispyware", "reg add" # Tampering with Windows Defender/Registry
-    ]
-
-    # 4. Network Scanning & Reconnaissance (Probing)
-    RECON = [
-        "nmap", "masscan", "dirbuster", "nikto", "sqlmap", "iptables-dropped", 
-        "connection refused", "port scan", "icmp", "test packet",
-        "zgrab", "nessus", "acunetix", "w3af" # Common automated vulnerability scanners
-    ]
-
-    @classmethod
-    def get_all(cls):
-        # combine everything into one massive list for initial filter
-        return cls.WEB_ATTACKS + cls.AUTH_ATTACKS + cls.SYSTEM_ATTACKS + cls.RECON
-
-SUSPICIOUS_KEYWORDS = ThreatDictionary.get_all()
-
-# list of patterns that are noisy but safe
-# Expanded to aggressively filter out normal Windows and Linux background noise
-KNOWN_SAFE_PATTERNS = [
-    # Linux / Unix Noise
-    "session opened", "session closed", "systemd: started", "ntpdate", 
-    "authorized_keys", "cron[", "postfix/", "dovecot:", "crond[", 
-    "reached target", "pms-refresh", "status=sent (250 2.0.0 ok", 
-    "starting update inventory", "connection closed by authenticating user",
-    "removed slice", "created slice", "starting session", "started session", # Systemd slice spam
-    "pam_unix(cron:session)", "dhcpack", "dhcpdiscover", # DHCP and Cron spam
-    
-    # Windows Noise
-    "4624", # Windows: Successful Logon (EXTREMELY NOISY)
-    "4634", # Windows: Successful Logoff
-    "4672", # Windows: Special privileges assigned to new logon (Noisy for admin accounts)
-    "5140", # Windows: A network share object was accessed
-    "5156", # Windows: Windows Filtering Platform has allowed a connection
-    "service control manager", "system idle process", 
-    
-    # Web / Network Noise
-    "favicon.ico", "robots.txt", # Standard web crawler requests
-    "\"get / http/1.1\" 200", "\"get / http/1.0\" 200" # Basic successful web loads
-]
 
 # adding batching for brute force to reduce lines being parsed to llm at once
-BATCH_LIMIT = 50 # Number of suspicious lines to collect before calling LLM
+# batches are sized by prompt tokens now and the wait adapts to traffic (processing/batcher.py),
+# MAX_WAIT_SECONDS is only the upper bound on how long a partial batch is held
 MAX_WAIT_SECONDS = 90 # 1 1/2 mins 
+READ_CHUNK_BYTES = 16 * 1024 * 1024 # big backlogs are read and processed 16MB at a time rather than all at once
+RETRY_FAILED_SECONDS = 2 # a raw log that failed to read is tried again this often, like the old polling loop
+sanitiser_pool = None # set from --workers, None keeps everything in this process
+
+# cleaned-logs output, "ndjson" appends one event per line, "json" is the old rewrite-the-whole-array format
+CLEANED_OUTPUT_FORMAT = "ndjson"
+CLEANED_COMPRESS = False # True writes .ndjson.gz segments instead
+cleaned_writer = NDJSONWriter(dst_dir, compress=CLEANED_COMPRESS) # rolls over to a new segment every 64MB
+# LLM calls run on background threads (services/dispatcher.py) instead of sleeping 61s in the ingest loop
+LLM_MODEL = 'gemini-2.5-flash-lite'
+LLM_STREAMING = True # read the reply as it's generated, each analysis is written the moment its object closes
+LLM_RPM = 15 # requests per minute, free tier limit for the model above
+LLM_TPM = 250000 # input tokens per minute
+LLM_CONCURRENCY = 2 # batches allowed in flight at once, the buckets still cap the overall rate
+PROMPT_OVERHEAD_TOKENS = 1200 # persona + instructions + JSON template sent with every batch
+llm_dispatcher = None # started under __main__
+file_watcher = None # raw-logs watcher, set by log_watcher so dispatcher threads can wake it (release_batch)
+adaptive_batcher = AdaptiveBatcher(max_wait=MAX_WAIT_SECONDS, request_interval=60 / LLM_RPM)
 last_batch_time = time.time() # Initialise the timer
-suspicious_buffer = [] # Temporary list to hold lines
+
+# suspicious events wait for the LLM in a SQLite spool rather than a list, so a crash doesn't strand
+# them as "pending" and a burst doesn't fill RAM. Only this many batches are held in memory at once.
+SPOOL_FILE = os.path.join(current_dir, "llm_spool.db")
+MAX_QUEUED_BATCHES = 4
+CLUSTER_WINDOW = 5000 # events taken from the spool per flush and grouped by template (processing/clustering.py)
+event_spool = None # opened in main()
+
+# incident creates and AI updates go out as batched commits instead of one RPC each
+FIRESTORE_FLUSH_SIZE = 100 # writes per commit (Firestore allows up to 500)
+FIRESTORE_FLUSH_INTERVAL = 2 # seconds, background flush for anything left queued
+incident_writer = None # created in main()
+
+# LLM results keyed by normalised line + persona + model, so a repeat alert hours later is free
+ANALYSIS_CACHE_FILE = os.path.join(current_dir, "llm_cache.db")
+ANALYSIS_CACHE_TTL = 24 * 60 * 60 # seconds
+ANALYSIS_CACHE_MAX_ENTRIES = 10000 # least recently used patterns are evicted past this
+analysis_cache = None # opened in main()
 processed_files_announced = set() # stop the terminal spam for processed logs check
 
 TRACKING_FILE = os.path.join(current_dir, "log_progress.json") # file tracking path
@@ -130,24 +99,11 @@ def save_file_progress(progress_data):
     with open(TRACKING_FILE, 'w') as f:
         json.dump(progress_data, f)
 
-def is_suspicious(line):
-    line_lower = line.lower()
-    # If any suspicious word is in the line, the LLM will look at it
-    return any(keyword in line_lower for keyword in SUSPICIOUS_KEYWORDS)
-
-def is_noise(line):
-    line_lower = line.lower()
-    return any(pattern in line_lower for pattern in KNOWN_SAFE_PATTERNS) # filters out unsuspicious logs
-
 def get_ai_persona():
     """Fetches the technical level setting from Firestore and returns a specific system prompt."""
     try:
-        # Fetch the config document in the React Settings page
-        doc = db.collection("settings").document("global_config").get()
-        if doc.exists:
-            level = doc.to_dict().get("tech_level", "business_owner")
-        else:
-            level = "business_owner"
+        # The config document from the React Settings page, held in RAM by a snapshot listener
+        level = settings_cache.tech_level()
     except Exception as e:
         print(f"Warning: Could not fetch settings ({e}). Defaulting to Business Owner.")
         level = "business_owner"
@@ -178,47 +134,53 @@ def get_ai_persona():
     
     return prompts.get(level, prompts["business_owner"])
 
-def process_batch(batch_list):
-    global last_batch_time
+def analyse_batch(batch_list):
+    """Runs on a dispatcher thread. Sends one batch to Gemini and applies each result as it streams in.
 
-    # takes plantext data, snesds to llm as a group to save credits, then updates firestore
-    print(f"\n--- [ACTION] BATCH OF {len(batch_list)} READY FOR LLM ---")
+    Returns the results that were applied. API errors are raised rather than printed so the
+    dispatcher can retry 429s, a retry only asks again for the items that didn't get a result.
+    """
+    todo = [item for item in batch_list if "ai_result" not in item]
+    if not todo:
+        return []
 
-    # Group the cleaned logs from memory
-    combined_text = "\n".join([f"ID {item['event_id']}: {item['raw_sanitised_text']}" for item in batch_list])
+    # Group the cleaned logs from memory, one line per cluster with how often it repeated
+    combined_text = "\n".join([
+        f"ID {item['event_id']}: {item['raw_sanitised_text']}" +
+        (f" [repeated {item['occurrence_count']} times]" if item.get("occurrence_count", 1) > 1 else "")
+        for item in todo
+    ])
 
     persona_instruction = get_ai_persona() 
     print(f"AI Persona Loaded: {persona_instruction[:50]}...") # Print first 50 chars to confirm
 
-    try: 
-
-        print("Waiting 60 seconds for API rate limits...")
-        time.sleep(61)
-
-        response = client.models.generate_content(
-            model='gemini-2.5-flash-lite',
-            config=GenerateContentConfig(
-                safety_settings=[
-                    SafetySetting(
-                        category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
-                        threshold=HarmBlockThreshold.BLOCK_NONE,
-                    ),
-                    SafetySetting(
-                        category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
-                        threshold=HarmBlockThreshold.BLOCK_NONE,
-                    ),
-                    SafetySetting(
-                        category=HarmCategory.HARM_CATEGORY_HARASSMENT,
-                        threshold=HarmBlockThreshold.BLOCK_NONE,
-                    ),
-                    SafetySetting(
-                        category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
-                        threshold=HarmBlockThreshold.BLOCK_NONE,
-                    ),
-                ],
-                response_mime_type="application/json"
-            ),
-            contents=f"""
+    # no fixed sleep here any more, the dispatcher's token buckets keep us under the RPM/TPM limits
+    call_started = time.time()
+    generate = client.models.generate_content_stream if LLM_STREAMING else client.models.generate_content
+    response = generate(
+        model=LLM_MODEL,
+        config=GenerateContentConfig(
+            safety_settings=[
+                SafetySetting(
+                    category=HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT,
+                    threshold=HarmBlockThreshold.BLOCK_NONE,
+                ),
+                SafetySetting(
+                    category=HarmCategory.HARM_CATEGORY_HATE_SPEECH,
+                    threshold=HarmBlockThreshold.BLOCK_NONE,
+                ),
+                SafetySetting(
+                    category=HarmCategory.HARM_CATEGORY_HARASSMENT,
+                    threshold=HarmBlockThreshold.BLOCK_NONE,
+                ),
+                SafetySetting(
+                    category=HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT,
+                    threshold=HarmBlockThreshold.BLOCK_NONE,
+                ),
+            ],
+            response_mime_type="application/json"
+        ),
+        contents=f"""
             
 
             {persona_instruction}
@@ -260,166 +222,251 @@ def process_batch(batch_list):
                     }}
                 }}
             ]
-            """
-        )
-
-        # print (response)    
-        raw_text = response.text.replace("```json", "").replace("```", "").strip()
-        ai_results = json.loads(raw_text)
+        """
+    )
+
+    # each object is applied the moment it's complete, a broken one only loses that one event
+    # (it stays in the spool and goes in a later batch) instead of the whole reply
+    parser = JSONObjectStream()
+    items_by_id = {item["event_id"]: item for item in todo}
+    applied = []
+    for chunk in (response if LLM_STREAMING else [response]):
+        for res in parser.feed(chunk.text or ""):
+            item = items_by_id.pop(res.get("event_id"), None) if isinstance(res, dict) else None
+            if item is None:
+                parser.malformed += 1 # unknown, duplicate or missing event_id
+                continue
+            apply_result(item, res)
+            # remember each pattern's analysis for the next time it turns up (services/analysis_cache.py)
+            analysis_cache.put(cache_key(item["raw_sanitised_text"], persona_instruction, LLM_MODEL), res)
+            applied.append(res)
+    parser.close()
+
+    adaptive_batcher.observe_latency(time.time() - call_started) # feeds the wait window
+    if parser.malformed or items_by_id:
+        print(f"LLM reply: {len(applied)} of {len(todo)} analyses usable, {parser.malformed} malformed, "
+              f"{len(items_by_id)} events will be re-queued.")
+        for error, snippet in parser.errors[:3]:
+            print(f"  {error}: {snippet[:80]}")
+    return applied
+
+def apply_result(item, res):
+    """Writes one analysis to the item's incident doc (and every repeat in its cluster)."""
+    risk = res.get("risk_assessment", {}).get("score", 1)
+    summary = res.get("analysis", {}).get("incident_overview", "No summary provided.")
+
+    raw_steps = res.get("mitigation_plan", [])
+    formatted_steps = [
+        f"Step {step.get('step_number', '?')}: {step.get('action_title', 'Action')} - {step.get('detailed_instructions', '')}" 
+        for step in raw_steps
+    ]
 
+    # Provide a fallback if the LLM hallucinated an empty list
+    if not formatted_steps:
+        formatted_steps = ["Review logs manually"]
+        
+    # Encrypt the INDIVIDUAL insight
+    encrypted_insights = encrypt_payload({
+        "summary": summary,
+        "mitigation_steps": formatted_steps, 
+        "risk_score": risk
+    })
+
+    # item is a cluster representative, every repeat of the same pattern gets its analysis
+    members = item.get("cluster_members", [item])
+    for member in members:
+        incident_writer.update(member["doc_id"], {
+            "ai_insights": [encrypted_insights], # Save as a list for frontend
+            "risk_score": risk, # Store plain for analytics
+            "analysis_status": "AI_Analysis_Complete",
+            "occurrence_count": len(members), # how many times this pattern was seen in the window
+            "cluster_id": item["event_id"] # the event the analysis was done for
+        })
+    if len(members) > 1:
+        summary = f"{summary} (seen {len(members)} times)" # for the email only
+
+    # queued on the item for the batch's consolidated email
+    item["ai_result"] = {"event_id": item["event_id"], "risk_score": risk, "summary": summary}
+
+def apply_analysis(batch_list, ai_results):
+    """Runs on a dispatcher thread once a batch comes back. Commits the updates and emails users.
+
+    Streamed results were already applied by analyse_batch, cached ones are applied here. Items
+    that never got a result go back to the spool on their own, the rest of the batch is done.
+    """
+    try:
         # Map results by event_id for easy lookup
-        results_map = {res['event_id']: res for res in ai_results}
+        results_map = {res.get('event_id'): res for res in ai_results if isinstance(res, dict)}
+        for item in batch_list:
+            if "ai_result" not in item and item.get("event_id") in results_map and item.get("doc_id"):
+                apply_result(item, results_map[item["event_id"]])
 
-        # Fetch users once per batch to save resources
-        users = list(db.collection("users").stream())
+        done = [item for item in batch_list if "ai_result" in item]
+        missing = [item for item in batch_list if "ai_result" not in item]
 
-        user_notification_batches = {}
+        # Users come from the RAM cache, kept up to date by a snapshot listener (0 reads per batch)
+        users = settings_cache.get_users()
 
-        # Update Firestore individually for each item in the batch
-        for item in batch_list:
-            doc_id = item.get("doc_id")
-            event_id = item.get("event_id")
-            
-            if event_id in results_map and doc_id:
-                res = results_map[event_id]
-                risk = res.get("risk_assessment", {}).get("score", 1)
-                summary = res.get("analysis", {}).get("incident_overview", "No summary provided.")
-
-                raw_steps = res.get("mitigation_plan", [])
-                formatted_steps = [
-                    f"Step {step.get('step_number', '?')}: {step.get('action_title', 'Action')} - {step.get('detailed_instructions', '')}" 
-                    for step in raw_steps
-                ]
-
-                # Provide a fallback if the LLM hallucinated an empty list
-                if not formatted_steps:
-                    formatted_steps = ["Review logs manually"]
-                    
-                # Encrypt the INDIVIDUAL insight
-                encrypted_insights = encrypt_payload({
-                    "summary": summary,
-                    "mitigation_steps": formatted_steps, 
-                    "risk_score": risk
-                })
-
-                db.collection("incidents").document(doc_id).update({
-                    "ai_insights": [encrypted_insights], # Save as a list for frontend
-                    "risk_score": risk, # Store plain for analytics
-                    "analysis_status": "AI_Analysis_Complete"
-                })
-
-               # Trigger Notifications for this specific incident
-                for user_doc in users:
-                    user_data = user_doc.to_dict()
-                    target_email = user_data.get("email")
-                    pref = user_data.get("notification_level", "critical")
+        user_notification_batches = {}
+        for item in done:
+            incident = item["ai_result"]
+            risk = incident["risk_score"]
+
+           # Trigger Notifications for this specific incident
+            for user_data in users:
+                target_email = user_data.get("email")
+                pref = user_data.get("notification_level", "critical")
+                
+                # Logic to decide if email is seent
+                should_notify = (
+                    (pref == "all") or 
+                    (pref == "high" and risk >= 6) or 
+                    (pref == "critical" and risk >= 8)
+                )
+
+                if should_notify and target_email:
+                    if target_email not in user_notification_batches:
+                        user_notification_batches[target_email] = []
                     
-                    # Logic to decide if email is seent
-                    should_notify = (
-                        (pref == "all") or 
-                        (pref == "high" and risk >= 6) or 
-                        (pref == "critical" and risk >= 8)
-                    )
-
-                    if should_notify and target_email:
-                        if target_email not in user_notification_batches:
-                            user_notification_batches[target_email] = []
-                        
-                        # Add this incident to the user's specific batch
-                        user_notification_batches[target_email].append({
-                            "event_id": event_id,
-                            "risk_score": risk,
-                            "summary": summary
-                        })
+                    # Add this incident to the user's specific batch
+                    user_notification_batches[target_email].append(incident)
                         
+        # One commit for whatever is still queued, raises (and the batch is retried) if it fails
+        incident_writer.flush()
+
         # After processing ALL incidents in the batch, send one email per user
         for email, incident_list in user_notification_batches.items():
             send_consolidated_email(email, incident_list)
 
         print("Success: Batch processed and notifications sent.")
+        event_spool.ack(spool_seqs(done)) # done, the events can leave the spool
+        adaptive_batcher.record_analysed([member["spool_queued_at"] for item in done
+                                          for member in item.get("cluster_members", [item]) if "spool_queued_at" in member])
+        if missing:
+            release_batch(missing) # no usable result, retried in a later batch
 
     except Exception as e:
-        # If rate limit hit...
-        if "429" in str(e):
-            print("RATE LIMIT HIT: The script is moving too fast for the Gemini Free Tier.")
-            print("Action: Increase BATCH_LIMIT or wait 60 seconds before running again.")
-        elif "404" in str(e):
-            print("MODEL NOT FOUND.")
+        print(f"Error applying LLM results: {e}")
+        release_batch(batch_list)
+
+    log_dispatcher_metrics()
+
+def on_batch_error(batch_list, e):
+    """Called by the dispatcher when a batch fails for good (429s are only here once retries run out)."""
+    if is_rate_limited(e):
+        print("RATE LIMIT HIT: The script is moving too fast for the Gemini Free Tier.")
+        print("Action: Lower LLM_RPM/LLM_TPM or raise MAX_PROMPT_TOKENS in processing/batcher.py.")
+    elif "404" in str(e):
+        print("MODEL NOT FOUND.")
+    else:
+        print(f"LLM Error: {e}")
+    if any("ai_result" in item for item in batch_list):
+        apply_analysis(batch_list, []) # keeps what streamed in before the error, only the rest is re-queued
+    else:
+        release_batch(batch_list)
+
+def spool_seqs(batch_list):
+    """Spool entries behind a batch, including every member of each cluster."""
+    return [member["spool_seq"] for item in batch_list for member in item.get("cluster_members", [item]) if "spool_seq" in member]
+
+def release_batch(batch_list):
+    """Puts a failed batch back in the spool so it is retried with the next flush.
+
+    Runs on a dispatcher thread, so it wakes log_watcher, which may be blocked with no timeout
+    because everything was claimed when it went to sleep. Events that have failed MAX_ATTEMPTS times go to the spool's dead letter table and their
+    incidents are marked AI_Analysis_Failed, run with --retry-failed to send them again.
+    """
+    dead = event_spool.release(spool_seqs(batch_list))
+    if dead:
+        print(f"Gave up on {len(dead)} events after {MAX_ATTEMPTS} failed attempts, marking their incidents as failed.")
+        set_analysis_status(dead, "AI_Analysis_Failed")
+    if file_watcher is not None:
+        file_watcher.wake() # the released events need a new batch timeout
+
+def set_analysis_status(events, status):
+    """Queues an analysis_status update for each spooled event's incident."""
+    try:
+        for event in events:
+            if event.get("doc_id"):
+                incident_writer.update(event["doc_id"], {"analysis_status": status})
+    except Exception as e:
+        # the events are safe in the spool either way, only the dashboard status is behind
+        print(f"Could not update analysis status to {status}: {e}")
+
+def log_dispatcher_metrics():
+    """One line summary of the LLM queue, printed after each batch."""
+    m = llm_dispatcher.metrics()
+    c = analysis_cache.metrics()
+    print(f"[CACHE] hits {c['hits']}, misses {c['misses']}, hit rate {c['hit_rate']:.0%}, entries {c['size']}, evicted {c['evicted']}, expired {c['expired']}")
+    print(f"[LLM] spooled {event_spool.pending_count()}, queue depth {m['queue_depth']}, in flight {m['in_flight']}, done {m['completed']}, "
+          f"failed {m['failed']}, 429s {m['rate_limited']}, wait avg {m['avg_wait_seconds']:.1f}s max {m['max_wait_seconds']:.1f}s")
+    b = adaptive_batcher.metrics()
+    print(f"[BATCH] time to analysis p50 {b['p50_seconds']:.1f}s p99 {b['p99_seconds']:.1f}s ({b['samples']} events), "
+          f"arrivals {b['token_rate']:.0f} tokens/s, LLM latency {b['llm_latency']:.1f}s")
+
+def estimate_tokens(batch_list):
+    """Rough prompt size for the TPM bucket, ~4 chars per token plus the fixed instructions."""
+    return PROMPT_OVERHEAD_TOKENS + sum(len(item["raw_sanitised_text"]) + 16 for item in batch_list) // 4
+
+def flush_spool(force=False):
+    """Moves full batches from the spool to the dispatcher while it has room, force also sends a partial one."""
+    while event_spool.pending_count() > 0 and (force or adaptive_batcher.is_full(event_spool.pending_count())):
+        if llm_dispatcher.metrics()["queue_depth"] >= MAX_QUEUED_BATCHES:
+            return # backpressure, the rest waits on disk until the dispatcher catches up
+        # pull a window of events and collapse repeats, each distinct pattern takes one slot in a batch
+        representatives = cluster_events(event_spool.take_batch(CLUSTER_WINDOW))
+        for batch in adaptive_batcher.pack(representatives): # as many as fit the prompt token budget
+            process_batch(batch)
+
+def process_batch(batch_list):
+    """Hands a batch to the background dispatcher and returns straight away so ingestion carries on."""
+    global last_batch_time
+
+    # takes plantext data, snesds to llm as a group to save credits, then updates firestore
+    events = sum(item.get("occurrence_count", 1) for item in batch_list)
+    print(f"\n--- [ACTION] BATCH OF {len(batch_list)} PATTERNS ({events} EVENTS) QUEUED FOR LLM ---")
+
+    # patterns already analysed under the same persona and model skip the API entirely
+    persona_instruction = get_ai_persona()
+    hits, cached_results, misses = [], [], []
+    for item in batch_list:
+        cached = analysis_cache.get(cache_key(item["raw_sanitised_text"], persona_instruction, LLM_MODEL))
+        if cached is None:
+            misses.append(item)
         else:
-            print(f"LLM Error: {e}")
+            hits.append(item)
+            cached_results.append({**cached, "event_id": item["event_id"]})
+
+    if hits:
+        print(f"Analysis cache: {len(hits)} of {len(batch_list)} patterns already analysed, applying without an API call.")
+        llm_dispatcher.submit_result(hits, cached_results)
+    if misses:
+        llm_dispatcher.submit(misses, tokens=estimate_tokens(misses))
 
     # Timer Reset whenever a batch is processed
     last_batch_time = time.time()
-    print("Batch processed and timer reset.")
+    print("Batch queued and timer reset.")
 
-def log_sanitiser(new_lines, file_name_only):
+def log_sanitiser(new_lines, file_name_only, source=None):
+    """source is (inode, offset) of the chunk in the raw log. Doc IDs are derived from it, so if the
+    chunk is read again (a failed flush leaves the bookmark where it was) its incidents are
+    overwritten rather than created twice. Without it every incident gets a fresh ID."""
     processed_events = []
-    global suspicious_buffer
+    suspicious_events = []
+    suspicious_doc_ids = [] # same order as suspicious_events
     
     print(f"Processing {len(new_lines)} new lines from {file_name_only}...")
 
-    for line in new_lines: #extract each line of the log file individually
-
-        try:
-            # Parse the line as JSON (for Winlogbeat .ndjson files)
-            log_data = json.loads(line)
-
-            # Extract Winlogbeat Event ID (if it exists)
-            event_id_val = str(log_data.get("winlog", {}).get("event_id", ""))
-            
-            # Extract the human-readable message 
-            # If 'message' isn't there, dump the 'winlog' object to a string
-            raw_message = log_data.get("message", "")
-            if not raw_message:
-                raw_message = json.dumps(log_data.get("winlog", log_data))
-
-            # Combine them: If it's a Windows log, make sure the ID is visible to the scanner
-            if event_id_val:
-                text_to_analyze = f"EventID {event_id_val}: {raw_message}"
-            else:
-                # For any other JSON logs that aren't Windows
-                text_to_analyze = raw_message
-                
-        except json.JSONDecodeError:
-            # If it fails (because it's an old plain text or .ids or .log file), just use the line directly
-            text_to_analyze = line
-
-        if not line.strip(): continue # skips any lines that are empty
-        if "CRON" in text_to_analyze and "CMD" in text_to_analyze: continue # Bins the pointless background traffic to save llm credits
-        if is_noise(text_to_analyze): continue # Ignore 
+    # parse, drop noise and sanitise the whole chunk up front (see processing/pipeline.py)
+    if sanitiser_pool is not None:
+        prepared = sanitiser_pool.prepare(new_lines) # merged back in file order
+    else:
+        prepared = prepare_lines(new_lines)
 
-        suspicious_flag = is_suspicious(text_to_analyze)
+    for line_number, (threat_categories, sanitised_line, macs, internal_ips, external_ips) in enumerate(prepared):
+        suspicious_flag = len(threat_categories) > 0
         analysis_status = "pending" if suspicious_flag else "ignored_low_risk"
 
-        #sanitisation
-        # remove mac address entirely for same reason as ip
-        macs = re.findall(pattern_mac, text_to_analyze) # find and store before redacting the text, same as ips
-        sanitised_line = re.sub(pattern_mac, "[MAC_REDACTED]", text_to_analyze) # repalce all mac oocurances with redacted text
-        # New System-Level Sanitisation
-        sanitised_line = re.sub(pattern_email, "[EMAIL_REDACTED]", sanitised_line)
-        sanitised_line = re.sub(pattern_win_user_path, "[WINDOWS_USER_DIR]", sanitised_line)
-        sanitised_line = re.sub(pattern_passwords, "[PASSWORD_REDACTED]", sanitised_line)
-
-        # Extract both IPv4 and IPv6 addresses
-        ips_v4 = re.findall(pattern_ip, sanitised_line)
-        ips_v6 = re.findall(pattern_ipv6, sanitised_line)
-
-        # Use a set to get unique IPs, then sort them to ensure consistentcy 
-        # and combine both ips into a single unique list
-        unique_ips = sorted(list(set(ips_v4 + ips_v6)))
-        # Define all internal prefixes (both v4 and v6)
-        internal_prefixes = ("192.168.", "10.", "172.", "fc", "fd", "fe80", "::1", "127.0.0.1")
-        # Separate into internal and external lists by checking the prefix
-        internal_ips = [ip for ip in unique_ips if ip.lower().startswith(internal_prefixes)]
-        external_ips = [ip for ip in unique_ips if ip not in internal_ips]
-
-        # External IPs now starting from 0
-        for i, ip in enumerate(external_ips):
-            sanitised_line = sanitised_line.replace(ip, f"[EXTERNAL_IP_{i}]")
-        # Internal IPs now starting from 0 (seperate to external ips)
-        for i, ip in enumerate(internal_ips):
-            sanitised_line = sanitised_line.replace(ip, f"[INTERNAL_IP_{i}]")
-
         #create dictionary for log entry 
         event = {
             "event_id": str(uuid.uuid4())[:8], # generate unique id for every log entry
@@ -430,162 +477,291 @@ def log_sanitiser(new_lines, file_name_only):
                 "original_internal_ips": internal_ips, # seperate list for easier detection for SOC / SME
                 "original_external_ips": external_ips,
                 "original_macs" : macs, # now stores the orginal mac addressess
-                "ip_count": len(unique_ips) # number of ips
+                "ip_count": len(internal_ips) + len(external_ips) # number of ips
             },
             "original_filename": file_name_only, # find the original file that it came from for future reference
             "analysis_status": analysis_status, # filtered ready for LLm later
-            "is_suspicious": suspicious_flag # flags any suspicious threats that may be worth parsing to llm
+            "is_suspicious": suspicious_flag, # flags any suspicious threats that may be worth parsing to llm
+            "threat_categories": threat_categories # which ThreatDictionary lists matched (WEB_ATTACKS, RECON etc)
         }
 
 
 
         # batching logic
         if event["is_suspicious"]:
+            # Doc ID is generated locally, so no waiting on a round trip per line
+            if source is not None:
+                suspicious_doc_ids.append(stable_doc_id(file_name_only, *source, line_number))
+            else:
+                suspicious_doc_ids.append(incident_writer.new_doc_id())
+            suspicious_events.append(event)
+        
+        # everything (inlucding unsuspicious data) appended to processed_events so LOCAL JSON 
+        # files remain a complete record of the whole log file
+        processed_events.append(event)
 
-            #encrypt files 
-            encrypted_token = encrypt_payload(event) 
-
+    if suspicious_events:
+        # encrypt the whole chunk's incidents in one go, before doc_id is added to the events
+        for event, actual_doc_id, encrypted_token in zip(suspicious_events, suspicious_doc_ids, encrypt_many(suspicious_events)):
             # Firestore needs to recieve a dictionary { "key": "value" }
             encrypted_payload = {
                 "data": encrypted_token,
                 "is_encrypted": True,
                 "timestamp": firestore.SERVER_TIMESTAMP # used for sorting
             }
+            incident_writer.create(actual_doc_id, encrypted_payload) # Push to Firestore (batched)
 
-            # Push to Firestore
-            doc_ref = db.collection("incidents").add(encrypted_payload) 
-            
             # Add doc ID for later LLM updates
-            actual_doc_id = doc_ref[1].id
             event['doc_id'] = actual_doc_id # The Firestore UUID (e.g., "zX9yP...")
-            
-            # Add to the buffer for batching
-            suspicious_buffer.append(event)
 
-            # Trigger batch if limit reached
-            if len(suspicious_buffer) >= BATCH_LIMIT:
-                process_batch(suspicious_buffer) # send to LLM 
-                suspicious_buffer = [] # clear the buffer back to empty
-        
-        # everything (inlucding unsuspicious data) appended to processed_events so LOCAL JSON 
-        # files remain a complete record of the whole log file
-        processed_events.append(event)
+        # commit the incidents before they can reach the LLM, its results update these docs.
+        # If this raises, check_file leaves the bookmark alone and the chunk is read again, the
+        # same doc IDs overwrite whatever the writer's timer commits in the meantime.
+        incident_writer.flush()
+
+        # Add to the spool for batching
+        event_spool.push_many(suspicious_events)
+        adaptive_batcher.observe_arrivals(suspicious_events)
+
+        # critical signatures don't wait for the batch to fill
+        urgent = sum(1 for e in suspicious_events if is_high_priority(e["raw_sanitised_text"]))
+        if urgent:
+            print(f"--- [PRIORITY] {urgent} high priority events, sending without waiting ---")
+            flush_spool(force=True)
+        else:
+            flush_spool() # send to LLM if a batch worth of tokens is waiting
+
+    if CLEANED_OUTPUT_FORMAT == "ndjson":
+        # append-only, each call only writes its own new events (see processing/ndjson.py)
+        cleaned_writer.append(file_name_only, processed_events)
+    else:
+        # Note: We now APPEND to the JSON file if it exists, rather than overwriting
+        # This keeps the local JSON record complete
+        dst_path = os.path.join(dst_dir, legacy_json_name(file_name_only))
+
+        existing_data = []
+        if os.path.exists(dst_path):
+            try:
+                with open(dst_path, "r") as f:
+                    existing_data = json.load(f)
+            except:
+                pass
+
+        existing_data.extend(processed_events)
+
+        with open(dst_path, "w") as f:
+            json.dump(existing_data, f, indent=4, default=str)
 
-    # Note: We now APPEND to the JSON file if it exists, rather than overwriting
-    # This keeps the local JSON record complete
-    output_filename = file_name_only.replace(".log", ".json").replace(".ids", ".json")
-    dst_path = os.path.join(dst_dir, output_filename)
-    
-    existing_data = []
-    if os.path.exists(dst_path):
-        try:
-            with open(dst_path, "r") as f:
-                existing_data = json.load(f)
-        except:
-            pass
-    
-    existing_data.extend(processed_events)
-    
-    with open(dst_path, "w") as f:
-        json.dump(existing_data, f, indent=4, default=str)
-        
     print(f"Success: Sanitised {len(processed_events)} lines from {file_name_only}.")
     return processed_events
 
+def read_new_lines(f, max_bytes=READ_CHUNK_BYTES):
+    """Reads whole lines from the current position until roughly max_bytes have been read."""
+    # readline rather than readlines(hint) because a text file won't tell() after the latter
+    lines = []
+    size = 0
+    while size < max_bytes:
+        line = f.readline()
+        if not line:
+            break
+        lines.append(line)
+        size += len(line)
+    return lines
+
+def progress_entry(file_progress, file):
+    """Returns (offset, inode) for a file. Older progress files only stored the offset."""
+    entry = file_progress.get(file, 0)
+    if isinstance(entry, dict):
+        return entry.get("offset", 0), entry.get("inode")
+    return entry, None
+
+def check_file(file, file_progress):
+    """Reads and processes any new lines in one raw log. Returns False if it couldn't be read and
+    should be tried again (log_watcher retries it even if nothing is written to it)."""
+    name, ext = os.path.splitext(file) # .split text to split the file as a more efficient way
+    if ext not in acc_ext and not file.endswith(".ids"):
+        return True
+
+    src_path = os.path.join(src_dir, file)
+
+    # stat once, gives the size and the inode used to spot rotation
+    try:
+        stat = os.stat(src_path)
+    except FileNotFoundError:
+        return True # deleted, nothing left to read
+    except OSError:
+        return False # File might be locked
+
+    # Check if the  file was processed this in the past
+    if file not in file_progress:
+        # Construct the path where the JSON would be
+        dst_json_path = os.path.join(dst_dir, legacy_json_name(file))
+
+        if os.path.exists(dst_json_path) or segment_paths(dst_dir, output_base(file)):
+            # We have seen this file before the update!
+            # Bookmark it at the CURRENT size so we skip everything inside it
+            # and only wait for NEW lines.
+            file_progress[file] = {"offset": stat.st_size, "inode": stat.st_ino}
+            save_file_progress(file_progress)
+            print(f"Skipping previously processed file: {file} (Bookmarked at {stat.st_size})")
+            return True
+
+    # Get the last known position (default to 0 if new file)
+    last_pos, last_inode = progress_entry(file_progress, file)
+
+    # A different inode under the same name means the log was rotated (moved away and a new file
+    # created), so start the new file from the top even if it's already bigger than the old offset.
+    # copytruncate style rotation keeps the inode, the shrink check still catches that.
+    if (last_inode is not None and stat.st_ino != last_inode) or stat.st_size < last_pos:
+        print(f"{file} was rotated or truncated, reading from the start.")
+        last_pos = 0
+
+    # If there is NEW data (current size > last position)
+    if stat.st_size <= last_pos:
+        if last_inode is None: # upgrade an old offset-only bookmark
+            file_progress[file] = {"offset": last_pos, "inode": stat.st_ino}
+            save_file_progress(file_progress)
+        return True
+
+    try:
+        with open(src_path, "r", encoding="utf-8", errors="replace") as f:
+            f.seek(last_pos) # JUMP to where we left off
+
+            # a big backlog goes through in chunks, bookmarking after each one so a
+            # restart picks up from the last finished chunk instead of the beginning
+            while True:
+                chunk_start = f.tell()
+                new_lines = read_new_lines(f)
+                if not new_lines:
+                    break
+
+                # Process ONLY the new lines, doc IDs come from the inode and offset so a retry overwrites
+                log_sanitiser(new_lines, file, source=(os.fstat(f.fileno()).st_ino, chunk_start))
+
+                # Update "bookmark", fstat so the inode is the one actually read
+                file_progress[file] = {"offset": f.tell(), "inode": os.fstat(f.fileno()).st_ino}
+                save_file_progress(file_progress)
+
+    except Exception as e:
+        print(f"Error reading {file}: {e}, retrying in {RETRY_FAILED_SECONDS}s")
+        return False
+
+    return True
+
 # checks the directory for log files
 def log_watcher():
-    global suspicious_buffer, last_batch_time
+    global last_batch_time
 
     # Load where file reading was left off last time
     file_progress = get_file_progress()
 
     if not os.path.exists(src_dir) or not os.path.exists(dst_dir): # more efficient way to check the dirs exist using .exists instead
         sys.exit("Error: Directories missing.")
-            
-    print(f"Monitoring {src_dir} for changes...")
-
-    while True: # The script now runs continuously
-        # Get all files in the source folder
-        all_files = os.listdir(src_dir)
-        new_data_found = False
-
-        for file in all_files:
-            name, ext = os.path.splitext(file) # .split text to split the file as a more efficient way
-            if ext not in acc_ext and not file.endswith(".ids"): 
-                continue
 
-            src_path = os.path.join(src_dir, file)
-            
-            # Check if the  file was processed this in the past
-            if file not in file_progress:
-                # Construct the path where the JSON would be
-                output_filename = file.replace(".log", ".json").replace(".ids", ".json")
-                if not output_filename.endswith(".json"): output_filename += ".json"
-                dst_json_path = os.path.join(dst_dir, output_filename)
-
-                if os.path.exists(dst_json_path):
-                    # We have seen this file before the update!
-                    # Bookmark it at the CURRENT size so we skip everything inside it
-                    # and only wait for NEW lines.
-                    try:
-                        current_size = os.path.getsize(src_path)
-                        file_progress[file] = current_size
-                        save_file_progress(file_progress)
-                        print(f"Skipping previously processed file: {file} (Bookmarked at {current_size})")
-                        continue
-                    except OSError:
-                        pass
-
-            # Get current file size
-            try:
-                current_size = os.path.getsize(src_path)
-            except OSError:
-                continue # File might be locked or deleted
-
-            # Get the last known position (default to 0 if new file)
-            last_pos = file_progress.get(file, 0)
-
-            # If the file is smaller than before, it was likely truncated/rotated. Reset to 0.
-            if current_size < last_pos:
-                last_pos = 0
-
-            # If there is NEW data (current size > last position)
-            if current_size > last_pos:
-                try:
-                    with open(src_path, "r", encoding="utf-8", errors="replace") as f:
-                        f.seek(last_pos) # JUMP to where we left off
-                        new_lines = f.readlines()
-                        
-                        if new_lines:
-                            log_sanitiser(new_lines, file) # Process ONLY the new lines
-                            new_data_found = True
-                        
-                        # Update "bookmark"
-                        file_progress[file] = f.tell() 
-                        save_file_progress(file_progress)
+    # inotify on Linux so new lines are picked up as soon as they're written, polling elsewhere
+    global file_watcher
+    watcher = file_watcher = make_watcher(src_dir)
+    print(f"Monitoring {src_dir} for changes ({watcher.kind})...")
 
-                except Exception as e:
-                    print(f"Error reading {file}: {e}")
+    changed_files = set(os.listdir(src_dir)) # first pass catches up on everything
+    failed_files = set() # couldn't be read last pass, tried again without waiting for a write
 
-        # Batch Timeout Logic
-        time_since_last_batch = time.time() - last_batch_time
-        if len(suspicious_buffer) > 0 and time_since_last_batch >= MAX_WAIT_SECONDS:
-            print(f"--- [TIMEOUT] Processing partial batch of {len(suspicious_buffer)} ---")
-            process_batch(suspicious_buffer)
-            suspicious_buffer = []
+    # events claimed by a batch that never finished last run go back in the queue
+    replayed = event_spool.recover()
+    if replayed:
+        print(f"Replaying {replayed} spooled events from the last run...")
+        flush_spool(force=True)
 
-        if not new_data_found:
-            time.sleep(2) # Poll every 2 seconds
+    try:
+        while True: # The script now runs continuously
+            failed_files = {file for file in sorted(changed_files | failed_files) if not check_file(file, file_progress)}
+
+            # Batch Timeout Logic, the window shrinks when a partial batch isn't going to fill anyway
+            time_since_last_batch = time.time() - last_batch_time
+            wait_window = adaptive_batcher.wait_window(event_spool.pending_count())
+            dispatcher_has_room = llm_dispatcher.metrics()["queue_depth"] < MAX_QUEUED_BATCHES
+            if event_spool.pending_count() > 0 and time_since_last_batch >= wait_window and dispatcher_has_room:
+                print(f"--- [TIMEOUT] Processing partial batch of {event_spool.pending_count()} ---")
+                flush_spool(force=True)
+            else:
+                flush_spool() # full batches held back by backpressure
+
+            # Sleep until something changes, but wake in time for the batch timeout
+            timeout = None
+            if event_spool.pending_count() > 0:
+                timeout = adaptive_batcher.wait_window(event_spool.pending_count()) - (time.time() - last_batch_time)
+                if adaptive_batcher.is_full(event_spool.pending_count()) or timeout <= 0:
+                    timeout = 1 # still here after a flush, so waiting on the dispatcher to make room
+            if failed_files:
+                timeout = RETRY_FAILED_SECONDS if timeout is None else min(timeout, RETRY_FAILED_SECONDS)
+            changed_files = watcher.wait(timeout)
+    finally:
+        file_watcher = None
+        watcher.close()
+
+def main():
+    global client, db, settings_cache, event_spool, incident_writer, analysis_cache, llm_dispatcher, sanitiser_pool
+    parser = argparse.ArgumentParser(description="Watches raw-logs, sanitises new lines and forwards suspicious ones for analysis.")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="processes used to sanitise large backlogs (default 0 runs everything in this process)")
+    parser.add_argument("--fake-llm", action="store_true",
+                        help="answer batches with a local fake client instead of calling Gemini (testing)")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="send events that previously failed analysis (AI_Analysis_Failed) to the LLM again")
+    args = parser.parse_args()
+
+    # Create a single client object
+    if args.fake_llm:
+        client = FakeLLMClient()
+        print("Using the fake LLM client, nothing will be sent to Gemini.")
+    else:
+        client = genai.Client(api_key=GEMINI_API_KEY)
+
+    # Initialise Firebase 
+    cred = credentials.Certificate(os.path.join(current_dir, "serviceAccountKey.json"))
+    firebase_admin.initialize_app(cred)
+    db = firestore.client()
+
+    settings_cache = SettingsCache(db).start()
+    incident_writer = IncidentWriter(db, flush_size=FIRESTORE_FLUSH_SIZE, flush_interval=FIRESTORE_FLUSH_INTERVAL)
+    incident_writer.start()
+    event_spool = EventSpool(SPOOL_FILE)
+    analysis_cache = AnalysisCache(ANALYSIS_CACHE_FILE, ttl=ANALYSIS_CACHE_TTL, max_entries=ANALYSIS_CACHE_MAX_ENTRIES)
+
+    if args.retry_failed:
+        requeued = event_spool.requeue_dead()
+        set_analysis_status(requeued, "pending")
+        print(f"Re-queued {len(requeued)} events that failed analysis.")
+    elif event_spool.dead_count():
+        print(f"{event_spool.dead_count()} events failed analysis, run with --retry-failed to send them again.")
+    llm_dispatcher = BatchDispatcher(analyse_batch, apply_analysis, on_batch_error,
+                                     rpm=LLM_RPM, tpm=LLM_TPM, concurrency=LLM_CONCURRENCY).start()
+
+    # the pool has to be started from main() so worker processes don't start their own
+    if args.workers > 0:
+        sanitiser_pool = SanitiserPool(args.workers)
+        print(f"Sanitising with {args.workers} worker processes.")
 
-if __name__ == "__main__":
     try:
         log_watcher()
     except KeyboardInterrupt:
         print("\nScript stopped manually.")
         # Final flush before the script actually stops
-        if len(suspicious_buffer) > 0:
-            print(f"--- [FINAL FLUSH] Processing {len(suspicious_buffer)} remaining logs before exit ---")
-            process_batch(suspicious_buffer)
+        if event_spool.pending_count() > 0:
+            print(f"--- [FINAL FLUSH] Processing {event_spool.pending_count()} remaining logs before exit ---")
+            flush_spool(force=True)
+        print("Waiting for queued LLM batches to finish...")
+        llm_dispatcher.stop()
+        incident_writer.close()
+        settings_cache.stop()
+        if event_spool.pending_count() > 0:
+            print(f"{event_spool.pending_count()} events left in the spool, they will be sent on the next start.")
+        event_spool.close()
+        analysis_cache.close()
+        if sanitiser_pool is not None:
+            sanitiser_pool.shutdown()
         print("Shutdown complete. Goodbye!")
         sys.exit(0)
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#batcher.py decides how much goes into each LLM batch and how long a partial batch should wait
+import re, time, threading
+from collections import deque
+
+# Snort Priority 1 rules and the Windows events that mean someone is covering tracks or persisting:
+# 1102 audit log cleared, 4740 account locked out, 7045 new service installed
+pattern_high_priority = re.compile(r"\[Priority: ?1\]|\bEventID (?:1102|4740|7045)\b")
+
+CHARS_PER_TOKEN = 4
+MAX_PROMPT_TOKENS = 30000 # log text per batch, the instructions are on top of this
+OUTPUT_TOKENS_PER_EVENT = 350 # one analysis object with a mitigation plan
+MAX_OUTPUT_TOKENS = 60000 # stay under the model's output limit, caps how many events fit in one reply
+MIN_WAIT_SECONDS = 5 # a partial batch always waits this long so a small burst goes out together
+MAX_WAIT_SECONDS = 90
+EWMA_WEIGHT = 0.2 # how fast arrival rate / latency estimates follow new observations
+TIMING_SAMPLES = 1000 # time-to-analysis samples kept for the percentiles
+
+def is_high_priority(text):
+    return pattern_high_priority.search(text) is not None
+
+def estimate_item_tokens(item):
+    """Prompt tokens one batch line costs ("ID xxxxxxxx: " + the text)."""
+    return (len(item["raw_sanitised_text"]) + 16) // CHARS_PER_TOKEN
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+class AdaptiveBatcher:
+    """Token based batch packing plus a wait window tuned from what it observes.
+
+    - pack() fills batches up to the prompt token budget (and the reply size limit) instead of a fixed line count
+    - wait_window() is how long a partial batch should wait: long enough to fill at the current arrival
+      rate, but if it wouldn't fill before max_wait anyway there's no point holding it, so it goes after min_wait.
+      Never shorter than the gap the rate limiter forces between requests or the time a call takes to come back.
+    - record_analysed() collects time-to-analysis for p50/p99
+    """
+
+    def __init__(self, max_prompt_tokens=MAX_PROMPT_TOKENS, max_items=MAX_OUTPUT_TOKENS // OUTPUT_TOKENS_PER_EVENT,
+                 min_wait=MIN_WAIT_SECONDS, max_wait=MAX_WAIT_SECONDS, request_interval=0.0, clock=time.time):
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_items = max_items
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.request_interval = request_interval # 60 / RPM
+        self.clock = clock
+
+        self.lock = threading.Lock() # arrivals come from the ingest loop, latencies from dispatcher threads
+        self.token_rate = 0.0 # EWMA of suspicious prompt tokens arriving per second
+        self.item_tokens = 0.0 # EWMA of tokens per event, turns a spool count into a token estimate
+        self.last_arrival = None
+        self.llm_latency = 0.0 # EWMA of seconds per LLM call
+        self.time_to_analysis = deque(maxlen=TIMING_SAMPLES)
+
+    def pack(self, items):
+        """Splits items into batches that each fit the token budget, keeping their order."""
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for item in items:
+            tokens = estimate_item_tokens(item)
+            if batch and (batch_tokens + tokens > self.max_prompt_tokens or len(batch) >= self.max_items):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(item)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def observe_arrivals(self, items):
+        """Feeds newly spooled suspicious events into the arrival rate estimate."""
+        if not items:
+            return
+        tokens = sum(estimate_item_tokens(item) for item in items)
+        now = self.clock()
+        with self.lock:
+            per_item = tokens / len(items)
+            self.item_tokens = per_item if self.item_tokens == 0.0 else self.item_tokens + EWMA_WEIGHT * (per_item - self.item_tokens)
+            if self.last_arrival is not None:
+                elapsed = max(now - self.last_arrival, 1e-3)
+                self.token_rate += EWMA_WEIGHT * (tokens / elapsed - self.token_rate)
+            self.last_arrival = now
+
+    def observe_latency(self, seconds):
+        with self.lock:
+            if self.llm_latency == 0.0:
+                self.llm_latency = seconds
+            else:
+                self.llm_latency += EWMA_WEIGHT * (seconds - self.llm_latency)
+
+    def pending_tokens(self, pending_events):
+        with self.lock:
+            return pending_events * self.item_tokens
+
+    def is_full(self, pending_events):
+        """True once the waiting events would fill a whole batch (before clustering shrinks them)."""
+        return pending_events >= self.max_items or self.pending_tokens(pending_events) >= self.max_prompt_tokens
+
+    def wait_window(self, pending_events=0):
+        """Seconds a partial batch of pending_events should wait for more before being sent."""
+        pending_tokens = self.pending_tokens(pending_events)
+        with self.lock:
+            token_rate = self.token_rate
+            # quiet for longer than the last gap means the real rate is lower than the estimate
+            if self.last_arrival is not None:
+                idle = self.clock() - self.last_arrival
+                if idle > 0 and token_rate * idle > self.max_prompt_tokens:
+                    token_rate = self.max_prompt_tokens / idle
+            floor = max(self.min_wait, self.request_interval, self.llm_latency)
+
+        remaining = max(self.max_prompt_tokens - pending_tokens, 0)
+        if token_rate <= 0:
+            return min(floor, self.max_wait) # nothing else is coming, don't hold it
+        time_to_fill = remaining / token_rate
+        if time_to_fill > self.max_wait:
+            return min(floor, self.max_wait) # it won't fill in time anyway
+        return min(max(time_to_fill, floor), self.max_wait)
+
+    def record_analysed(self, queued_times, now=None):
+        """Adds time-to-analysis samples for events queued at the given times (spool queued_at)."""
+        now = self.clock() if now is None else now
+        with self.lock:
+            self.time_to_analysis.extend(now - queued_at for queued_at in queued_times)
+
+    def metrics(self):
+        with self.lock:
+            samples = sorted(self.time_to_analysis)
+            snapshot = {
+                "token_rate": self.token_rate,
+                "llm_latency": self.llm_latency
+            }
+        snapshot["p50_seconds"] = percentile(samples, 0.50)
+        snapshot["p99_seconds"] = percentile(samples, 0.99)
+        snapshot["samples"] = len(samples)
+        return snapshot
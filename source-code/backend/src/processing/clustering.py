@@ -0,0 +1,48 @@
+#clustering.py groups near-identical suspicious lines so the LLM analyses each attack pattern once, not once per line
+import re
+
+# Each rule masks one kind of field that changes between repeats of the same event. Order matters,
+# timestamps go first so their digits aren't picked up by the port/pid rules.
+TEMPLATE_RULES = [
+    # timestamps: ISO, apache [10/Dec/2024:14:12:15 +0000], snort 03/24-10:30:05.123, syslog Dec 11 03:17:22 / Dec 03 091401
+    (re.compile(r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?"), "<TS>"),
+    (re.compile(r"\d{1,2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2}(?: [+-]\d{4})?"), "<TS>"),
+    (re.compile(r"\b\d{2}/\d{2}-\d{2}:\d{2}:\d{2}(?:\.\d+)?"), "<TS>"),
+    (re.compile(r"\b[A-Z][a-z]{2} +\d{1,2} (?:\d{2}:\d{2}:\d{2}|\d{6})\b"), "<TS>"),
+    (re.compile(r"\[\s*\d+\.\d+\]"), "[<UPTIME>]"), # kernel [8392.11]
+    # numbered redaction tokens from the sanitiser, which IP is which doesn't change the pattern
+    (re.compile(r"\[(EXTERNAL|INTERNAL)_IP_\d+\]"), r"[\1_IP]"),
+    # ephemeral ports (4-5 digits), well known ones like :22 or :80 stay as they say what was attacked
+    (re.compile(r"(?<=\]):\d{4,5}\b"), ":<PORT>"),
+    (re.compile(r"\b(port|SPT=|DPT=)( ?)\d{4,5}\b"), r"\1\2<PORT>"),
+    (re.compile(r"(?<=[A-Za-z])\[\d+\]"), "[<PID>]"), # sshd[4401]
+    (re.compile(r"(\" \d{3}) \d+\b"), r"\1 <BYTES>"), # apache status code kept, response size masked
+]
+pattern_spaces = re.compile(r"\s+")
+
+def template_key(text):
+    """The sanitised line with its variable fields masked, identical for repeats of the same event."""
+    for pattern, replacement in TEMPLATE_RULES:
+        text = pattern.sub(replacement, text)
+    return pattern_spaces.sub(" ", text).strip()
+
+def cluster_events(events):
+    """Groups events by template, keeping the order each template was first seen.
+
+    Returns one representative per cluster (the first event in it), with "cluster_members" listing
+    every event in the cluster (itself included) and "occurrence_count" set.
+    """
+    clusters = {}
+    for event in events:
+        key = template_key(event["raw_sanitised_text"])
+        representative = clusters.get(key)
+        if representative is None:
+            representative = dict(event)
+            representative["template"] = key
+            representative["cluster_members"] = []
+            clusters[key] = representative
+        representative["cluster_members"].append(event)
+
+    for representative in clusters.values():
+        representative["occurrence_count"] = len(representative["cluster_members"])
+    return list(clusters.values())
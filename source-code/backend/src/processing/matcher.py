@@ -0,0 +1,154 @@
+#matcher.py used by log-forwarder to flag suspicious and noisy lines, the keyword search runs in compiled regexes
+import re
+
+NOISE_CATEGORY = "NOISE"
+
+# Define keywords for suspicious prediction
+class ThreatDictionary:
+    # 1. Web Application Attacks (SQLi, XSS, Path Traversal)
+    WEB_ATTACKS = [
+        "<script>", "alert(", "onerror=", "onload=", "eval(", "src=",  # XSS
+        "union select", "select *", "drop table", "insert into", "order by", "--", " ' or '1'='1", # SQLi
+        "../", "..\\", "etc/passwd", "windows/system32", "boot.ini", ".env", ".git", # Path Traversal / Info Leak
+        "jndi:ldap", "jndi:rmi", #Log4j exploits
+        "wp-admin", "wp-login",  # WordPress brute force/scanning
+        "whoami", "ifconfig", "ipconfig" # Command execution output
+    ]
+
+    # 2. Authentication & Account Security (Brute Force)
+    AUTH_ATTACKS = [
+        "failed password", "invalid user", "authentication failure", "unauthorized",
+        "login failed", "access denied", "bad password", "locked out", "user not found", "4625", # Windows Failed Logon
+        "maximum authentication attempts exceeded", # Linux aggressive brute force
+        "preauth", # SSH pre-authentication failures
+        "4740" # Windows: User Account Locked Out
+    ]
+
+    # 3. System & Malware Indicators (Post-Exploitation)
+    SYSTEM_ATTACKS = [
+        "rm -rf", "sudo", "chmod", "chown", "wget ", "curl ", "netcat", "nc -e", # Command Injection
+        "compromised", "unexpected service", "malicious", "backdoor", "shell",
+        "powershell", "base64", "python -c", "perl -e", # Common script execution
+        "4720", "4732", "1102", "7045", "vssadmin delete shadows",
+        "lsass.exe", "invoke-expression", # Windows specific
+        "certutil.exe -urlcache", "certutil.exe -split", # Often used by malware to download payloads
+        "schtasks /create", "bitsadmin", #  Windows persistence mechanisms
+        "disableantispyware", "reg add" # Tampering with Windows Defender/Registry
+    ]
+
+    # 4. Network Scanning & Reconnaissance (Probing)
+    RECON = [
+        "nmap", "masscan", "dirbuster", "nikto", "sqlmap", "iptables-dropped",
+        "connection refused", "port scan", "icmp", "test packet",
+        "zgrab", "nessus", "acunetix", "w3af" # Common automated vulnerability scanners
+    ]
+
+    @classmethod
+    def get_all(cls):
+        # combine everything into one massive list for initial filter
+        return cls.WEB_ATTACKS + cls.AUTH_ATTACKS + cls.SYSTEM_ATTACKS + cls.RECON
+
+    @classmethod
+    def categories(cls):
+        # same lists keyed by category name so the matcher can report which one hit
+        return {
+            "WEB_ATTACKS": cls.WEB_ATTACKS,
+            "AUTH_ATTACKS": cls.AUTH_ATTACKS,
+            "SYSTEM_ATTACKS": cls.SYSTEM_ATTACKS,
+            "RECON": cls.RECON
+        }
+
+# list of patterns that are noisy but safe
+# Expanded to aggressively filter out normal Windows and Linux background noise
+KNOWN_SAFE_PATTERNS = [
+    # Linux / Unix Noise
+    "session opened", "session closed", "systemd: started", "ntpdate",
+    "authorized_keys", "cron[", "postfix/", "dovecot:", "crond[",
+    "reached target", "pms-refresh", "status=sent (250 2.0.0 ok",
+    "starting update inventory", "connection closed by authenticating user",
+    "removed slice", "created slice", "starting session", "started session", # Systemd slice spam
+    "pam_unix(cron:session)", "dhcpack", "dhcpdiscover", # DHCP and Cron spam
+
+    # Windows Noise
+    "4624", # Windows: Successful Logon (EXTREMELY NOISY)
+    "4634", # Windows: Successful Logoff
+    "4672", # Windows: Special privileges assigned to new logon (Noisy for admin accounts)
+    "5140", # Windows: A network share object was accessed
+    "5156", # Windows: Windows Filtering Platform has allowed a connection
+    "service control manager", "system idle process",
+
+    # Web / Network Noise
+    "favicon.ico", "robots.txt", # Standard web crawler requests
+    "\"get / http/1.1\" 200", "\"get / http/1.0\" 200" # Basic successful web loads
+]
+
+def trie_pattern(keywords):
+    """Regex source matching any of the keywords, with shared prefixes factored out like a trie.
+
+    A flat "a|b|c" alternation makes the re engine try every keyword at every position, this way
+    each position only follows the branch for its next character.
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {} # a keyword ends here
+
+    def build(node):
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body # a shorter keyword already matched by here
+
+    return build(trie) if trie else "(?!)" # no keywords never matches
+
+class KeywordMatcher:
+    """Compiled re patterns over the keyword lists, so the per-character scanning happens in C.
+
+    suspicious() is the noise/suspicious decision on its own, one search for noise and one for any
+    threat keyword. classify() is what the pipeline uses, it makes the same two searches and only a
+    line with a threat goes on to find out which categories (searching from the first hit).
+    """
+
+    def __init__(self, categories: dict, noise=NOISE_CATEGORY):
+        self.names = list(categories)
+        keywords = {name: {keyword.lower() for keyword in categories[name]} for name in self.names}
+        self.patterns = {name: re.compile(trie_pattern(keywords[name])) for name in self.names}
+        self.noise = self.patterns.get(noise, re.compile("(?!)"))
+        self.threats = [(name, self.patterns[name]) for name in self.names if name != noise]
+        self.any_threat = re.compile(trie_pattern(set().union(*(keywords[name] for name, _ in self.threats))))
+        self._sets = {} # tuple of names -> frozenset, there are only a handful of combinations
+
+    def names_set(self, names):
+        found = self._sets.get(names)
+        if found is None:
+            found = self._sets[names] = frozenset(names)
+        return found
+
+    def suspicious(self, line: str):
+        """Just the filter decision: None if the line is noise, else whether any threat keyword is in it."""
+        text = line.lower()
+        if self.noise.search(text):
+            return None
+        return self.any_threat.search(text) is not None
+
+    def classify(self, line: str):
+        """None if the line is noise, otherwise the threat categories it matches (empty for neither)."""
+        text = line.lower()
+        if self.noise.search(text):
+            return None
+        first = self.any_threat.search(text)
+        if first is None:
+            return self.names_set(())
+        start = first.start() # nothing can match before the first hit
+        return self.names_set(tuple(name for name, pattern in self.threats if pattern.search(text, start)))
+
+    def scan(self, line: str) -> frozenset:
+        """Returns the names of every category with at least one keyword in the line, noise included."""
+        text = line.lower()
+        return self.names_set(tuple(name for name in self.names if self.patterns[name].search(text)))
+
+# Built once on import, used by processing/pipeline.py
+THREAT_MATCHER = KeywordMatcher({**ThreatDictionary.categories(), NOISE_CATEGORY: KNOWN_SAFE_PATTERNS})
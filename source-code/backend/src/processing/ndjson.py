@@ -0,0 +1,105 @@
+#ndjson.py keeps the cleaned-logs record as append-only NDJSON (one event per line) instead of one big JSON array
+import os, re, json, gzip
+
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024 # roll over to a new segment once the current one passes 64MB
+EXTENSION = ".ndjson"
+GZIP_EXTENSION = ".ndjson.gz"
+
+SEGMENT_DIGITS = 4 # rolled segments are numbered 0001, 0002, ...
+
+def output_base(file_name_only):
+    """Raw log name -> the base name its cleaned output is stored under (alert.fast -> alert.fast).
+
+    The whole name is kept, alert.ids, alert.fast and alert.log are three different logs.
+    """
+    return file_name_only
+
+def legacy_json_name(file_name_only):
+    """Where log_sanitiser writes (and used to write) the whole record as one JSON array."""
+    return file_name_only.replace(".log", ".json").replace(".ids", ".json")
+
+def segment_pattern(base):
+    """<base>.ndjson[.gz] for the live segment, <base>.<n>.ndjson[.gz] for rolled ones. Only a number
+    the writer zero-padded counts, so auth.2024.log's output is never taken for a segment of auth.log."""
+    return re.compile(re.escape(base) + r"(?:\.(\d{%d,}))?\.ndjson(?:\.gz)?$" % SEGMENT_DIGITS)
+
+def segment_number(path, base):
+    """The rolled segment's number, the live one has no number and sorts last."""
+    match = segment_pattern(base).match(os.path.basename(path))
+    return int(match.group(1)) if match and match.group(1) else float("inf")
+
+def segment_paths(folder, base):
+    """Every segment for a base name, oldest first."""
+    pattern = segment_pattern(base)
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if pattern.match(name)]
+    return sorted(paths, key=lambda path: segment_number(path, base))
+
+def starts_with_array(path):
+    """True for an old indented JSON array output, NDJSON lines always start with an object."""
+    with open(path, "rb") as f:
+        return f.read(1) == b"["
+
+class NDJSONWriter:
+    """Appends events to cleaned-logs/<base>.ndjson, so each batch costs O(new lines) not O(history).
+
+    compress=True writes gzip members instead (<base>.ndjson.gz), which gzip reads back as one stream.
+    """
+
+    def __init__(self, folder, compress=False, max_bytes=SEGMENT_MAX_BYTES):
+        self.folder = folder
+        self.compress = compress
+        self.max_bytes = max_bytes
+
+    def live_path(self, base):
+        return os.path.join(self.folder, base + (GZIP_EXTENSION if self.compress else EXTENSION))
+
+    def roll_over(self, base):
+        """Renames the live segment to the next number so the next append starts a fresh file."""
+        live = self.live_path(base)
+        numbers = [segment_number(path, base) for path in segment_paths(self.folder, base)]
+        next_number = max([n for n in numbers if n != float("inf")], default=0) + 1
+        extension = GZIP_EXTENSION if self.compress else EXTENSION
+        os.replace(live, os.path.join(self.folder, f"{base}.{next_number:0{SEGMENT_DIGITS}d}{extension}"))
+
+    def append(self, file_name_only, events):
+        """Writes the events as one line each to the end of the live segment. Returns its path."""
+        base = output_base(file_name_only)
+        live = self.live_path(base)
+        if os.path.exists(live) and os.path.getsize(live) >= self.max_bytes:
+            self.roll_over(base)
+
+        data = "".join(json.dumps(event, default=str) + "\n" for event in events).encode("utf-8")
+        if self.compress:
+            with gzip.open(live, "ab") as f: # each call adds a gzip member
+                f.write(data)
+        else:
+            with open(live, "ab") as f:
+                f.write(data)
+        return live
+
+def read_events(folder, file_name_only):
+    """Streams every cleaned event for a raw log back in write order, one dict at a time.
+
+    Starts with the old JSON array if there is one (written before NDJSON output),
+    then every segment. A half written last line from a crash is skipped.
+    """
+    base = output_base(file_name_only)
+    legacy_path = os.path.join(folder, legacy_json_name(file_name_only))
+    if os.path.exists(legacy_path) and starts_with_array(legacy_path):
+        try:
+            with open(legacy_path, "r") as f:
+                yield from json.load(f)
+        except (json.JSONDecodeError, OSError):
+            pass
+
+    for path in segment_paths(folder, base):
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue # truncated final line
+        except EOFError:
+            continue # gzip member cut short by a crash, everything before it was already yielded
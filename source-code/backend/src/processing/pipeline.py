@@ -0,0 +1,52 @@
+#pipeline.py turns raw log lines into sanitised, categorised records ready for log_sanitiser to store
+import json
+from processing.matcher import THREAT_MATCHER
+from processing.sanitiser import sanitise_line
+
+def extract_text(line):
+    """Returns the text to scan for a raw line, pulling the message out of Winlogbeat JSON."""
+    try:
+        # Parse the line as JSON (for Winlogbeat .ndjson files)
+        log_data = json.loads(line)
+
+        # Extract Winlogbeat Event ID (if it exists)
+        event_id_val = str(log_data.get("winlog", {}).get("event_id", ""))
+
+        # Extract the human-readable message
+        # If 'message' isn't there, dump the 'winlog' object to a string
+        raw_message = log_data.get("message", "")
+        if not raw_message:
+            raw_message = json.dumps(log_data.get("winlog", log_data))
+
+        # Combine them: If it's a Windows log, make sure the ID is visible to the scanner
+        if event_id_val:
+            return f"EventID {event_id_val}: {raw_message}"
+        # For any other JSON logs that aren't Windows
+        return raw_message
+
+    except json.JSONDecodeError:
+        # If it fails (because it's an old plain text or .ids or .log file), just use the line directly
+        return line
+
+def screen_lines(new_lines):
+    """Drops empty, cron and noisy lines. Returns (text, threat_categories) for the rest."""
+    kept = []
+    for line in new_lines: #extract each line of the log file individually
+        text_to_analyze = extract_text(line)
+
+        if not line.strip(): continue # skips any lines that are empty
+        if "CRON" in text_to_analyze and "CMD" in text_to_analyze: continue # Bins the pointless background traffic to save llm credits
+
+        # noise check first, then which threat categories hit (None means noise)
+        matched_categories = THREAT_MATCHER.classify(text_to_analyze)
+        if matched_categories is None: continue # Ignore
+
+        kept.append((text_to_analyze, sorted(matched_categories)))
+    return kept
+
+def prepare_lines(new_lines):
+    """Parses, filters and sanitises a chunk of raw lines.
+
+    Returns a list of (threat_categories, sanitised_line, macs, internal_ips, external_ips).
+    """
+    return [(categories, *sanitise_line(text)) for text, categories in screen_lines(new_lines)]
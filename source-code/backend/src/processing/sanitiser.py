@@ -0,0 +1,169 @@
+#sanitiser.py strips PII (MACs, emails, user dirs, passwords, IPs) from a log line before it leaves the machine
+import re
+
+# Config for sanitisation
+pattern_ip = re.compile(r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b")
+pattern_ipv6 = re.compile(r"(?:(?:[0-9a-fA-F]{1,4}:){7,7}[0-9a-fA-F]{1,4}|(?:[0-9a-fA-F]{1,4}:){1,7}:|(?:[0-9a-fA-F]{1,4}:){1,6}:[0-9a-fA-F]{1,4}|(?:[0-9a-fA-F]{1,4}:){1,5}(?::[0-9a-fA-F]{1,4}){1,2}|(?:[0-9a-fA-F]{1,4}:){1,4}(?::[0-9a-fA-F]{1,4}){1,3}|(?:[0-9a-fA-F]{1,4}:){1,3}(?::[0-9a-fA-F]{1,4}){1,4}|(?:[0-9a-fA-F]{1,4}:){1,2}(?::[0-9a-fA-F]{1,4}){1,5}|[0-9a-fA-F]{1,4}:(?::[0-9a-fA-F]{1,4}){1,6}|:(?::[0-9a-fA-F]{1,4}){1,7}|::1)")
+pattern_mac = re.compile(r"(?:[0-9A-Fa-f]{2}[:-]){5}(?:[0-9A-Fa-f]{2})")
+pattern_email = re.compile(r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}")
+pattern_win_user_path = re.compile(r"(?i)(C:\\Users\\[a-z0-9_-]+)")
+pattern_passwords = re.compile(r"(?i)(--password|-p|password=)\s*['\"]?([^\s'\"]+)['\"]?")
+
+# Define all internal prefixes (both v4 and v6)
+internal_prefixes = ("192.168.", "10.", "172.", "fc", "fd", "fe80", "::1", "127.0.0.1")
+
+# Every pattern above in one alternation, in the same order the chained version applies them,
+# so each line is scanned once. Inline (?i) flags are scoped because they can't sit mid-pattern.
+# Emails and IPv6 always send the line down the chained path (see below), so rather than their
+# full (slow) patterns the scan only looks for what they can't exist without:
+# - an email needs an "@"
+# - an IPv6 needs a "::" or eight colon separated groups
+# The MAC lookahead just stops the engine retrying that branch at every hex char.
+pattern_fused = re.compile("|".join([
+    f"(?P<mac>(?=[0-9A-Fa-f]{{2}}[:-]){pattern_mac.pattern})",
+    r"(?P<email>@)",
+    r"(?P<win_user_path>(?i:C:\\Users\\[a-z0-9_-]+))",
+    r"(?P<password>(?i:--password|-p|password=)\s*['\"]?[^\s'\"]+['\"]?)",
+    f"(?P<ipv4>{pattern_ip.pattern})",
+    r"(?P<ipv6>::|(?:[0-9a-fA-F]{1,4}:){7}[0-9a-fA-F])"
+]))
+
+# The chained version runs each stage over the output of the last one, so matches can overlap or
+# reshape each other (a MAC inside a password, an IPv6 "5::" hiding in "10.0.0.5::1"). The fused
+# scan only keeps its result when that can't happen, anything else takes the chained path:
+# - emails (any "@"), user dirs and IPv6 are rare in Snort/iptables/apache lines
+# - a MAC or IPv4 must stand alone, i.e. not touch another char any of the patterns could use
+# - a password (or "-prod" in a hostname, the pattern is loose) must not follow something an
+#   IP or MAC could end with, as the redaction would change the word boundary in front of it
+CHAINED_ONLY_GROUPS = ("email", "win_user_path", "ipv6")
+TOKEN_CHARS = frozenset("0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_.:-%+@")
+ADDRESS_END_CHARS = frozenset("0123456789abcdefABCDEF:.")
+pattern_port = re.compile(r":\d{1,5}") # 1.2.3.4:443 is fine, no other pattern can use the port
+
+# Only MACs and passwords are ever spliced in by the fused path, IPs get numbered tokens
+REDACTED_TOKENS = {
+    "mac": "[MAC_REDACTED]",
+    "password": "[PASSWORD_REDACTED]"
+}
+
+def split_ips(unique_ips):
+    """Separate into internal and external lists by checking the prefix."""
+    internal_ips = [ip for ip in unique_ips if ip.lower().startswith(internal_prefixes)]
+    external_ips = [ip for ip in unique_ips if ip not in internal_ips]
+    return internal_ips, external_ips
+
+def sanitise_line_chained(text):
+    """The original stage by stage sanitiser, roughly 8 + N passes over the line.
+
+    Returns (sanitised_line, macs, internal_ips, external_ips).
+    """
+    # remove mac address entirely for same reason as ip
+    macs = re.findall(pattern_mac, text) # find and store before redacting the text, same as ips
+    sanitised_line = re.sub(pattern_mac, "[MAC_REDACTED]", text) # repalce all mac oocurances with redacted text
+    # New System-Level Sanitisation
+    sanitised_line = re.sub(pattern_email, "[EMAIL_REDACTED]", sanitised_line)
+    sanitised_line = re.sub(pattern_win_user_path, "[WINDOWS_USER_DIR]", sanitised_line)
+    sanitised_line = re.sub(pattern_passwords, "[PASSWORD_REDACTED]", sanitised_line)
+
+    # Extract both IPv4 and IPv6 addresses
+    ips_v4 = re.findall(pattern_ip, sanitised_line)
+    ips_v6 = re.findall(pattern_ipv6, sanitised_line)
+
+    # Use a set to get unique IPs, then sort them to ensure consistentcy
+    # and combine both ips into a single unique list
+    unique_ips = sorted(list(set(ips_v4 + ips_v6)))
+    internal_ips, external_ips = split_ips(unique_ips)
+
+    # External IPs now starting from 0
+    for i, ip in enumerate(external_ips):
+        sanitised_line = sanitised_line.replace(ip, f"[EXTERNAL_IP_{i}]")
+    # Internal IPs now starting from 0 (seperate to external ips)
+    for i, ip in enumerate(internal_ips):
+        sanitised_line = sanitised_line.replace(ip, f"[INTERNAL_IP_{i}]")
+
+    return sanitised_line, macs, internal_ips, external_ips
+
+def stands_alone(text, match):
+    """True if the chars either side of a match can't belong to another match."""
+    start, end = match.span()
+    if match.lastgroup == "password":
+        # the value runs to the next space/quote so only the front can clash
+        return start == 0 or text[start - 1] not in ADDRESS_END_CHARS
+    if start > 0 and text[start - 1] in TOKEN_CHARS:
+        return False
+    if match.lastgroup == "ipv4":
+        port = pattern_port.match(text, end)
+        if port:
+            end = port.end()
+    return end == len(text) or text[end] not in TOKEN_CHARS
+
+def redact_passwords_only(text, matches):
+    """The line with just the password matches redacted, what the IP stage of the chained version sees."""
+    pieces = []
+    last_end = 0
+    for match in matches:
+        if match.lastgroup == "password":
+            pieces.append(text[last_end:match.start()])
+            pieces.append(REDACTED_TOKENS["password"])
+            last_end = match.end()
+    pieces.append(text[last_end:])
+    return "".join(pieces)
+
+def sanitise_matches(text, matches):
+    """Sanitises text from the fused matches already found in it.
+
+    Returns (sanitised_line, macs, internal_ips, external_ips).
+    """
+    macs = []
+    ips = []
+    has_password = False
+    for match in matches:
+        kind = match.lastgroup
+        if kind in CHAINED_ONLY_GROUPS or not stands_alone(text, match):
+            return sanitise_line_chained(text)
+        if kind == "mac":
+            macs.append(match.group())
+        elif kind == "password":
+            # the chained version collects MACs before redacting, even one inside a password
+            # (or overlapping the "d" of "--password"), and redacts emails first, which can
+            # start before the password does, so leave those lines to it
+            if "@" in match.group() or pattern_mac.search(match.group()):
+                return sanitise_line_chained(text)
+            has_password = True
+        else:
+            ips.append(match.group())
+
+    unique_ips = sorted(set(ips))
+    internal_ips, external_ips = split_ips(unique_ips)
+
+    # The chained version uses str.replace, which also hits copies of an IP that the regex didn't
+    # match (e.g. 1.2.3.4 inside 11.2.3.45). Only splice by position when every copy was a match.
+    # Copies inside a password are already gone by then, so count against the text without them.
+    if unique_ips:
+        remaining = redact_passwords_only(text, matches) if has_password else text
+        if sum(remaining.count(ip) for ip in unique_ips) != len(ips):
+            return sanitise_line_chained(text)
+
+    tokens = {ip: f"[EXTERNAL_IP_{i}]" for i, ip in enumerate(external_ips)}
+    tokens.update({ip: f"[INTERNAL_IP_{i}]" for i, ip in enumerate(internal_ips)})
+
+    # Stitch the untouched gaps and replacement tokens together in one go
+    pieces = []
+    last_end = 0
+    for match in matches:
+        pieces.append(text[last_end:match.start()])
+        pieces.append(REDACTED_TOKENS.get(match.lastgroup) or tokens[match.group()])
+        last_end = match.end()
+    pieces.append(text[last_end:])
+
+    return "".join(pieces), macs, internal_ips, external_ips
+
+def sanitise_line(text):
+    """Single pass sanitiser, same output as sanitise_line_chained.
+
+    Returns (sanitised_line, macs, internal_ips, external_ips).
+    """
+    matches = list(pattern_fused.finditer(text))
+    if not matches:
+        return text, [], [], []
+    return sanitise_matches(text, matches)
@@ -0,0 +1,129 @@
+#spool.py keeps suspicious events waiting for the LLM on disk so a crash or a burst doesn't lose or pile them up in RAM
+import json, time, sqlite3, threading
+
+MAX_ATTEMPTS = 3 # an event whose batch fails this many times goes to the dead letter table rather than being retried forever
+
+class EventSpool:
+    """SQLite (WAL mode) queue of events awaiting analysis.
+
+    push() on ingest, take_batch() claims the oldest pending events for a batch, then ack() once the
+    batch has been applied or release() if it failed. Anything claimed when the process died is put
+    back by recover() on the next start, so nothing is left "pending" in Firestore forever.
+    Events that fail MAX_ATTEMPTS times are kept in dead_letter until requeue_dead() sends them again.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock() # one connection shared by the ingest loop and dispatcher threads
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL") # WAL + NORMAL survives a process crash, only an OS crash can lose the tail
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                event TEXT NOT NULL,
+                claimed INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                queued_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS spool_pending ON spool (claimed, seq)")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                seq INTEGER PRIMARY KEY,
+                event TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                queued_at REAL NOT NULL,
+                failed_at REAL NOT NULL
+            )
+        """)
+        self.pending = self.conn.execute("SELECT COUNT(*) FROM spool WHERE claimed = 0").fetchone()[0] # kept in RAM, no COUNT per push
+
+    def push(self, event):
+        self.push_many([event])
+
+    def push_many(self, events):
+        """Appends events in one transaction."""
+        now = time.time()
+        rows = [(json.dumps(event, default=str), now) for event in events]
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("INSERT INTO spool (event, queued_at) VALUES (?, ?)", rows)
+            self.conn.execute("COMMIT")
+            self.pending += len(rows)
+
+    def take_batch(self, limit):
+        """Claims up to `limit` of the oldest pending events. Each comes back with 'spool_seq' and 'spool_queued_at' set."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute(
+                "SELECT seq, event, queued_at FROM spool WHERE claimed = 0 ORDER BY seq LIMIT ?", (limit,)).fetchall()
+            self.conn.executemany("UPDATE spool SET claimed = 1 WHERE seq = ?", [(seq,) for seq, _, _ in rows])
+            self.conn.execute("COMMIT")
+            self.pending -= len(rows)
+
+        batch = []
+        for seq, data, queued_at in rows:
+            event = json.loads(data)
+            event["spool_seq"] = seq
+            event["spool_queued_at"] = queued_at # for time-to-analysis
+            batch.append(event)
+        return batch
+
+    def ack(self, seqs):
+        """The batch was analysed and applied, forget its events."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("DELETE FROM spool WHERE seq = ?", [(seq,) for seq in seqs])
+            self.conn.execute("COMMIT")
+
+    def release(self, seqs):
+        """The batch failed, put its events back in the queue.
+
+        Events that have now failed MAX_ATTEMPTS times move to the dead letter table instead,
+        they are returned so the caller can mark their incidents as failed.
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("UPDATE spool SET claimed = 0, attempts = attempts + 1 WHERE seq = ?", [(seq,) for seq in seqs])
+            rows = self.conn.execute("SELECT event FROM spool WHERE attempts >= ?", (MAX_ATTEMPTS,)).fetchall()
+            self.conn.execute("""
+                INSERT OR REPLACE INTO dead_letter (seq, event, attempts, queued_at, failed_at)
+                SELECT seq, event, attempts, queued_at, ? FROM spool WHERE attempts >= ?
+            """, (time.time(), MAX_ATTEMPTS))
+            self.conn.execute("DELETE FROM spool WHERE attempts >= ?", (MAX_ATTEMPTS,))
+            self.conn.execute("COMMIT")
+            self.pending += len(seqs) - len(rows)
+        return [json.loads(data) for data, in rows]
+
+    def dead_count(self):
+        """Events given up on and waiting in the dead letter table."""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def requeue_dead(self):
+        """Moves every dead letter back into the queue with a fresh set of attempts. Returns the events."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            rows = self.conn.execute("SELECT event FROM dead_letter ORDER BY seq").fetchall()
+            now = time.time() # counted as new arrivals, their old wait would skew time-to-analysis
+            self.conn.executemany("INSERT INTO spool (event, queued_at) VALUES (?, ?)", [(data, now) for data, in rows])
+            self.conn.execute("DELETE FROM dead_letter")
+            self.conn.execute("COMMIT")
+            self.pending += len(rows)
+        return [json.loads(data) for data, in rows]
+
+    def recover(self):
+        """Un-claims everything left over from a previous run. Returns how many events will be replayed."""
+        with self.lock:
+            self.conn.execute("UPDATE spool SET claimed = 0 WHERE claimed = 1")
+            self.pending = self.conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+            return self.pending
+
+    def pending_count(self):
+        """Events not yet claimed by a batch."""
+        return self.pending
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
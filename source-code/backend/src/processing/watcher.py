@@ -0,0 +1,126 @@
+#watcher.py tells log_watcher which files in raw-logs changed, via inotify on Linux or polling everywhere else
+import os, sys, select, struct, threading, ctypes, ctypes.util
+
+# inotify flags from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CREATE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len, then len bytes of null padded name
+READ_SIZE = 64 * 1024
+POLL_INTERVAL = 2 # seconds, same as the old loop
+
+class PollingWatcher:
+    """Fallback for Windows/macOS or when inotify can't be set up, stats every file each interval."""
+    kind = "polling"
+
+    def __init__(self, path, interval=POLL_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.woken = threading.Event()
+        self.seen = self.snapshot()
+
+    def snapshot(self):
+        """(inode, size, mtime) for every file in the folder."""
+        seen = {}
+        for entry in os.scandir(self.path):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue # deleted between listing and stat
+            seen[entry.name] = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        return seen
+
+    def wait(self, timeout=None):
+        """Sleeps for one interval (or less if timeout is shorter, or until wake()) and returns the names that changed."""
+        self.woken.wait(self.interval if timeout is None else min(self.interval, timeout))
+        self.woken.clear()
+        current = self.snapshot()
+        changed = {name for name, state in current.items() if self.seen.get(name) != state}
+        self.seen = current
+        return changed
+
+    def wake(self):
+        """Ends the current wait() early, safe to call from any thread."""
+        self.woken.set()
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Blocks on an inotify descriptor so the forwarder only wakes when something is written to the folder."""
+    kind = "inotify"
+
+    def __init__(self, path):
+        self.path = path
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {path}")
+        # self-pipe, wake() writes a byte so another thread can end a select() with no timeout
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+        os.set_blocking(self.wake_w, False)
+
+    def read_events(self):
+        """Drains the descriptor. Returns the changed names, or None if the kernel queue overflowed."""
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                if mask & IN_Q_OVERFLOW:
+                    return None # events were dropped, caller has to rescan everything
+                name = data[offset:offset + name_len].rstrip(b"\0")
+                offset += name_len
+                if name:
+                    changed.add(os.fsdecode(name))
+
+    def wait(self, timeout=None):
+        """Blocks until the folder changes, wake() is called or timeout (seconds) runs out. Returns the changed names."""
+        ready, _, _ = select.select([self.fd, self.wake_r], [], [], timeout)
+        if self.wake_r in ready:
+            try:
+                os.read(self.wake_r, READ_SIZE) # drain, several wakes count as one
+            except BlockingIOError:
+                pass
+        if self.fd not in ready:
+            return set()
+        changed = self.read_events()
+        if changed is None:
+            return set(os.listdir(self.path))
+        return changed
+
+    def wake(self):
+        """Ends the current wait() early, safe to call from any thread."""
+        try:
+            os.write(self.wake_w, b"\0")
+        except BlockingIOError:
+            pass # pipe already full, the wait will end anyway
+
+    def close(self):
+        os.close(self.fd)
+        os.close(self.wake_r)
+        os.close(self.wake_w)
+
+def make_watcher(path):
+    """inotify when the platform has it, polling otherwise."""
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(path)
+        except (OSError, AttributeError) as e: # AttributeError: libc without inotify symbols
+            print(f"inotify unavailable ({e}), falling back to polling.")
+    return PollingWatcher(path)
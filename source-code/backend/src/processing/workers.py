@@ -0,0 +1,41 @@
+#workers.py spreads the parse/filter/sanitise step over several processes for big log backlogs
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from processing.pipeline import prepare_lines
+
+MIN_CHUNK_LINES = 500 # below this the pickling round trip costs more than the work itself
+CHUNKS_PER_WORKER = 4 # a few chunks each so one slow chunk doesn't leave the other cores idle
+# spawn rather than fork, the pool starts its processes on first use, long after the Firestore (gRPC),
+# LLM dispatcher and flusher threads are running. Each spawned worker imports log-forwarder.py as
+# __mp_main__, which only defines things, its clients, spool and caches are opened in main().
+# Scripts without a __main__ guard (the tests) switch to "fork".
+START_METHOD = "spawn"
+
+class SanitiserPool:
+    """Runs prepare_lines in worker processes, results come back in the same order as the lines went in."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD))
+
+    def split(self, new_lines):
+        """Cuts the lines into contiguous sub-chunks, sized so every worker gets a few."""
+        size = max(MIN_CHUNK_LINES, -(-len(new_lines) // (self.workers * CHUNKS_PER_WORKER)))
+        return [new_lines[i:i + size] for i in range(0, len(new_lines), size)]
+
+    def prepare(self, new_lines):
+        """Same output as prepare_lines(new_lines), just computed across the pool."""
+        chunks = self.split(new_lines)
+        if len(chunks) < 2:
+            # normal tailing only brings in a few lines at a time, not worth leaving this process
+            return prepare_lines(new_lines)
+
+        # executor.map yields in submission order, so the merged list keeps file order
+        # no matter which worker finishes first
+        prepared = []
+        for result in self.executor.map(prepare_lines, chunks):
+            prepared.extend(result)
+        return prepared
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -1,6 +1,6 @@
-from fastapi import HTTPException, Security, status
+from fastapi import HTTPException, Security, Query, status
 from fastapi.security import APIKeyHeader
-import os
+import os, time, hmac, hashlib
 
 # Define the name of the header the frontend must send
 API_KEY_NAME = "X-API-Key"
@@ -18,4 +18,29 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Could not validate credentials"
-        )
\ No newline at end of file
+        )
+
+# EventSource (the browser's SSE client) can't send headers, so /api/incidents/stream also takes a
+# short lived token in the URL. It's signed with the API key and only good for opening the stream,
+# so the key itself never ends up in a URL (or a proxy's access log).
+STREAM_TOKEN_SECONDS = 60
+
+def sign_stream_token(expires):
+    return hmac.new(EXPECTED_API_KEY.encode(), f"stream:{expires}".encode(), hashlib.sha256).hexdigest()
+
+def issue_stream_token():
+    """<expiry>.<signature>, for ?token= on the stream. Returns (token, seconds it's valid for)."""
+    expires = int(time.time()) + STREAM_TOKEN_SECONDS
+    return f"{expires}.{sign_stream_token(expires)}", STREAM_TOKEN_SECONDS
+
+def stream_token_valid(token):
+    expires, _, signature = token.partition(".")
+    if not EXPECTED_API_KEY or not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, sign_stream_token(int(expires)))
+
+async def get_stream_access(api_key_header: str = Security(api_key_header), token: str | None = Query(None)):
+    # the header still works for fetch based clients, EventSource sends ?token= instead
+    if token is not None and stream_token_valid(token):
+        return token
+    return await get_api_key(api_key_header)
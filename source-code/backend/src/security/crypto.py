@@ -1,5 +1,6 @@
 #crypto.py used for encrypting the incident data and ai summary within log-fowarder and decrypting it when retrieving from firestore
-import os, json
+import os, sys, json, hashlib, threading
+from collections import OrderedDict
 from cryptography.fernet import Fernet
 from dotenv import load_dotenv
 
@@ -20,18 +21,119 @@ def get_or_create_key():
 raw_key = get_or_create_key()
 cipher = Fernet(raw_key.encode()) # fernet uses AES-128 in CBC mode with HMAC for auth. encode converts key to bytes 
 
+# decrypted payloads are memoised by ciphertext, the API re-reads the same tokens on every snapshot
+DECRYPT_CACHE_MAX_BYTES = int(os.getenv("DECRYPT_CACHE_MB", "64")) * 1024 * 1024
+ENTRY_OVERHEAD_BYTES = 200 # digest key, LRU node and bookkeeping per entry
+
+def estimate_size(obj):
+    """Rough bytes held by a decoded JSON value (dicts, lists, strings, numbers)."""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in obj.items())
+    elif isinstance(obj, list):
+        size += sum(estimate_size(v) for v in obj)
+    return size
+
+class DecryptCache:
+    """Bounded LRU of sha256(ciphertext) -> decrypted object, evicted by estimated memory rather than count.
+
+    Hits hand back the same object every time, so callers treat results as read only.
+    """
+
+    def __init__(self, max_bytes=DECRYPT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # digest -> (value, size), oldest first
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def get(self, digest):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, digest, value):
+        size = estimate_size(value) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return # wouldn't fit even on its own
+        with self.lock:
+            old = self.entries.pop(digest, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[digest] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats["evicted"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def metrics(self):
+        with self.lock:
+            snapshot = dict(self.stats)
+            snapshot["entries"] = len(self.entries)
+            snapshot["bytes"] = self.bytes
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
+
+decrypt_cache = DecryptCache()
+
 def encrypt_payload(data_dict: dict) -> str:
     json_data = json.dumps(data_dict, default=str).encode() # converts a dict to JSON bytes, encrypts it and returns a string
     return cipher.encrypt(json_data).decode()
 
-def decrypt_payload(encrypted_string: str):
+def encrypt_many(items) -> list:
+    """encrypt_payload for a list, with the lookups hoisted out of the loop."""
+    encrypt = cipher.encrypt
+    dumps = json.dumps
+    return [encrypt(dumps(item, default=str).encode()).decode() for item in items]
+
+def decrypt_payload(encrypted_string: str, use_cache=True):
     # If fit gets a list instead of a string, catch it here
     if not isinstance(encrypted_string, str):
         print(f"Error: Expected string for decryption, got {type(encrypted_string)}")
         return None
-        
+
+    digest = None
+    if use_cache:
+        digest = hashlib.sha256(encrypted_string.encode()).digest()
+        cached = decrypt_cache.get(digest)
+        if cached is not None:
+            return cached
+
     try:
         decrypted_bytes = cipher.decrypt(encrypted_string.encode())
-        return json.loads(decrypted_bytes.decode())
+        value = json.loads(decrypted_bytes.decode())
     except Exception as e:
-        return None
\ No newline at end of file
+        return None
+    if digest is not None and value is not None: # failures aren't cached, a key change shouldn't stick
+        decrypt_cache.put(digest, value)
+    return value
+
+def remember_decrypted(encrypted_string, value):
+    """Puts a value decrypted somewhere else (a worker process) into this process's cache."""
+    if isinstance(encrypted_string, str) and value is not None:
+        decrypt_cache.put(hashlib.sha256(encrypted_string.encode()).digest(), value)
+
+def decrypt_many(encrypted_strings, use_cache=True) -> list:
+    """decrypt_payload for a list, same order, None for anything that won't decrypt. Repeats are only decrypted once."""
+    seen = {} # ciphertext -> value within this call
+    results = []
+    for token in encrypted_strings:
+        if not isinstance(token, str):
+            results.append(decrypt_payload(token)) # logs the bad type like a single call would
+            continue
+        if token not in seen:
+            seen[token] = decrypt_payload(token, use_cache)
+        results.append(seen[token])
+    return results
@@ -0,0 +1,84 @@
+#analysis_cache.py remembers what the LLM said about a log pattern so repeat alerts don't cost another API call
+import json, time, hashlib, sqlite3, threading
+from processing.clustering import template_key
+
+DEFAULT_TTL_SECONDS = 24 * 60 * 60 # a day, after that the pattern is analysed fresh
+DEFAULT_MAX_ENTRIES = 10000
+
+def cache_key(text, persona, model):
+    """Hash of the normalised line (variable fields masked) plus the prompt persona and model."""
+    normalised = template_key(text)
+    return hashlib.sha256(f"{model}\0{persona}\0{normalised}".encode("utf-8")).hexdigest()
+
+class AnalysisCache:
+    """SQLite backed cache of LLM results with a TTL and least-recently-used eviction.
+
+    Results are stored without their event_id, get() hands back a copy for the caller to stamp.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL_SECONDS, max_entries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.lock = threading.Lock() # looked up on the ingest loop, filled from dispatcher threads
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_cache (
+                key TEXT PRIMARY KEY,
+                result TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS analysis_cache_lru ON analysis_cache (last_used)")
+        self.size = self.conn.execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+
+    def get(self, key):
+        """The cached result for key, or None if there isn't a fresh one."""
+        now = self.clock()
+        with self.lock:
+            row = self.conn.execute("SELECT result, created FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                self.size -= 1
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self.conn.execute("UPDATE analysis_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """Stores a result (minus its event_id), evicting the least recently used entries past max_entries."""
+        result = {k: v for k, v in result.items() if k != "event_id"}
+        now = self.clock()
+        with self.lock:
+            existed = self.conn.execute("SELECT 1 FROM analysis_cache WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO analysis_cache (key, result, created, last_used) VALUES (?, ?, ?, ?)",
+                              (key, json.dumps(result), now, now))
+            if not existed:
+                self.size += 1
+            if self.size > self.max_entries:
+                excess = self.size - self.max_entries
+                self.conn.execute("DELETE FROM analysis_cache WHERE key IN "
+                                  "(SELECT key FROM analysis_cache ORDER BY last_used LIMIT ?)", (excess,))
+                self.size -= excess
+                self.stats["evicted"] += excess
+
+    def metrics(self):
+        """Hit/miss counters plus the current size and hit rate."""
+        with self.lock:
+            snapshot = dict(self.stats)
+        snapshot["size"] = self.size
+        lookups = snapshot["hits"] + snapshot["misses"]
+        snapshot["hit_rate"] = snapshot["hits"] / lookups if lookups else 0.0
+        return snapshot
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,142 @@
+#analytics.py keeps the Analytics page's counts and histograms up to date as incidents change, so it needn't download them all
+import datetime
+from collections import Counter
+
+FIVE_MINUTES = 300 # the "minute" histogram uses 5 minute buckets, like the last-hour chart
+GRANULARITIES = ("minute", "hour", "day", "month") # day and month are summed from the hourly counters
+
+def severity(risk):
+    """Same bands as the Analytics pie chart."""
+    if risk is None:
+        return None
+    if risk >= 8:
+        return "Critical"
+    if risk >= 6:
+        return "High"
+    if risk >= 4:
+        return "Medium"
+    return "Low"
+
+def facets(incident, values):
+    """Every counter one incident adds 1 to. values is its index_values() from the incident cache."""
+    event = incident.get("event") if isinstance(incident.get("event"), dict) else {}
+    resolved = values["status"] == "resolved"
+    keys = ["total", f"status:{values['status']}", f"source:{values['filename']}"]
+    keys.append("resolved" if resolved else "open")
+    if values["risk"] is not None:
+        keys.append(f"risk:{values['risk']}")
+        keys.append(f"severity:{severity(values['risk'])}")
+        if values["risk"] >= 8 and not resolved:
+            keys.append("critical_open")
+    keys.extend(f"category:{category}" for category in event.get("threat_categories") or [])
+    return keys
+
+def bump(counter, keys, sign):
+    """Adds sign to each key, dropping any that reach 0 so the counters only hold what exists."""
+    for key in keys:
+        counter[key] += sign
+        if counter[key] == 0:
+            del counter[key]
+
+def utc_seconds(moment):
+    """Epoch seconds for a since/until bound. Naive datetimes are read as UTC like the buckets are,
+    .timestamp() on its own would read them in the server's local time."""
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.timestamp()
+
+def to_seconds(timestamp):
+    return timestamp.timestamp() if hasattr(timestamp, "timestamp") else None
+
+class AnalyticsRollup:
+    """Counters kept per incident add/remove: all-time totals, per hour (for windowed summaries and
+    hour/day/month histograms) and per 5 minutes (for the last-hour chart).
+
+    Not thread safe on its own, the incident cache calls it under its lock.
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self.hourly = {} # hour number since the epoch -> Counter of facets
+        self.five_minute = Counter() # 5 minute bucket number -> incidents
+
+    def add(self, incident, values, sign=1):
+        keys = facets(incident, values)
+        bump(self.totals, keys, sign)
+        seconds = to_seconds(incident.get("timestamp"))
+        if seconds is None:
+            return # no timestamp yet, only in the totals
+        hour = int(seconds // 3600)
+        bump(self.hourly.setdefault(hour, Counter()), keys, sign)
+        if not self.hourly[hour]: # emptied, windows only walk hours that had incidents
+            del self.hourly[hour]
+        bump(self.five_minute, [int(seconds // FIVE_MINUTES)], sign)
+
+    def remove(self, incident, values):
+        self.add(incident, values, sign=-1)
+
+    def clear(self):
+        self.totals.clear()
+        self.hourly.clear()
+        self.five_minute.clear()
+
+    def counts(self, since=None, until=None):
+        """Facet counts for incidents in [since, until] (datetimes, naive ones are UTC, whole hours), all time if neither is given."""
+        if since is None and until is None:
+            return Counter(self.totals)
+        first = int(utc_seconds(since) // 3600) if since is not None else None
+        last = int(utc_seconds(until) // 3600) if until is not None else None
+        total = Counter()
+        for hour, counts in self.hourly.items():
+            if (first is None or hour >= first) and (last is None or hour <= last):
+                total.update(counts)
+        return total
+
+    def summary(self, since=None, until=None):
+        """The StatCards and breakdown charts in one small dict."""
+        counts = self.counts(since, until)
+        grouped = {"severity": {}, "status": {}, "source": {}, "category": {}, "risk": {}}
+        for key, value in counts.items():
+            facet, _, name = key.partition(":")
+            if facet in grouped:
+                grouped[facet][name] = value
+        return {
+            "total": counts["total"],
+            "open": counts["open"],
+            "resolved": counts["resolved"],
+            "critical": counts["critical_open"], # risk 8+ and not resolved, like the dashboard card
+            "severity": grouped["severity"],
+            "status": grouped["status"],
+            "sources": grouped["source"],
+            "threat_categories": grouped["category"],
+            "risk": {int(score): value for score, value in grouped["risk"].items()}
+        }
+
+    def histogram(self, granularity="hour", since=None, until=None):
+        """Incident counts per time bucket, oldest first, as [{"bucket": ISO start (UTC), "count": n}]. Empty buckets are left out."""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        first = utc_seconds(since) if since is not None else float("-inf")
+        last = utc_seconds(until) if until is not None else float("inf")
+        buckets = Counter()
+        if granularity == "minute":
+            for bucket, count in self.five_minute.items():
+                start = bucket * FIVE_MINUTES
+                if first < start + FIVE_MINUTES and start <= last:
+                    buckets[start] += count
+        else:
+            for hour, counts in self.hourly.items():
+                start = hour * 3600
+                if start + 3600 <= first or start > last:
+                    continue
+                if granularity == "hour":
+                    buckets[start] += counts["total"]
+                else:
+                    day = datetime.datetime.fromtimestamp(start, datetime.timezone.utc)
+                    if granularity == "day":
+                        key = day.replace(hour=0)
+                    else: # month
+                        key = day.replace(day=1, hour=0)
+                    buckets[key.timestamp()] += counts["total"]
+        return [{"bucket": datetime.datetime.fromtimestamp(start, datetime.timezone.utc).isoformat(), "count": count}
+                for start, count in sorted(buckets.items()) if count > 0]
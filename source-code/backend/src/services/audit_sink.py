@@ -0,0 +1,106 @@
+#audit_sink.py queues audit log entries and writes them in batches on a background thread, so requests never wait on Firestore
+import queue, threading
+from services.bulk_writer import MAX_BATCH_WRITES
+
+DEFAULT_MAX_QUEUE = 10000 # entries waiting to be written, past this new ones are dropped (and counted)
+DEFAULT_FLUSH_INTERVAL = 1 # seconds between batch commits when traffic is light
+RETRY_LIMIT = 3 # commits a batch gets before it's given up on
+
+class AuditSink:
+    """Bounded queue of audit entries with a flusher thread that commits them as WriteBatches.
+
+    record() never blocks, it's called from the async middleware. If the queue is full (Firestore
+    down or far behind) the entry is dropped and counted in `dropped` rather than holding up the request.
+    close() stops the thread and writes whatever is still queued.
+    """
+
+    def __init__(self, db, collection="audit_logs", max_queue=DEFAULT_MAX_QUEUE,
+                 flush_size=MAX_BATCH_WRITES, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db = db
+        self.collection = db.collection(collection)
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.flush_size = min(flush_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.pending = [] # taken off the queue, not committed yet (only the flusher touches it)
+        self.attempts = 0 # failed commits of the current pending batch
+        self.stopped = threading.Event()
+        self.thread = None
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0 # entries given up on after RETRY_LIMIT failed commits
+        self.commits = 0
+
+    def record(self, entry):
+        """Queues one audit entry. Returns False if it had to be dropped."""
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.recorded += 1
+        return True
+
+    def flush(self):
+        """Commits pending entries plus whatever is queued, a batch at a time. Returns how many were written."""
+        written = 0
+        while True:
+            while len(self.pending) < self.flush_size:
+                try:
+                    self.pending.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not self.pending:
+                return written
+            batch = self.db.batch()
+            for entry in self.pending:
+                batch.set(self.collection.document(), entry)
+            try:
+                batch.commit()
+            except Exception:
+                self.attempts += 1
+                if self.attempts >= RETRY_LIMIT:
+                    self.failed += len(self.pending)
+                    self.pending = []
+                    self.attempts = 0
+                raise # kept for the next flush otherwise
+            self.commits += 1
+            self.written += len(self.pending)
+            written += len(self.pending)
+            self.pending = []
+            self.attempts = 0
+
+    def start(self):
+        """Starts the flusher thread. It wakes as soon as an entry arrives and commits every flush_interval seconds."""
+        def run():
+            while not self.stopped.is_set():
+                if not self.pending: # a failed batch is retried without waiting for new entries
+                    try:
+                        self.pending.append(self.queue.get(timeout=self.flush_interval))
+                    except queue.Empty:
+                        continue
+                self.stopped.wait(self.flush_interval) # let a burst pile up into one batch
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Audit log write failed, will retry: {e}")
+        self.thread = threading.Thread(target=run, name="audit-sink", daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        """Stops the flusher thread and writes what's left, call on shutdown."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        for _ in range(RETRY_LIMIT):
+            try:
+                self.flush()
+                break
+            except Exception as e:
+                print(f"Audit log write failed on shutdown: {e}")
+        print(f"[AUDIT] Sink closed: {self.metrics()}")
+
+    def metrics(self):
+        return {"recorded": self.recorded, "written": self.written, "dropped": self.dropped,
+                "failed": self.failed, "queued": self.queue.qsize() + len(self.pending), "commits": self.commits}
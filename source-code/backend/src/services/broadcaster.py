@@ -0,0 +1,139 @@
+#broadcaster.py fans incident changes out to every connected dashboard (SSE) without holding up the Firestore listener thread
+import os, asyncio, threading, collections
+from services.responses import dumps
+
+REPLAY_EVENTS = 5000 # recent changes kept so a reconnecting dashboard can catch up from its resume token
+CLIENT_QUEUE_EVENTS = 1000 # a client this far behind is told to reload rather than buffered forever
+RESET_MIN_CHANGES = 500 # pushes bigger than this (the cold start) go out as one "reset" instead of per incident
+HEARTBEAT_SECONDS = 15 # comment line on idle streams so proxies don't close them
+
+def sse_message(event, data, event_id=None):
+    """One Server-Sent Events frame, data is serialised here."""
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+class Subscription:
+    """One connected client: the events it missed while away, then a queue filled on its event loop."""
+
+    def __init__(self, loop, backlog):
+        self.loop = loop
+        self.backlog = backlog
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE_EVENTS)
+        self.overflowed = False # set when the queue filled up, the stream sends a reset and starts again
+
+class IncidentBroadcaster:
+    """Turns incident cache changes into SSE frames and hands them to every subscriber.
+
+    publish() runs on the listener thread: it serialises each change once (not once per client), keeps
+    it in a replay buffer and schedules one delivery per event loop, so it never waits on a client.
+    Event ids are "<epoch>-<seq>" resume tokens, the epoch changes on restart so old tokens reset.
+    """
+
+    def __init__(self, replay=REPLAY_EVENTS):
+        self.epoch = os.urandom(4).hex()
+        self.seq = 0
+        self.recent = collections.deque(maxlen=replay) # (seq, frame)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.published = 0
+        self.overflows = 0
+
+    def token(self, seq=None):
+        return f"{self.epoch}-{self.seq if seq is None else seq}"
+
+    def publish(self, changes):
+        """changes are the cache's (doc_id, incident or None) pairs, None means the incident is gone."""
+        with self.lock:
+            if len(changes) > RESET_MIN_CHANGES:
+                self.seq += 1
+                frames = [sse_message("reset", {"reason": "bulk", "changes": len(changes)}, self.token())]
+                self.recent.append((self.seq, frames[0]))
+            else:
+                frames = []
+                for doc_id, incident in changes:
+                    self.seq += 1
+                    if incident is None:
+                        frame = sse_message("remove", {"id": doc_id}, self.token())
+                    else:
+                        frame = sse_message("upsert", {"id": doc_id, "incident": incident}, self.token())
+                    self.recent.append((self.seq, frame))
+                    frames.append(frame)
+            self.published += len(frames)
+            # taken under the lock, so a client subscribing now gets these in its backlog or its queue, never both
+            by_loop = {}
+            for subscription in self.subscribers:
+                by_loop.setdefault(subscription.loop, []).append(subscription)
+        for loop, subscriptions in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self.deliver, subscriptions, frames)
+            except RuntimeError: # loop already closed (server shutting down)
+                pass
+
+    def deliver(self, subscriptions, frames):
+        """Runs on the subscribers' event loop."""
+        for subscription in subscriptions:
+            if subscription.overflowed:
+                continue
+            for frame in frames:
+                try:
+                    subscription.queue.put_nowait(frame)
+                except asyncio.QueueFull:
+                    subscription.overflowed = True
+                    self.overflows += 1
+                    break
+
+    def subscribe(self, resume_token=None):
+        """Registers a client on the running event loop. With a resume token it replays what it missed,
+        or gets a reset if that's no longer in the buffer."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            backlog = self.replay_from(resume_token)
+            subscription = Subscription(loop, backlog)
+            self.subscribers.add(subscription)
+        return subscription
+
+    def replay_from(self, resume_token):
+        if not resume_token:
+            return [sse_message("ready", {}, self.token())] # gives the client a token to resume from
+        epoch, _, seq = resume_token.rpartition("-")
+        oldest = self.recent[0][0] if self.recent else self.seq + 1
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq or int(seq) < oldest - 1:
+            return [sse_message("reset", {"reason": "resume_expired"}, self.token())]
+        return [frame for frame_seq, frame in self.recent if frame_seq > int(seq)]
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+
+    async def stream(self, resume_token=None, request=None):
+        """The SSE body for one client, ends when it disconnects. It subscribes once the response starts
+        sending, inside the try, so a client that goes before that never leaves a subscription behind."""
+        subscription = None
+        try:
+            subscription = self.subscribe(resume_token)
+            for frame in subscription.backlog:
+                yield frame
+            subscription.backlog = []
+            while True:
+                if subscription.overflowed:
+                    while not subscription.queue.empty():
+                        subscription.queue.get_nowait()
+                    subscription.overflowed = False
+                    with self.lock:
+                        token = self.token()
+                    yield sse_message("reset", {"reason": "lagging"}, token) # reload the list, then carry on from here
+                    continue
+                try:
+                    frame = await asyncio.wait_for(subscription.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if request is not None and await request.is_disconnected():
+                        break
+                    yield b": ping\n\n"
+                    continue
+                yield frame
+        finally:
+            if subscription is not None:
+                self.unsubscribe(subscription)
+
+    def __len__(self):
+        return len(self.subscribers)
@@ -0,0 +1,131 @@
+#bulk_writer.py groups incident creates and AI result updates into batched Firestore commits
+import threading, hashlib
+from collections import Counter
+
+MAX_BATCH_WRITES = 500 # Firestore's limit for a single batch commit
+DEFAULT_FLUSH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 2 # seconds, for writes nobody calls flush() for
+MAX_UPDATE_ATTEMPTS = 3 # failed commits an update rides along in before it's dropped (e.g. its doc doesn't exist)
+
+def stable_doc_id(*parts):
+    """Doc ID derived from where a record came from (file, inode, offset, line...), so writing the
+    same record again overwrites its document instead of creating a duplicate."""
+    return hashlib.sha1("\0".join(map(str, parts)).encode("utf-8")).hexdigest()[:20]
+
+class IncidentWriter:
+    """Queues writes to one collection and commits them as WriteBatches.
+
+    Document IDs come from new_doc_id(), which Firestore generates client side, or stable_doc_id(),
+    so an event knows its doc_id straight away instead of waiting on an add() round trip per line.
+    flush() commits everything queued, it also happens automatically every flush_size writes and
+    (once start() is called) every flush_interval seconds.
+
+    A failed commit puts every write back in the queue. Writes are tracked per queuing thread, so if
+    another thread's failed commits end up dropping one of yours, your next flush() raises instead
+    of reporting success.
+    """
+
+    def __init__(self, db, collection="incidents", flush_size=DEFAULT_FLUSH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db = db
+        self.collection = db.collection(collection)
+        self.flush_size = min(flush_size, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.pending = [] # (op, doc_id, data, owner thread id, failed attempts)
+        self.lost = Counter() # owner thread id -> its updates dropped since its last flush()
+        self.dropped = 0
+        self.lock = threading.Lock() # ingest loop and dispatcher threads both write
+        self.flush_lock = threading.Lock() # one flush at a time, so flush() returning means earlier writes are committed
+        self.commits = 0
+        self.writes = 0
+        self.stopped = threading.Event()
+        self.timer = None
+
+    def new_doc_id(self):
+        """A fresh auto-ID, generated locally without an RPC."""
+        return self.collection.document().id
+
+    def create(self, doc_id, data):
+        self.queue("set", doc_id, data)
+
+    def update(self, doc_id, data):
+        self.queue("update", doc_id, data)
+
+    def queue(self, op, doc_id, data):
+        with self.lock:
+            self.pending.append((op, doc_id, data, threading.get_ident(), 0))
+            full = len(self.pending) >= self.flush_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Commits every queued write, flush_size at a time. Returns how many were written.
+
+        Raises if a commit fails, or if any of the calling thread's updates were dropped by earlier
+        failed commits (apply_analysis then releases its batch back to the spool).
+        """
+        owner = threading.get_ident()
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+
+            for start in range(0, len(pending), self.flush_size):
+                chunk = pending[start:start + self.flush_size]
+                batch = self.db.batch()
+                for op, doc_id, data, _, _ in chunk:
+                    ref = self.collection.document(doc_id)
+                    if op == "set":
+                        batch.set(ref, data)
+                    else:
+                        batch.update(ref, data)
+                try:
+                    batch.commit()
+                except Exception:
+                    self.requeue(chunk, pending[start + self.flush_size:])
+                    with self.lock:
+                        self.lost.pop(owner, None) # this raise covers them
+                    raise
+                with self.lock:
+                    self.commits += 1
+                    self.writes += len(chunk)
+
+            with self.lock:
+                lost = self.lost.pop(owner, 0)
+            if lost:
+                raise RuntimeError(f"{lost} queued updates were dropped after {MAX_UPDATE_ATTEMPTS} failed commits")
+            return len(pending)
+
+    def requeue(self, failed, untried):
+        """Puts a failed chunk (and the chunks after it) back in front of the queue. Creates are
+        retried until they go through. An update that keeps failing is dropped after
+        MAX_UPDATE_ATTEMPTS, one to a missing doc would fail every batch it's in, and its owner's
+        next flush() raises."""
+        retry = []
+        for op, doc_id, data, writer, attempts in failed:
+            attempts += 1
+            if op == "update" and attempts >= MAX_UPDATE_ATTEMPTS:
+                with self.lock:
+                    self.lost[writer] += 1
+                    self.dropped += 1
+            else:
+                retry.append((op, doc_id, data, writer, attempts))
+        with self.lock:
+            self.pending[:0] = retry + untried
+
+    def start(self):
+        """Starts the background thread that flushes every flush_interval seconds."""
+        def run():
+            while not self.stopped.wait(self.flush_interval):
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Firestore batch write failed, will retry: {e}")
+        self.timer = threading.Thread(target=run, name="incident-writer", daemon=True)
+        self.timer.start()
+        return self
+
+    def close(self):
+        """Stops the interval thread and commits whatever is left."""
+        self.stopped.set()
+        if self.timer is not None:
+            self.timer.join()
+        self.flush()
@@ -0,0 +1,193 @@
+#dispatcher.py sends LLM batches from a background thread so log ingestion never waits on the API
+import re, time, queue, random, threading
+
+# Gemini 2.5 Flash-Lite free tier limits, per minute
+DEFAULT_RPM = 15
+DEFAULT_TPM = 250000
+
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 60
+
+class TokenBucket:
+    """Holds up to `capacity` tokens and refills `capacity` of them every minute.
+
+    acquire() blocks until the requested amount is there, so calls spread out evenly instead
+    of a fixed sleep in front of each one.
+    """
+
+    def __init__(self, per_minute, clock=time.monotonic, sleep=time.sleep):
+        self.capacity = per_minute
+        self.rate = per_minute / 60 # tokens per second
+        self.tokens = per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount=1):
+        """Takes `amount` tokens, waiting for them if needed. Returns the seconds spent waiting."""
+        amount = min(amount, self.capacity) # a single huge batch still has to go through eventually
+        waited = 0
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return waited
+                shortfall = (amount - self.tokens) / self.rate
+            self.sleep(shortfall)
+            waited += shortfall
+
+    def drain(self):
+        """Empties the bucket, used after a 429 so every worker backs off together."""
+        with self.lock:
+            self.refill()
+            self.tokens = 0
+
+def is_rate_limited(error):
+    """True for quota errors (HTTP 429 / RESOURCE_EXHAUSTED) from the API client."""
+    text = str(error)
+    return "429" in text or "RESOURCE_EXHAUSTED" in text
+
+def retry_after_seconds(error):
+    """The retryDelay Gemini puts in its 429 body (e.g. 'retryDelay': '37s'), or None."""
+    match = re.search(r"retryDelay['\"]?\s*:\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+    return float(match.group(1)) if match else None
+
+class BatchDispatcher:
+    """Queue of LLM batches worked through by background threads.
+
+    analyse(batch) does the API call and returns its result, on_result(batch, result) applies it
+    (Firestore updates, emails). Each request first takes one token from the requests-per-minute
+    bucket and its estimated prompt size from the tokens-per-minute bucket. Rate limit errors are
+    retried with exponential backoff, anything else goes to on_error(batch, error).
+    """
+
+    def __init__(self, analyse, on_result, on_error=None, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM,
+                 concurrency=1, max_retries=MAX_RETRIES, sleep=time.sleep):
+        self.analyse = analyse
+        self.on_result = on_result
+        self.on_error = on_error or (lambda batch, error: print(f"LLM Error: {error}"))
+        self.request_bucket = TokenBucket(rpm, sleep=sleep)
+        self.token_bucket = TokenBucket(tpm, sleep=sleep)
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.queue = queue.Queue()
+        self.threads = []
+
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "submitted": 0,
+            "sent": 0,
+            "completed": 0,
+            "failed": 0,
+            "in_flight": 0,
+            "rate_limited": 0, # 429s seen, including ones that succeeded on retry
+            "skipped_api": 0, # batches applied from submit_result without a request
+            "total_wait_seconds": 0.0, # time batches spent queued + throttled before being sent
+            "max_wait_seconds": 0.0,
+            "last_wait_seconds": 0.0
+        }
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self.worker, name=f"llm-dispatcher-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def submit(self, batch, tokens=1):
+        """Queues a batch for analysis and returns straight away. tokens is its estimated prompt size."""
+        with self.stats_lock:
+            self.stats["submitted"] += 1
+        self.queue.put((batch, tokens, time.monotonic(), None))
+
+    def submit_result(self, batch, result):
+        """Queues a batch whose result is already known (e.g. cached), on_result runs without an API call."""
+        with self.stats_lock:
+            self.stats["submitted"] += 1
+        self.queue.put((batch, 0, time.monotonic(), result))
+
+    def count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def send(self, batch, tokens, queued_at):
+        """One batch through the rate limits and the API, retrying 429s. Returns the analysis result."""
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(tokens)
+            if attempt == 0:
+                # wait = time in the queue plus time held by the buckets, up to the first send
+                self.record_wait(time.monotonic() - queued_at)
+            try:
+                return self.analyse(batch)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                self.count("rate_limited")
+                self.request_bucket.drain()
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+                    delay += random.uniform(0, delay / 2) # jitter so workers don't retry in lockstep
+                print(f"RATE LIMIT HIT: retrying batch in {delay:.1f}s (attempt {attempt + 1}/{self.max_retries}).")
+                self.sleep(delay)
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None: # stop() sentinel
+                self.queue.task_done()
+                return
+
+            batch, tokens, queued_at, result = item
+            self.count("in_flight")
+            try:
+                if result is None:
+                    result = self.send(batch, tokens, queued_at)
+                else:
+                    self.count("skipped_api")
+                self.on_result(batch, result)
+                self.count("completed")
+            except Exception as e:
+                self.count("failed")
+                self.on_error(batch, e)
+            finally:
+                self.count("in_flight", -1)
+                self.queue.task_done()
+
+    def record_wait(self, waited):
+        with self.stats_lock:
+            self.stats["sent"] += 1
+            self.stats["total_wait_seconds"] += waited
+            self.stats["last_wait_seconds"] = waited
+            self.stats["max_wait_seconds"] = max(self.stats["max_wait_seconds"], waited)
+
+    def metrics(self):
+        """Snapshot of queue depth, throughput and how long batches waited before being sent."""
+        with self.stats_lock:
+            snapshot = dict(self.stats)
+        snapshot["queue_depth"] = self.queue.qsize()
+        sent = snapshot["sent"]
+        snapshot["avg_wait_seconds"] = snapshot["total_wait_seconds"] / sent if sent else 0.0
+        return snapshot
+
+    def join(self):
+        """Blocks until every queued batch has been handled."""
+        self.queue.join()
+
+    def stop(self, timeout=None):
+        """Finishes what is queued, then stops the worker threads."""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
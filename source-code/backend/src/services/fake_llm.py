@@ -0,0 +1,75 @@
+#fake_llm.py stands in for the Gemini client when testing the dispatcher, no API key or credits needed
+import re, json, time, random, threading
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModels:
+    """Mimics client.models.generate_content, answering with one analysis object per 'ID xxx:' line."""
+
+    def __init__(self, latency=0.5, rate_limit_every=0, malformed_every=0, chunk_chars=256):
+        self.latency = latency # seconds each call takes, like a real round trip
+        self.rate_limit_every = rate_limit_every # every Nth call raises a 429, 0 never does
+        self.malformed_every = malformed_every # every Nth object in a reply is broken JSON, 0 never
+        self.chunk_chars = chunk_chars # size of each streamed piece
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def start_call(self):
+        with self.lock:
+            self.calls += 1
+            call_number = self.calls
+        if self.rate_limit_every and call_number % self.rate_limit_every == 0:
+            time.sleep(self.latency)
+            raise Exception("429 RESOURCE_EXHAUSTED. {'error': {'code': 429, 'details': [{'retryDelay': '1s'}]}}")
+
+    def generate_content(self, model=None, config=None, contents=""):
+        self.start_call()
+        time.sleep(self.latency)
+        return FakeResponse(self.reply_text(contents))
+
+    def generate_content_stream(self, model=None, config=None, contents=""):
+        """Same reply as generate_content, handed out a chunk at a time with the latency spread across them."""
+        self.start_call()
+        text = self.reply_text(contents)
+        chunks = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        for chunk in chunks:
+            time.sleep(self.latency / len(chunks))
+            yield FakeResponse(chunk)
+
+    def reply_text(self, contents):
+        results = []
+        for event_id in re.findall(r"^\s*ID (\S+?):", contents, re.MULTILINE):
+            score = random.randint(1, 10)
+            results.append({
+                "event_id": event_id,
+                "analysis": {
+                    "incident_overview": f"Fake analysis for {event_id}.",
+                    "business_impact": "None, this is a test.",
+                    "technical_root_cause": "Generated by FakeLLMClient."
+                },
+                "mitigation_plan": [{
+                    "step_number": 1,
+                    "action_title": "Review logs manually",
+                    "who_should_execute": "Network Engineer",
+                    "detailed_instructions": "Nothing to do, fake result.",
+                    "why_this_is_necessary": "It isn't."
+                }],
+                "risk_assessment": {
+                    "score": score,
+                    "severity": "Critical" if score >= 8 else "High" if score >= 6 else "Medium" if score >= 4 else "Low",
+                    "justification": "Random score from the fake client."
+                }
+            })
+        objects = [json.dumps(result) for result in results]
+        if self.malformed_every:
+            for i in range(self.malformed_every - 1, len(objects), self.malformed_every):
+                objects[i] = objects[i].replace('"event_id": ', '"event_id" ', 1) # missing colon
+        return "[" + ", ".join(objects) + "]"
+
+class FakeLLMClient:
+    """Drop-in for genai.Client in log-forwarder (--fake-llm) and the benchmarks."""
+
+    def __init__(self, latency=0.5, rate_limit_every=0, malformed_every=0):
+        self.models = FakeModels(latency, rate_limit_every, malformed_every)
@@ -1,6 +1,9 @@
 import firebase_admin, os, threading
 from firebase_admin import credentials, firestore
-from security.crypto import decrypt_payload
+from services.incident_cache import IncidentCache, order_key
+from services.search_index import SearchIndex
+from services.broadcaster import IncidentBroadcaster
+from services.mutations import IncidentMutator
 
 current_dir = os.path.dirname(__file__)
 cred = credentials.Certificate(os.path.join(current_dir, "..", "serviceAccountKey.json"))
@@ -11,51 +14,36 @@ if not firebase_admin._apps:
 db = firestore.client() 
 
 # CACHE 1: INCIDENTS 
-GLOBAL_INCIDENTS_CACHE = []
-incident_cache_lock = threading.Lock()
+# keyed by doc id and updated per change, a note on one incident only decrypts that incident (services/incident_cache.py)
+# the first push is the whole collection, big ones are decrypted over DECRYPT_WORKERS processes (0 keeps it in this one)
+DECRYPT_WORKERS = int(os.getenv("DECRYPT_WORKERS", str(os.cpu_count() if (os.cpu_count() or 1) > 1 else 0)))
+incident_cache = IncidentCache(workers=DECRYPT_WORKERS)
+# every change the cache applies is pushed to the dashboards on /api/incidents/stream
+incident_broadcaster = IncidentBroadcaster()
+incident_cache.subscribe(incident_broadcaster.publish)
+# full-text search over the decrypted text, summaries and notes, updated from the same change lists
+incident_search = SearchIndex(incident_cache.get, order_key)
+incident_cache.subscribe(incident_search.on_change)
+# dashboard edits: written on their own thread pool, shown in the cache before Firestore confirms them
+FIRESTORE_WRITE_WORKERS = int(os.getenv("FIRESTORE_WRITE_WORKERS", "32"))
+incident_mutator = IncidentMutator(db, incident_cache, workers=FIRESTORE_WRITE_WORKERS)
 
 def on_incident_snapshot(col_snapshot, changes, read_time):
-    global GLOBAL_INCIDENTS_CACHE
     print(f"\n[SYNC] Firebase pushed an INCIDENT update! Updating RAM cache...")
-    updated_list = []
-    
-    for doc in col_snapshot:
-        data = doc.to_dict()
-        decrypted_event = decrypt_payload(data.get("data"))
-        if decrypted_event is None: continue
-
-        ai_insights = None
-        raw_insights = data.get("ai_insights")
-        if raw_insights:
-            if isinstance(raw_insights, list) and len(raw_insights) > 0:
-                ai_insights = [decrypt_payload(raw_insights[0])]
-            elif isinstance(raw_insights, str):
-                ai_insights = [decrypt_payload(raw_insights)]
-
-        raw_notes = data.get("user_notes", [])
-        decrypted_notes = [decrypt_payload(n) for n in raw_notes if n is not None]
-
-        updated_list.append({
-            "id": doc.id,
-            "event": decrypted_event,
-            "ai_insights": ai_insights,
-            "analysis_status": data.get("analysis_status", "pending"),
-            "timestamp": data.get("timestamp"),
-            "user_notes": decrypted_notes,
-            "completed_steps": data.get("completed_steps", []),
-            "assigned_to": data.get("assigned_to", "")
-        })
-    
-    with incident_cache_lock:
-        GLOBAL_INCIDENTS_CACHE = updated_list
-    print("[SYNC] Incident Cache updated successfully.")
+    cold_start = incident_cache.cold_start_seconds is None
+    applied = incident_cache.on_snapshot(col_snapshot, changes, read_time)
+    if cold_start:
+        print(f"[SYNC] Cold start: {len(incident_cache)} incidents cached {incident_cache.cold_start_seconds:.2f}s "
+              f"after the listener started ({DECRYPT_WORKERS} decrypt workers).")
+    print(f"[SYNC] Incident Cache updated successfully ({applied} changed of {len(incident_cache)}).")
 
 # CACHE 2: USERS 
 GLOBAL_USERS_CACHE = []
+USERS_CACHE_VERSION = 0 # bumped with every push, lets the API answer unchanged polls with a 304
 users_cache_lock = threading.Lock()
 
 def on_users_snapshot(col_snapshot, changes, read_time):
-    global GLOBAL_USERS_CACHE
+    global GLOBAL_USERS_CACHE, USERS_CACHE_VERSION
     print(f"\n[SYNC] Firebase pushed a USERS update! Updating RAM cache...")
     updated_users = []
     
@@ -66,6 +54,7 @@ def on_users_snapshot(col_snapshot, changes, read_time):
         
     with users_cache_lock:
         GLOBAL_USERS_CACHE = updated_users
+        USERS_CACHE_VERSION += 1
     print("[SYNC] Users Cache updated successfully.")
 
 
@@ -85,10 +74,47 @@ users_watch = users_query.on_snapshot(on_users_snapshot)
 # FASTAPI ROUTE HANDLERS 
 def get_incidents():
     """Returns the decrypted incidents from local RAM."""
-    with incident_cache_lock:
-        return GLOBAL_INCIDENTS_CACHE
+    return incident_cache.list()
+
+def get_incidents_versioned():
+    """(version, incidents), the version goes up every time the incident cache changes."""
+    return incident_cache.list_versioned()
+
+def query_incidents(**filters):
+    """One filtered page of incidents from local RAM, see IncidentCache.query for the filters."""
+    return incident_cache.query(**filters)
+
+async def update_incident(doc_id, fields, local=None):
+    """Updates one incident without blocking the event loop, see IncidentMutator.update."""
+    await incident_mutator.update(doc_id, fields, local)
+
+async def update_incidents(updates):
+    """Many incident updates as batched writes, per-id results, see IncidentMutator.update_many."""
+    return await incident_mutator.update_many(updates)
+
+def search_incidents(query, limit=20):
+    """Best matching incidents for a text query from the RAM search index, each with its search_score."""
+    results = []
+    for doc_id, score in incident_search.search(query, limit):
+        incident = incident_cache.get(doc_id)
+        if incident is not None: # removed since the search
+            results.append(dict(incident, search_score=score))
+    return results
+
+def get_analytics_summary(since=None, until=None):
+    """Precomputed dashboard counts from local RAM, kept up to date by the incident listener."""
+    return incident_cache.analytics_summary(since, until)
+
+def get_analytics_histogram(granularity="hour", since=None, until=None):
+    """Incidents per time bucket from local RAM."""
+    return incident_cache.analytics_histogram(granularity, since, until)
 
 def get_users():
     """Returns the team members list from local RAM."""
     with users_cache_lock:
-        return GLOBAL_USERS_CACHE
\ No newline at end of file
+        return GLOBAL_USERS_CACHE
+
+def get_users_versioned():
+    """(version, users) read together."""
+    with users_cache_lock:
+        return USERS_CACHE_VERSION, GLOBAL_USERS_CACHE
@@ -0,0 +1,350 @@
+#incident_cache.py holds the decrypted incidents for the API, updated from the listener's change list instead of rebuilt
+import time, heapq, base64, bisect, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from security.crypto import decrypt_payload, decrypt_many, remember_decrypted
+from services.analytics import AnalyticsRollup, utc_seconds
+
+# a cold start decrypts the whole collection, above this many documents it's split over worker processes
+# (Fernet + json.loads hold the GIL, so threads wouldn't help)
+PARALLEL_MIN_DOCS = 20000
+DECODE_CHUNK_DOCS = 2000 # per task, big enough that pickling doesn't dominate
+# spawn rather than fork, decoding runs on the Firestore listener thread and forking a process with
+# gRPC threads running isn't safe. Scripts without a __main__ guard (the tests) switch to "fork".
+DECODE_START_METHOD = "spawn"
+BULK_REORDER_DOCS = 1000 # pushes bigger than this re-sort the order once rather than inserting each doc
+
+def decode_incident(doc_id, data, decrypt=decrypt_payload):
+    """The API's view of one incident document, or None if its payload won't decrypt."""
+    decrypted_event = decrypt(data.get("data"))
+    if decrypted_event is None:
+        return None
+
+    ai_insights = None
+    raw_insights = data.get("ai_insights")
+    if raw_insights:
+        if isinstance(raw_insights, list) and len(raw_insights) > 0:
+            ai_insights = [decrypt(raw_insights[0])]
+        elif isinstance(raw_insights, str):
+            ai_insights = [decrypt(raw_insights)]
+
+    raw_notes = [n for n in data.get("user_notes", []) if n is not None]
+    if decrypt is decrypt_payload:
+        decrypted_notes = decrypt_many(raw_notes) # the same note pasted on several incidents is decrypted once
+    else:
+        decrypted_notes = [decrypt(n) for n in raw_notes]
+
+    return {
+        "id": doc_id,
+        "event": decrypted_event,
+        "ai_insights": ai_insights,
+        "analysis_status": data.get("analysis_status", "pending"),
+        "timestamp": data.get("timestamp"),
+        "user_notes": decrypted_notes,
+        "completed_steps": data.get("completed_steps", []),
+        "assigned_to": data.get("assigned_to", "")
+    }
+
+def decode_chunk(docs):
+    """Worker side of a parallel load: [(doc_id, data)] -> [(doc_id, incident or None)]."""
+    return [(doc_id, decode_incident(doc_id, data)) for doc_id, data in docs]
+
+def remember_incident(data, incident):
+    """Seeds this process's decrypt cache with the values a worker decrypted for one document, so the
+    next push for it (a note added, say) only decrypts what actually changed."""
+    remember_decrypted(data.get("data"), incident["event"])
+    raw_insights = data.get("ai_insights")
+    if isinstance(raw_insights, list) and len(raw_insights) > 0:
+        raw_insights = raw_insights[0]
+    if incident["ai_insights"]:
+        remember_decrypted(raw_insights, incident["ai_insights"][0])
+    raw_notes = [n for n in data.get("user_notes", []) if n is not None]
+    for token, note in zip(raw_notes, incident["user_notes"]):
+        remember_decrypted(token, note)
+
+# secondary indexes kept alongside the display order, each maps a value to the sorted order keys holding it
+INDEXED_FIELDS = ("status", "assigned_to", "filename", "risk")
+
+def index_values(incident):
+    """The value each secondary index files an incident under."""
+    insights = incident.get("ai_insights") or [None]
+    risk = insights[0].get("risk_score") if isinstance(insights[0], dict) else None
+    event = incident.get("event") if isinstance(incident.get("event"), dict) else {}
+    return {
+        "status": incident.get("analysis_status"),
+        "assigned_to": incident.get("assigned_to", ""),
+        "filename": event.get("original_filename"),
+        "risk": risk if isinstance(risk, int) else None
+    }
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(f"{key[0]!r}|{key[1]}".encode()).decode()
+
+def decode_cursor(cursor):
+    """The order key a cursor points at. Raises ValueError for anything that isn't one of ours."""
+    try:
+        seconds, doc_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return (float(seconds), doc_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+def order_key(incident):
+    """Sort key for newest first (same order as the listener's query), unstamped docs count as newest."""
+    timestamp = incident.get("timestamp")
+    seconds = timestamp.timestamp() if hasattr(timestamp, "timestamp") else float("inf")
+    return (-seconds, incident["id"])
+
+class IncidentCache:
+    """Decrypted incidents keyed by doc id, plus the ids in display order.
+
+    on_snapshot() applies the ADDED/MODIFIED/REMOVED changes Firestore sends with each push, so only
+    changed documents are decrypted. The first push lists every document as ADDED, with workers > 0
+    a push that big is decrypted across that many processes.
+    """
+
+    def __init__(self, decrypt=decrypt_payload, workers=0):
+        self.decrypt = decrypt
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.incidents = {} # doc id -> decoded incident
+        self.keys = {} # doc id -> its order_key, to find it again in `order`
+        self.order = [] # sorted order_keys
+        self.indexes = {field: {} for field in INDEXED_FIELDS} # field -> value -> sorted order_keys
+        self.index_entries = {} # doc id -> its index_values, to find it again in the indexes
+        self.analytics = AnalyticsRollup() # dashboard counts, adjusted per add/remove like the indexes
+        self.listing = [] # incidents in order, rebuilt on the first read after a change
+        self.dirty = False
+        self.version = 0 # bumped on every change that touches the cache
+        self.observers = [] # see subscribe()
+        self.decrypted_docs = 0
+        self.created = time.perf_counter()
+        self.cold_start_seconds = None # listener start to a fully populated cache, set by the first push
+        self.cold_start_docs = 0
+
+    def on_snapshot(self, col_snapshot, changes, read_time):
+        # decrypt outside the lock, readers only wait for the dict/list updates
+        decoded = []
+        to_decode = []
+        for change in changes:
+            doc = change.document
+            if change.type.name == "REMOVED":
+                decoded.append((doc.id, None))
+            else:
+                to_decode.append((doc.id, doc.to_dict()))
+        if self.workers > 0 and len(to_decode) >= PARALLEL_MIN_DOCS:
+            decoded.extend(self.decode_parallel(to_decode))
+        else:
+            decoded.extend((doc_id, decode_incident(doc_id, data, self.decrypt)) for doc_id, data in to_decode)
+        self.decrypted_docs += len(to_decode)
+
+        applied = self.apply(decoded)
+        if self.cold_start_seconds is None:
+            self.cold_start_seconds = time.perf_counter() - self.created
+            self.cold_start_docs = len(to_decode)
+        return applied
+
+    def decode_parallel(self, docs):
+        """decode_incident over a big batch of docs in worker processes, results in the same order."""
+        chunks = [docs[i:i + DECODE_CHUNK_DOCS] for i in range(0, len(docs), DECODE_CHUNK_DOCS)]
+        # the pool only lives for this one load, later pushes are a handful of docs
+        context = multiprocessing.get_context(DECODE_START_METHOD)
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            decoded = []
+            for result in executor.map(decode_chunk, chunks):
+                decoded.extend(result)
+        # the workers' decrypt caches went with them, the parent's gets filled from their results
+        if self.decrypt is decrypt_payload:
+            for (_, data), (_, incident) in zip(docs, decoded):
+                if incident is not None:
+                    remember_incident(data, incident)
+        return decoded
+
+    def apply(self, decoded):
+        """Puts decoded (doc_id, incident or None) pairs into the cache, None removes."""
+        if not decoded:
+            return 0
+        with self.lock:
+            self.apply_locked(decoded)
+        self.notify(decoded)
+        return len(decoded)
+
+    def apply_locked(self, decoded):
+        """apply() for a caller already holding the lock, it calls notify() once it lets go."""
+        bulk = len(decoded) > BULK_REORDER_DOCS
+        for doc_id, incident in decoded:
+            if bulk: # the order and indexes are rebuilt once below instead of an insert per doc
+                if self.keys.pop(doc_id, None) is not None:
+                    self.analytics.remove(self.incidents.pop(doc_id), self.index_entries.pop(doc_id))
+            else:
+                self.remove(doc_id)
+            if incident is not None: # unreadable docs are left out, like before
+                key = order_key(incident)
+                values = index_values(incident)
+                self.incidents[doc_id] = incident
+                self.keys[doc_id] = key
+                self.index_entries[doc_id] = values
+                self.analytics.add(incident, values)
+                if not bulk:
+                    bisect.insort(self.order, key)
+                    for field, value in values.items():
+                        bisect.insort(self.indexes[field].setdefault(value, []), key)
+        if bulk:
+            self.rebuild_indexes()
+        self.dirty = True
+        self.version += 1
+
+    def notify(self, decoded):
+        for callback in self.observers: # outside the lock, so an observer can read the cache
+            try:
+                callback(decoded)
+            except Exception as e:
+                print(f"[CACHE] Change observer failed: {e}")
+
+    def patch(self, doc_id, change):
+        """Optimistic local edit ahead of the listener: change(incident) returns the fields to overwrite.
+        Returns (before, after) for revert(), or None if the incident isn't cached."""
+        return self.patch_many([(doc_id, change)]).get(doc_id)
+
+    def patch_many(self, changes):
+        """patch() for [(doc_id, change)] in one apply. Returns {doc_id: (before, after)} for the cached ones.
+
+        before is read under the same lock hold as the apply, so a listener push can't land in between
+        and be overwritten by a patch of the older copy.
+        """
+        patched = {}
+        with self.lock:
+            for doc_id, change in changes:
+                before = self.incidents.get(doc_id)
+                if before is not None and doc_id not in patched:
+                    patched[doc_id] = (before, dict(before, **change(before)))
+            applied = [(doc_id, after) for doc_id, (_, after) in patched.items()]
+            if applied:
+                self.apply_locked(applied)
+        if applied:
+            self.notify(applied)
+        return patched
+
+    def revert(self, doc_id, before, after):
+        """Undoes patch() if the write failed, unless the listener has replaced the incident since."""
+        self.revert_many({doc_id: (before, after)})
+
+    def revert_many(self, patched):
+        with self.lock: # checked and undone in one hold, like patch_many
+            undo = [(doc_id, before) for doc_id, (before, after) in patched.items() if self.incidents.get(doc_id) is after]
+            if undo:
+                self.apply_locked(undo)
+        if undo:
+            self.notify(undo)
+
+    def subscribe(self, callback):
+        """callback(changes) is called after every applied change with the (doc_id, incident or None) pairs."""
+        self.observers.append(callback)
+
+    def rebuild_indexes(self):
+        self.order = sorted(self.keys.values())
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        for key in self.order: # walking in order keeps every index list sorted without sorting them
+            for field, value in self.index_entries[key[1]].items():
+                self.indexes[field].setdefault(value, []).append(key)
+
+    def remove(self, doc_id):
+        key = self.keys.pop(doc_id, None)
+        if key is None:
+            return
+        values = self.index_entries.pop(doc_id)
+        self.analytics.remove(self.incidents.pop(doc_id), values)
+        del self.order[bisect.bisect_left(self.order, key)]
+        for field, value in values.items():
+            keys = self.indexes[field][value]
+            del keys[bisect.bisect_left(keys, key)]
+            if not keys:
+                del self.indexes[field][value]
+
+    def query(self, limit=50, cursor=None, status=None, assigned_to=None, filename=None,
+              risk_min=None, risk_max=None, since=None, until=None, newest_first=True):
+        """One page of incidents matching every filter given, and the cursor for the next page.
+
+        The most selective index picks the candidates, so a page costs about O(limit + log n) rather
+        than a scan. since/until are datetimes, naive ones are taken as UTC. The cursor is None once the last page is reached.
+        """
+        equals = {"status": status, "assigned_to": assigned_to, "filename": filename}
+        equals = {field: value for field, value in equals.items() if value is not None}
+        start_key = decode_cursor(cursor) if cursor else None
+        with self.lock:
+            # candidate key lists, every one sorted. An equality filter gives one list, a risk range
+            # one per score in range (merged below), no filter the full order
+            sources = None
+            for field, value in equals.items():
+                candidates = [self.indexes[field].get(value, [])]
+                if sources is None or len(candidates[0]) < sum(map(len, sources)):
+                    sources = candidates
+            if risk_min is not None or risk_max is not None:
+                low = 1 if risk_min is None else risk_min
+                high = 10 if risk_max is None else risk_max
+                candidates = [keys for risk, keys in self.indexes["risk"].items()
+                              if risk is not None and low <= risk <= high]
+                if sources is None or sum(map(len, candidates)) < sum(map(len, sources)):
+                    sources = candidates
+            if sources is None:
+                sources = [self.order]
+
+            # keys run from newest (smallest -seconds) to oldest, the time window is a slice of each list
+            first = (-utc_seconds(until),) if until is not None else None
+            last = -utc_seconds(since) if since is not None else None
+            ranges = []
+            for keys in sources:
+                lo = bisect.bisect_left(keys, first) if first is not None else 0
+                hi = bisect.bisect_right(keys, last, key=lambda k: k[0]) if last is not None else len(keys)
+                if start_key is not None:
+                    if newest_first:
+                        lo = max(lo, bisect.bisect_right(keys, start_key))
+                    else:
+                        hi = min(hi, bisect.bisect_left(keys, start_key))
+                if newest_first:
+                    ranges.append(map(keys.__getitem__, range(lo, hi)))
+                else:
+                    ranges.append(map(keys.__getitem__, range(hi - 1, lo - 1, -1)))
+            merged = ranges[0] if len(ranges) == 1 else heapq.merge(*ranges, reverse=not newest_first)
+
+            page = []
+            last_key = None
+            for key in merged:
+                values = self.index_entries[key[1]]
+                if any(values[field] != value for field, value in equals.items()):
+                    continue
+                if risk_min is not None and (values["risk"] is None or values["risk"] < risk_min):
+                    continue
+                if risk_max is not None and (values["risk"] is None or values["risk"] > risk_max):
+                    continue
+                page.append(self.incidents[key[1]])
+                last_key = key
+                if len(page) >= limit:
+                    break
+        next_cursor = encode_cursor(last_key) if len(page) >= limit else None
+        return page, next_cursor
+
+    def list(self):
+        """Every incident, newest first. The list is shared, callers mustn't modify it."""
+        return self.list_versioned()[1]
+
+    def list_versioned(self):
+        """(version, list()) read together, the version only changes when the list does."""
+        with self.lock:
+            if self.dirty:
+                self.listing = [self.incidents[doc_id] for _, doc_id in self.order]
+                self.dirty = False
+            return self.version, self.listing
+
+    def analytics_summary(self, since=None, until=None):
+        with self.lock:
+            return self.analytics.summary(since, until)
+
+    def analytics_histogram(self, granularity="hour", since=None, until=None):
+        with self.lock:
+            return self.analytics.histogram(granularity, since, until)
+
+    def get(self, doc_id):
+        with self.lock:
+            return self.incidents.get(doc_id)
+
+    def __len__(self):
+        return len(self.incidents)
@@ -0,0 +1,107 @@
+#json_stream.py pulls complete objects out of a streamed JSON list as the text arrives, one bad object doesn't sink the rest
+import re, json
+
+# a backslash that doesn't start a valid JSON escape, e.g. C:\Windows written unescaped
+pattern_bad_escape = re.compile(r'\\(?!["\\/bfnrtu])')
+pattern_string_special = re.compile(r'["\\]')
+pattern_object_special = re.compile(r'["{}]')
+
+class JSONObjectStream:
+    """Incremental parser for the LLM's "[{...}, {...}]" reply.
+
+    feed() takes the next piece of text and returns every top level object finished so far. Anything
+    outside an object (the opening bracket, commas, ```json fences) is skipped, so a bare object or a
+    fenced reply works too. An object that won't parse is counted in `malformed` and skipped.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0 # how far into buffer has been scanned
+        self.start = None # buffer index of the open object's "{", None between objects
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.parsed = 0
+        self.malformed = 0
+        self.errors = [] # (error, first 200 chars of the object) for logging
+
+    def feed(self, text):
+        """Adds text and returns the objects it completed, in order."""
+        self.buffer += text
+        objects = []
+        buffer = self.buffer
+        end = len(buffer)
+        i = self.pos
+        # jump between the characters that matter rather than stepping through every one
+        while i < end:
+            if self.start is None:
+                i = buffer.find("{", i)
+                if i < 0:
+                    i = end
+                    break
+                self.start = i
+                self.depth = 1
+                i += 1
+            elif self.in_string:
+                if self.escaped: # skip the char after a backslash, \" doesn't end the string
+                    self.escaped = False
+                    i += 1
+                    continue
+                match = pattern_string_special.search(buffer, i)
+                if match is None:
+                    i = end
+                elif match.group() == '"':
+                    self.in_string = False
+                    i = match.end()
+                else:
+                    self.escaped = True
+                    i = match.end()
+            else:
+                match = pattern_object_special.search(buffer, i)
+                if match is None:
+                    i = end
+                    break
+                char = match.group()
+                i = match.end()
+                if char == '"':
+                    self.in_string = True
+                elif char == "{":
+                    self.depth += 1
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        objects.extend(self.parse(buffer[self.start:i]))
+                        self.start = None
+
+        # drop what's been dealt with so the buffer only ever holds the object being streamed
+        keep_from = i if self.start is None else self.start
+        self.buffer = buffer[keep_from:]
+        if self.start is not None:
+            self.start = 0
+        self.pos = i - keep_from
+        return objects
+
+    def parse(self, text):
+        # strict=False lets raw tabs/newlines inside strings through, the prompt asks for them escaped but they still turn up
+        try:
+            obj = json.loads(text, strict=False)
+        except json.JSONDecodeError as e:
+            try:
+                obj = json.loads(pattern_bad_escape.sub(r"\\\\", text), strict=False) # second go with the backslashes doubled
+            except json.JSONDecodeError:
+                self.malformed += 1
+                self.errors.append((str(e), text[:200]))
+                return []
+        self.parsed += 1
+        return [obj]
+
+    def close(self):
+        """Call once the stream ends. Returns True if it stopped in the middle of an object."""
+        truncated = self.start is not None
+        if truncated:
+            self.malformed += 1
+            self.errors.append(("response ended mid-object", self.buffer[:200]))
+        self.buffer = ""
+        self.pos = 0
+        self.start = None
+        return truncated
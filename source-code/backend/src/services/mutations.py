@@ -0,0 +1,86 @@
+#mutations.py runs the dashboard's incident updates on a thread pool, with the cache showing them before Firestore confirms
+import asyncio
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from starlette.concurrency import run_in_threadpool
+from services.bulk_writer import MAX_BATCH_WRITES
+
+DEFAULT_WORKERS = 32 # concurrent Firestore writes, more requests queue for a free thread
+
+class IncidentMutator:
+    """Applies updates to incident documents without blocking the event loop.
+
+    update() patches the incident cache straight away (so the next GET, and the SSE stream, show the
+    change), then does the blocking Firestore update on a dedicated pool, not FastAPI's shared one.
+    If the write fails the cache edit is rolled back. The listener's push for the write replaces the
+    optimistic copy with the real document either way.
+
+    The cache edits run on FastAPI's threadpool too, they wait on the cache lock and their observers
+    (search reindex, SSE fan-out) can take a while for a bulk request of thousands of incidents.
+    """
+
+    def __init__(self, db, cache, collection="incidents", workers=DEFAULT_WORKERS):
+        self.db = db
+        self.collection = db.collection(collection)
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="firestore-write")
+        self.writes = 0
+        self.failures = 0
+
+    async def update(self, doc_id, fields, local=None):
+        """fields go to Firestore as they are. local(incident) returns the same change in the cache's
+        decrypted form, leave it out if the fields can be copied as they are."""
+        patched = await run_in_threadpool(self.cache.patch, doc_id, local or (lambda incident: fields))
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, partial(self.collection.document(doc_id).update, fields))
+        except Exception:
+            self.failures += 1
+            if patched is not None:
+                await run_in_threadpool(self.cache.revert, doc_id, *patched)
+            raise
+        self.writes += 1
+
+    async def update_many(self, updates):
+        """update() for [(doc_id, fields, local or None)], written as batched commits of up to 500
+        (Firestore's limit) in parallel on the pool. Returns {doc_id: "ok" | "not_found" | "error: ..."}.
+
+        Ids missing from the cache are skipped as not_found, Firestore fails a whole batch over one
+        update to a missing doc. A failed commit only rolls back and fails its own chunk.
+        """
+        fields_by_id = {}
+        for doc_id, fields, local in updates:
+            fields_by_id.setdefault(doc_id, (fields, local))
+        patched = await run_in_threadpool(self.cache.patch_many, [(doc_id, local or (lambda incident, fields=fields: fields))
+                                                                  for doc_id, (fields, local) in fields_by_id.items()])
+        results = {doc_id: "not_found" for doc_id in fields_by_id if doc_id not in patched}
+        ids = list(patched)
+        chunks = [ids[i:i + MAX_BATCH_WRITES] for i in range(0, len(ids), MAX_BATCH_WRITES)]
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(
+            *(loop.run_in_executor(self.executor, self.commit, [(doc_id, fields_by_id[doc_id][0]) for doc_id in chunk])
+              for chunk in chunks),
+            return_exceptions=True
+        )
+        failed = {}
+        for chunk, outcome in zip(chunks, outcomes):
+            if isinstance(outcome, Exception):
+                self.failures += 1
+                failed.update((doc_id, patched[doc_id]) for doc_id in chunk)
+                results.update((doc_id, f"error: {outcome}") for doc_id in chunk)
+            else:
+                self.writes += len(chunk)
+                results.update((doc_id, "ok") for doc_id in chunk)
+        if failed:
+            await run_in_threadpool(self.cache.revert_many, failed)
+        return results
+
+    def commit(self, updates):
+        """One WriteBatch of (doc_id, fields) updates, runs on the pool."""
+        batch = self.db.batch()
+        for doc_id, fields in updates:
+            batch.update(self.collection.document(doc_id), fields)
+        batch.commit()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
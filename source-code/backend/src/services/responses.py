@@ -0,0 +1,99 @@
+#responses.py serialises cached listings once per version and answers repeat polls with 304s
+import gzip, json, hashlib, datetime, threading
+from fastapi import Request, Response
+
+try:
+    import orjson # much faster than json for big listings
+except ImportError:
+    orjson = None
+try:
+    import brotli # optional, smaller than gzip for JSON
+except ImportError:
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024 # below this the headers cost more than compression saves
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5 # brotli's higher levels are far slower for little gain on JSON
+
+def encode_default(obj):
+    """Types the encoders can't do themselves, rendered the way FastAPI's jsonable_encoder would."""
+    if isinstance(obj, (datetime.datetime, datetime.date)): # incl. Firestore's DatetimeWithNanoseconds
+        return obj.isoformat()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    return str(obj)
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload, default=encode_default)
+    return json.dumps(payload, default=encode_default, separators=(",", ":")).encode()
+
+class Payload:
+    """One serialised response body, its strong ETag and compressed copies (made on first request)."""
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"' # from the bytes, so restarts can't reuse one
+        self.encoded = {"identity": body}
+        self.lock = threading.Lock()
+
+    def encode(self, encoding):
+        """The body in the given content-coding (br, gzip or identity)."""
+        with self.lock:
+            if encoding not in self.encoded:
+                if encoding == "br":
+                    self.encoded[encoding] = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                else:
+                    self.encoded[encoding] = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+            return self.encoded[encoding]
+
+class VersionedPayload:
+    """Holds the Payload for the latest version of a cache, building it at most once per version."""
+
+    def __init__(self):
+        self.version = None
+        self.payload = None
+        self.lock = threading.Lock()
+        self.builds = 0
+
+    def get(self, version, build):
+        """build() returns the data to serialise, only called when version has moved on."""
+        with self.lock: # concurrent polls after a change wait for one build instead of all doing it
+            if self.version != version or self.payload is None:
+                self.payload = Payload(dumps(build()))
+                self.version = version
+                self.builds += 1
+            return self.payload
+
+def pick_encoding(accept_encoding: str, size: int):
+    if size < MIN_COMPRESS_BYTES:
+        return "identity"
+    offered = {part.split(";")[0].strip().lower() for part in accept_encoding.split(",")}
+    if "br" in offered and brotli is not None:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return "identity"
+
+def etag_matches(if_none_match: str, etag: str):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # weak comparison for If-None-Match, so a proxy's W/ prefix still matches
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags
+
+def send_payload(request: Request, payload: Payload) -> Response:
+    """304 if the client already has this version, otherwise the body in the best encoding it accepts."""
+    headers = {"ETag": payload.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match", ""), payload.etag):
+        return Response(status_code=304, headers=headers)
+    encoding = pick_encoding(request.headers.get("accept-encoding", ""), len(payload.body))
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.encode(encoding), media_type="application/json", headers=headers)
+
+def send_json(request: Request, data) -> Response:
+    """send_payload for a one-off result (a page, a filtered query), serialised per request."""
+    return send_payload(request, Payload(dumps(data)))
@@ -0,0 +1,203 @@
+#search_index.py is an in-memory inverted index over the decrypted incidents, Firestore only holds ciphertext so it can't search them
+import re, math, bisect, threading, itertools
+
+# words, plus dotted/dashed runs kept whole so an IP or hostname is one term (its parts are indexed too)
+pattern_token = re.compile(r"[a-z0-9]+(?:[._:@/-][a-z0-9]+)*")
+pattern_token_part = re.compile(r"[a-z0-9]+")
+
+# a term in the AI summary outranks one in a note, which outranks one in the raw log line
+TIER_SUMMARY = 3
+TIER_NOTE = 2
+TIER_TEXT = 1
+TIERS = (TIER_SUMMARY, TIER_NOTE, TIER_TEXT)
+
+MIN_PREFIX_CHARS = 2 # shorter prefixes match too much to be useful
+MAX_PREFIX_TERMS = 64 # most frequent expansions of a prefix kept
+MAX_QUERY_TERMS = 6
+SORT_LIMIT = 2048 # a candidate set this small is sorted directly, bigger ones are walked in recency order
+BULK_REINDEX_DOCS = 1000 # pushes bigger than this re-sort the order and vocabulary once at the end
+
+def tokenize(text):
+    """Lower-cased terms in order, compound ones (10.0.0.5, admin@corp) followed by their parts."""
+    terms = []
+    for token in pattern_token.findall(text.lower()):
+        terms.append(token)
+        parts = pattern_token_part.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+def incident_fields(incident):
+    """(tier, text) for every searchable piece of an incident."""
+    event = incident.get("event") if isinstance(incident.get("event"), dict) else {}
+    fields = [(TIER_TEXT, f"{event.get('event_id', '')} {event.get('raw_sanitised_text', '')}")]
+    insights = incident.get("ai_insights") or [None]
+    if isinstance(insights[0], dict) and insights[0].get("summary"):
+        fields.append((TIER_SUMMARY, str(insights[0]["summary"])))
+    fields.extend((TIER_NOTE, note) for note in incident.get("user_notes") or [] if isinstance(note, str))
+    return fields
+
+def incident_terms(incident):
+    """term -> the best tier it appears in."""
+    terms = {}
+    for tier, text in incident_fields(incident):
+        for term in tokenize(text):
+            if terms.get(term, 0) < tier:
+                terms[term] = tier
+    return terms
+
+def prefix_contains(sets, higher):
+    """Membership for one tier of a prefix: in any of sets, and not already in a better tier."""
+    def contains(key):
+        return any(key in keys for keys in sets) and not any(key in keys for keys in higher)
+    return contains
+
+class SearchIndex:
+    """Inverted index over raw_sanitised_text, AI summaries and user notes, kept up to date from the
+    incident cache's change list (IncidentCache.subscribe).
+
+    Each term maps tier -> set of order keys (the cache's (-seconds, id) sort key), so every document
+    sits in exactly one tier per term. A search ranks by sum(idf * tier) over its terms, newest first
+    on ties, and the last term matches as a prefix while it's being typed. Results come tier
+    combination by tier combination from the top, so a page stops as soon as it's full instead of
+    scoring every match.
+    """
+
+    def __init__(self, lookup, order_key):
+        self.lookup = lookup # doc_id -> the cache's current incident (or None)
+        self.order_key = order_key
+        self.lock = threading.Lock()
+        self.postings = {} # term -> {tier: set of order keys}
+        self.doc_terms = {} # doc_id -> (order key, {term: tier}), to find it again on change
+        self.vocabulary = [] # sorted terms, for prefix lookups
+        self.order = [] # sorted order keys of every indexed doc, newest first
+        self.searches = 0
+
+    def on_change(self, changes):
+        """Observer for IncidentCache.subscribe. Re-reads each incident from the cache under this
+        index's lock, so concurrent pushes can't leave an older version indexed."""
+        bulk = len(changes) > BULK_REINDEX_DOCS
+        with self.lock:
+            for doc_id, _ in changes:
+                self.remove(doc_id, bulk)
+                incident = self.lookup(doc_id)
+                if incident is not None:
+                    self.add(doc_id, incident, bulk)
+            if bulk:
+                self.order = sorted(entry[0] for entry in self.doc_terms.values())
+                self.vocabulary = sorted(self.postings)
+
+    def add(self, doc_id, incident, bulk=False):
+        key = self.order_key(incident)
+        terms = incident_terms(incident)
+        self.doc_terms[doc_id] = (key, terms)
+        for term, tier in terms.items():
+            tiers = self.postings.get(term)
+            if tiers is None:
+                tiers = self.postings[term] = {}
+                if not bulk:
+                    bisect.insort(self.vocabulary, term)
+            keys = tiers.get(tier)
+            if keys is None:
+                keys = tiers[tier] = set()
+            keys.add(key)
+        if not bulk:
+            bisect.insort(self.order, key)
+
+    def remove(self, doc_id, bulk=False):
+        entry = self.doc_terms.pop(doc_id, None)
+        if entry is None:
+            return
+        key, terms = entry
+        for term, tier in terms.items():
+            tiers = self.postings[term]
+            tiers[tier].discard(key)
+            if not tiers[tier]:
+                del tiers[tier]
+                if not tiers:
+                    del self.postings[term]
+                    if not bulk:
+                        del self.vocabulary[bisect.bisect_left(self.vocabulary, term)]
+        if not bulk:
+            del self.order[bisect.bisect_left(self.order, key)]
+
+    def expand(self, prefix):
+        """Terms starting with prefix, the most frequent MAX_PREFIX_TERMS of them."""
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\uffff")
+        terms = self.vocabulary[start:end]
+        if len(terms) > MAX_PREFIX_TERMS: # the exact word always stays in
+            terms = sorted(terms, key=lambda term: (term != prefix, -sum(map(len, self.postings[term].values()))))
+            terms = terms[:MAX_PREFIX_TERMS]
+        return terms
+
+    def term_tiers(self, term, prefix):
+        """tier -> (size, contains, key sets) for one query term.
+
+        A prefix isn't merged into new sets (a 2 letter prefix can cover most of the index), its
+        contains() checks the expansions' sets instead, counting a doc in the best tier any reached.
+        """
+        expansions = [self.postings[expansion] for expansion in self.expand(term)] if prefix \
+            else [self.postings[term]] if term in self.postings else []
+        if len(expansions) == 1: # plain sets, membership tests stay in C
+            return {tier: (len(keys), keys.__contains__, [keys]) for tier, keys in expansions[0].items()}
+        matchers = {}
+        higher = []
+        for tier in TIERS:
+            sets = [tiers[tier] for tiers in expansions if tier in tiers]
+            if sets:
+                matchers[tier] = (sum(map(len, sets)), prefix_contains(sets, list(higher)), sets)
+                higher.extend(sets)
+        return matchers
+
+    def newest(self, matchers, count):
+        """The count newest order keys every matcher accepts."""
+        matchers = sorted(matchers, key=lambda matcher: matcher[0])
+        size, _, sets = matchers[0]
+        if size <= SORT_LIMIT:
+            candidates = sets[0] if len(sets) == 1 else set().union(*sets)
+            return sorted(key for key in candidates if all(contains(key) for _, contains, _ in matchers))[:count]
+        matches = iter(self.order) # newest first, stops as soon as count are found
+        for _, contains, _ in matchers:
+            matches = filter(contains, matches)
+        return list(itertools.islice(matches, count))
+
+    def search(self, query, limit=20):
+        """[(doc_id, score)] best first. Every term must match, the last one as a prefix unless the
+        query ends in a space."""
+        # compound terms aren't split here, "10.0.0" should prefix-match the address not every 10 and 0
+        terms = list(dict.fromkeys(pattern_token.findall(query.lower())))[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        prefix_last = not query[-1].isspace() and len(terms[-1]) >= MIN_PREFIX_CHARS
+        with self.lock:
+            self.searches += 1
+            total = len(self.doc_terms)
+            weighted = [] # (idf, {tier: matcher}) per term
+            for i, term in enumerate(terms):
+                tiers = self.term_tiers(term, prefix_last and i == len(terms) - 1)
+                matching = sum(size for size, _, _ in tiers.values()) # docs hit by several expansions count twice, near enough for idf
+                if matching == 0:
+                    return [] # every term has to match
+                weighted.append((math.log(1 + total / matching), tiers))
+
+            # each combination of one tier per term is a disjoint group of docs with the same score
+            combos = {}
+            for combo in itertools.product(*(sorted(tiers) for _, tiers in weighted)):
+                score = round(sum(idf * tier for (idf, _), tier in zip(weighted, combo)), 6)
+                combos.setdefault(score, []).append(combo)
+
+            results = []
+            for score in sorted(combos, reverse=True):
+                needed = limit - len(results)
+                found = []
+                for combo in combos[score]:
+                    found.extend(self.newest([tiers[tier] for (_, tiers), tier in zip(weighted, combo)], needed))
+                found.sort()
+                results.extend((key[1], score) for key in found[:needed])
+                if len(results) >= limit:
+                    break
+            return results
+
+    def __len__(self):
+        return len(self.doc_terms)
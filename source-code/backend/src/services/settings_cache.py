@@ -0,0 +1,71 @@
+#settings_cache.py gives log-forwarder the same 0-read RAM caches main.py gets from services/firestore.py
+# (that module starts the API's incident listener on import, so the forwarder can't just import it)
+import threading
+
+DEFAULT_TECH_LEVEL = "business_owner"
+
+class SettingsCache:
+    """settings/global_config and the users collection held in RAM, kept up to date by snapshot listeners.
+
+    Until the first snapshot lands the getters fall back to a one-off read, so a batch straight after
+    start-up still gets real settings.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.settings_ref = db.collection("settings").document("global_config")
+        self.users_query = db.collection("users")
+
+        # CACHE 1: GLOBAL CONFIG
+        self.settings = None
+        self.settings_lock = threading.Lock()
+
+        # CACHE 2: USERS
+        self.users = None
+        self.users_lock = threading.Lock()
+
+        self.watches = []
+
+    def on_settings_snapshot(self, doc_snapshots, changes, read_time):
+        print("\n[SYNC] Firebase pushed a SETTINGS update! Updating RAM cache...")
+        settings = {}
+        for doc in doc_snapshots:
+            if doc.exists:
+                settings = doc.to_dict()
+        with self.settings_lock:
+            self.settings = settings
+
+    def on_users_snapshot(self, col_snapshot, changes, read_time):
+        print("\n[SYNC] Firebase pushed a USERS update! Updating RAM cache...")
+        updated_users = [doc.to_dict() for doc in col_snapshot]
+        with self.users_lock:
+            self.users = updated_users
+
+    def start(self):
+        """Starts both listeners, Firestore pushes every later change to the callbacks above."""
+        print("Starting settings/users listeners (0-Read Mode Active)...")
+        self.watches.append(self.settings_ref.on_snapshot(self.on_settings_snapshot))
+        self.watches.append(self.users_query.on_snapshot(self.on_users_snapshot))
+        return self
+
+    def tech_level(self):
+        """The persona level picked on the React Settings page."""
+        with self.settings_lock:
+            settings = self.settings
+        if settings is None: # listener hasn't delivered yet
+            doc = self.settings_ref.get()
+            settings = doc.to_dict() if doc.exists else {}
+        return settings.get("tech_level", DEFAULT_TECH_LEVEL)
+
+    def get_users(self):
+        """Every user document as a dict (email, notification_level, ...)."""
+        with self.users_lock:
+            users = self.users
+        if users is None:
+            users = [doc.to_dict() for doc in self.users_query.stream()]
+        return users
+
+    def stop(self):
+        for watch in self.watches:
+            watch.unsubscribe()
+        self.watches = []
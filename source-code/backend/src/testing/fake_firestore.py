@@ -0,0 +1,163 @@
+#fake_firestore.py is an in-memory stand-in for the bits of the Firestore client the writers use, for the unit tests and benchmarks in this folder
+import time, uuid, enum, threading
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self.data = data
+
+    def to_dict(self):
+        return dict(self.data) if self.data is not None else None
+
+class ChangeType(enum.Enum):
+    ADDED = 1
+    REMOVED = 2
+    MODIFIED = 3
+
+class FakeChange:
+    """Like Firestore's DocumentChange, only .type and .document are filled in."""
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+class FakeWatch:
+    def __init__(self, listeners, entry):
+        self.listeners = listeners
+        self.entry = entry
+
+    def unsubscribe(self):
+        self.listeners.remove(self.entry)
+
+class FakeDocumentRef:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self.collection.db.reads += 1
+        return FakeSnapshot(self.id, self.collection.db.docs.get((self.collection.name, self.id)))
+
+    def on_snapshot(self, callback):
+        return self.collection.db.listen(("doc", self.collection.name, self.id), callback)
+
+    def update(self, data):
+        """Plain field updates only (no ArrayUnion), listeners get the change pushed like a real write."""
+        db = self.collection.db
+        db.round_trip()
+        key = (self.collection.name, self.id)
+        with db.lock:
+            if key not in db.docs:
+                raise KeyError(f"404 No document to update: {self.id}")
+            db.docs[key] = dict(db.docs[key], **data)
+            updated = db.docs[key]
+        db.push_change(self.collection.name, self.id, FakeChange(ChangeType.MODIFIED, FakeSnapshot(self.id, updated)))
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self.db = db
+        self.name = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentRef(self, doc_id or uuid.uuid4().hex[:20])
+
+    def stream(self):
+        snapshots = self.db.snapshots(self.name)
+        self.db.reads += len(snapshots)
+        return iter(snapshots)
+
+    def on_snapshot(self, callback):
+        return self.db.listen(("collection", self.name), callback)
+
+    def add(self, data):
+        ref = self.document()
+        self.db.round_trip()
+        self.db.docs[(self.name, ref.id)] = dict(data)
+        return None, ref
+
+class FakeBatch:
+    def __init__(self, db):
+        self.db = db
+        self.ops = []
+
+    def set(self, ref, data):
+        self.ops.append(("set", ref, data))
+
+    def update(self, ref, data):
+        self.ops.append(("update", ref, data))
+
+    def commit(self):
+        self.db.round_trip()
+        with self.db.lock:
+            # same all-or-nothing rule as Firestore: an update to a missing doc fails the whole batch
+            for op, ref, _ in self.ops:
+                if op == "update" and (ref.collection.name, ref.id) not in self.db.docs:
+                    raise KeyError(f"404 No document to update: {ref.id}")
+            for op, ref, data in self.ops:
+                key = (ref.collection.name, ref.id)
+                if op == "set":
+                    self.db.docs[key] = dict(data)
+                else:
+                    self.db.docs[key].update(data)
+        self.db.commits += 1
+
+class FakeFirestore:
+    """Dict backed client. latency is the simulated round trip per RPC (add or commit)."""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.docs = {} # (collection, doc_id) -> data
+        self.rpcs = 0
+        self.commits = 0
+        self.reads = 0 # documents read by get()/stream(), listener pushes don't count
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def snapshots(self, collection):
+        return [FakeSnapshot(doc_id, data) for (name, doc_id), data in self.docs.items() if name == collection]
+
+    def listen(self, target, callback):
+        """Registers a listener and delivers the current state straight away, like on_snapshot."""
+        entry = (target, callback)
+        self.listeners.append(entry)
+        self.notify(entry)
+        return FakeWatch(self.listeners, entry)
+
+    def notify(self, entry, changes=None):
+        """Pushes the target's current state. Without a change list (first delivery) every doc counts as ADDED."""
+        target, callback = entry
+        if target[0] == "doc":
+            callback([FakeSnapshot(target[2], self.docs.get((target[1], target[2])))], [], None)
+        else:
+            snapshots = self.snapshots(target[1])
+            if changes is None:
+                changes = [FakeChange(ChangeType.ADDED, snapshot) for snapshot in snapshots]
+            callback(snapshots, changes, None)
+
+    def set_doc(self, collection, doc_id, data):
+        """Writes a document from "another client" and pushes it to any listeners, like the React app saving settings."""
+        change_type = ChangeType.MODIFIED if (collection, doc_id) in self.docs else ChangeType.ADDED
+        self.docs[(collection, doc_id)] = dict(data)
+        self.push_change(collection, doc_id, FakeChange(change_type, FakeSnapshot(doc_id, data)))
+
+    def delete_doc(self, collection, doc_id):
+        data = self.docs.pop((collection, doc_id))
+        self.push_change(collection, doc_id, FakeChange(ChangeType.REMOVED, FakeSnapshot(doc_id, data)))
+
+    def push_change(self, collection, doc_id, change):
+        for entry in list(self.listeners):
+            target = entry[0]
+            if target[1] == collection and (target[0] == "collection" or target[2] == doc_id):
+                self.notify(entry, [change])
+
+    def round_trip(self):
+        with self.lock:
+            self.rpcs += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
@@ -341,4 +341,1186 @@ try:
         print("\n[RESULT]: FAIL! The LLM grouped or dropped logs.")
 
 except Exception as e:
-    print(f"\n[API ERROR]: {e}")
\ No newline at end of file
+    print(f"\n[API ERROR]: {e}")
+
+# ==========================================
+# UT-13: KEYWORD MATCHER THREAT CATEGORIES
+# ==========================================
+print("\n--- UT-13: KEYWORD MATCHER THREAT CATEGORIES ---")
+
+from processing.matcher import THREAT_MATCHER, NOISE_CATEGORY
+
+sqli_and_scan = "GET /search.php?q=' UNION SELECT * FROM users -- sqlmap/1.7"
+windows_logon = "EventID 4624: An account was successfully logged on"
+plain_line = "08:05 - User loaded the homepage successfully"
+
+print(f"SQLi + scanner categories: {sorted(THREAT_MATCHER.scan(sqli_and_scan))} (Expected: ['RECON', 'WEB_ATTACKS'])")
+print(f"4624 logon categories: {sorted(THREAT_MATCHER.scan(windows_logon))} (Expected: ['{NOISE_CATEGORY}'])")
+print(f"Benign line categories: {sorted(THREAT_MATCHER.scan(plain_line))} (Expected: [])")
+# classify is the pipeline's version, None for noise instead of the NOISE category
+# a scanner before the SQLi checks the per-category search starts early enough
+scan_then_sqli = "sqlmap/1.7 GET /search.php?q=' UNION SELECT * FROM users --"
+decisions = [THREAT_MATCHER.classify(line) for line in (sqli_and_scan, scan_then_sqli, windows_logon, plain_line)]
+print(f"classify: {decisions} (Expected: RECON+WEB_ATTACKS twice, None, empty)")
+suspicious = [THREAT_MATCHER.suspicious(line) for line in (sqli_and_scan, windows_logon, plain_line)]
+print(f"suspicious: {suspicious} (Expected: [True, None, False])")
+
+if (THREAT_MATCHER.scan(sqli_and_scan) == {"RECON", "WEB_ATTACKS"} and THREAT_MATCHER.scan(windows_logon) == {NOISE_CATEGORY} and not THREAT_MATCHER.scan(plain_line)
+        and decisions == [{"RECON", "WEB_ATTACKS"}, {"RECON", "WEB_ATTACKS"}, None, set()] and suspicious == [True, None, False]):
+    print("[RESULT]: PASS! The compiled matcher reports every matching category.")
+else:
+    print("[RESULT]: FAIL! Category mismatch.")
+
+
+# ==========================================
+# UT-14: FUSED SANITISER MATCHES CHAINED OUTPUT
+# ==========================================
+print("\n--- UT-14: FUSED SANITISER ---")
+
+from processing.sanitiser import sanitise_line, sanitise_line_chained
+
+fused_samples = [
+    raw_log, # the mega-log from UT-01, has every PII type so takes the chained path
+    "03/24-10:30:05.123 [**] [1:2010937:3] ET WEB_SERVER UNION SELECT [**] {TCP} 45.33.22.11:51234 -> 192.168.1.100:80",
+    "kernel: IPTables-Dropped: IN=eth0 MAC=00:11:22:33:44:55 SRC=103.44.22.11 DST=192.168.1.20 PROTO=TCP",
+    "Login from fe80::1 and 11.2.3.45 then 1.2.3.4" # IPv6 and an IP hidden inside another, chained path again
+]
+
+all_match = True
+for sample in fused_samples:
+    fused = sanitise_line(sample)
+    print(f"Fused Result: {fused[0]}")
+    if fused != sanitise_line_chained(sample):
+        all_match = False
+        print(f"  Mismatch! Chained Result: {sanitise_line_chained(sample)[0]}")
+
+if all_match:
+    print("[RESULT]: PASS! Single pass sanitiser returns the same text, MACs and IP lists as the chained version.")
+else:
+    print("[RESULT]: FAIL! Fused sanitiser drifted from the chained output.")
+
+
+# ==========================================
+# UT-15: NDJSON CLEANED-LOGS ROUND TRIP
+# ==========================================
+print("\n--- UT-15: NDJSON WRITER AND READER ---")
+
+import tempfile
+from processing.ndjson import NDJSONWriter, read_events, segment_paths
+
+with tempfile.TemporaryDirectory() as cleaned_dir:
+    written = [{"event_id": f"{i:08d}", "raw_sanitised_text": f"line {i}"} for i in range(30)]
+
+    plain = NDJSONWriter(cleaned_dir, max_bytes=500) # tiny segments to force a few rollovers
+    zipped = NDJSONWriter(cleaned_dir, compress=True, max_bytes=200)
+    for start in range(0, 30, 5):
+        plain.append("auth.log", written[start:start + 5])
+        zipped.append("snort.ids", written[start:start + 5])
+
+    plain_back = list(read_events(cleaned_dir, "auth.log"))
+    zipped_back = list(read_events(cleaned_dir, "snort.ids"))
+    print(f"Segments written: {len(segment_paths(cleaned_dir, 'auth.log'))} plain, {len(segment_paths(cleaned_dir, 'snort.ids'))} gzip")
+    print(f"Events read back: {len(plain_back)} plain, {len(zipped_back)} gzip (Expected: 30 each)")
+
+    # same stem, different logs, each one has to keep its own output
+    for name in ("alert.ids", "alert.fast", "auth.2024.log"):
+        plain.append(name, [{"event_id": name}])
+    separate = [[e["event_id"] for e in read_events(cleaned_dir, name)] for name in ("alert.ids", "alert.fast", "auth.2024.log")]
+    print(f"alert.ids / alert.fast / auth.2024.log read back: {separate}")
+    auth_back = list(read_events(cleaned_dir, "auth.log"))
+
+    if plain_back == written and zipped_back == written and auth_back == written \
+            and separate == [["alert.ids"], ["alert.fast"], ["auth.2024.log"]]:
+        print("[RESULT]: PASS! Every appended event streams back in order across segment rollovers.")
+    else:
+        print("[RESULT]: FAIL! Events were lost or reordered.")
+
+
+# ==========================================
+# UT-16: BACKGROUND LLM DISPATCHER
+# ==========================================
+print("\n--- UT-16: LLM DISPATCHER WITH FAKE CLIENT ---")
+
+from services.dispatcher import BatchDispatcher
+from services.fake_llm import FakeLLMClient
+
+fake_client = FakeLLMClient(latency=0.2, rate_limit_every=3) # every 3rd call comes back 429
+analysed = {}
+
+def fake_analyse(batch):
+    contents = "\n".join(f"ID {event_id}: test line" for event_id in batch)
+    return json.loads(fake_client.models.generate_content(contents=contents).text)
+
+def fake_apply(batch, results):
+    for res in results:
+        analysed[res["event_id"]] = res["risk_assessment"]["score"]
+
+dispatcher = BatchDispatcher(fake_analyse, fake_apply, rpm=600, tpm=100000, concurrency=2).start()
+start = time.time()
+for b in range(5):
+    dispatcher.submit([f"evt{b}_{i}" for i in range(10)], tokens=500)
+submit_time = time.time() - start
+dispatcher.join()
+dispatcher.stop()
+metrics = dispatcher.metrics()
+
+print(f"Submitting 5 batches took {submit_time * 1000:.1f} ms (ingest loop is never blocked)")
+print(f"Analysed {len(analysed)} events, 429s retried: {metrics['rate_limited']}, failed: {metrics['failed']}, queue depth: {metrics['queue_depth']}")
+
+if len(analysed) == 50 and metrics["rate_limited"] > 0 and metrics["failed"] == 0 and submit_time < 0.1:
+    print("[RESULT]: PASS! Batches were analysed in the background and rate limited calls were retried.")
+else:
+    print("[RESULT]: FAIL! Dispatcher lost batches or blocked the caller.")
+
+
+# ==========================================
+# UT-17: SPOOL REPLAY AFTER A CRASH
+# ==========================================
+print("\n--- UT-17: DURABLE LLM SPOOL ---")
+
+from processing.spool import EventSpool, MAX_ATTEMPTS
+
+with tempfile.TemporaryDirectory() as spool_dir:
+    spool_path = os.path.join(spool_dir, "llm_spool.db")
+    spool = EventSpool(spool_path)
+    spool.push_many([{"event_id": f"evt{i}", "doc_id": f"doc{i}"} for i in range(8)])
+
+    first = spool.take_batch(5) # sent to the LLM...
+    spool.ack([e["spool_seq"] for e in first[:2]]) # ...but only 2 were applied before the crash
+    spool.close()
+
+    restarted = EventSpool(spool_path)
+    replayed = restarted.recover()
+    replay_batch = restarted.take_batch(50)
+    replay_ids = [e["event_id"] for e in replay_batch]
+
+    # a batch that keeps failing ends up in the dead letter table, not deleted
+    dead = []
+    for _ in range(MAX_ATTEMPTS):
+        dead = restarted.release([e["spool_seq"] for e in replay_batch])
+        replay_batch = restarted.take_batch(50)
+    dead_docs = [e["doc_id"] for e in dead]
+    parked = (restarted.dead_count(), restarted.pending_count())
+    requeued = restarted.requeue_dead()
+    retried_ids = [e["event_id"] for e in restarted.take_batch(50)]
+    restarted.close()
+
+    print(f"Replayed after restart: {replayed} events {replay_ids} (Expected: 6, evt2 to evt7 in order)")
+    print(f"After {MAX_ATTEMPTS} failures: {len(dead_docs)} dead letters for {dead_docs}, (dead, pending) {parked} (Expected: (6, 0))")
+    print(f"Requeued: {len(requeued)}, taken again: {retried_ids}")
+    if replay_ids == [f"evt{i}" for i in range(2, 8)] and dead_docs == [f"doc{i}" for i in range(2, 8)] \
+            and parked == (6, 0) and retried_ids == replay_ids:
+        print("[RESULT]: PASS! Unacknowledged events survive a crash and replay in order, repeated failures are kept for a retry.")
+    else:
+        print("[RESULT]: FAIL! Spool lost or reordered events.")
+
+
+# ==========================================
+# UT-18: BATCHED FIRESTORE WRITES
+# ==========================================
+print("\n--- UT-18: INCIDENT BULK WRITER (IN-MEMORY FIRESTORE) ---")
+
+from services.bulk_writer import IncidentWriter
+from fake_firestore import FakeFirestore
+
+fake_db = FakeFirestore()
+writer = IncidentWriter(fake_db, flush_size=20)
+
+doc_ids = [writer.new_doc_id() for _ in range(50)] # known before anything is sent
+for i, doc_id in enumerate(doc_ids):
+    writer.create(doc_id, {"data": f"encrypted-{i}", "is_encrypted": True})
+writer.flush()
+for doc_id in doc_ids:
+    writer.update(doc_id, {"risk_score": 7, "analysis_status": "AI_Analysis_Complete"})
+writer.flush()
+
+stored = [fake_db.docs[("incidents", doc_id)] for doc_id in doc_ids]
+print(f"Docs stored: {len(stored)}, RPCs used: {fake_db.rpcs} (Expected: 50 docs in 6 commits rather than 100 RPCs)")
+
+# a failed commit on one dispatcher thread mustn't lose another thread's AI updates
+import threading
+from fake_firestore import FakeBatch
+
+class FailingBatch(FakeBatch):
+    failures_left = 0
+    def commit(self):
+        if FailingBatch.failures_left > 0:
+            FailingBatch.failures_left -= 1
+            raise Exception("503 UNAVAILABLE")
+        super().commit()
+
+flaky_writer_db = FakeFirestore()
+flaky_writer_db.batch = lambda: FailingBatch(flaky_writer_db)
+flaky_writer = IncidentWriter(flaky_writer_db)
+for doc_id in ("batch-a", "batch-b"):
+    flaky_writer_db.docs[("incidents", doc_id)] = {"analysis_status": None}
+
+def in_thread(work):
+    outcome = []
+    def run():
+        try:
+            outcome.append(work())
+        except Exception as e:
+            outcome.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+    return outcome[0]
+
+in_thread(lambda: flaky_writer.update("batch-a", {"analysis_status": "AI_Analysis_Complete"}))
+in_thread(lambda: flaky_writer.update("batch-b", {"analysis_status": "AI_Analysis_Complete"}))
+FailingBatch.failures_left = 1
+flush_a = in_thread(flaky_writer.flush) # batch A's flush hits the outage
+flush_b = in_thread(flaky_writer.flush) # batch B's flush retries both updates
+analysed = [flaky_writer_db.docs[("incidents", d)]["analysis_status"] for d in ("batch-a", "batch-b")]
+
+# an update that keeps failing is dropped eventually, and its owner's flush says so
+queued, go, owner_flush = threading.Event(), threading.Event(), []
+def poisoned_batch():
+    flaky_writer.update("no-such-doc", {"risk_score": 1})
+    queued.set()
+    go.wait()
+    try:
+        owner_flush.append(flaky_writer.flush())
+    except Exception as e:
+        owner_flush.append(e)
+owner = threading.Thread(target=poisoned_batch)
+owner.start()
+queued.wait()
+other_flushes = [in_thread(flaky_writer.flush) for _ in range(3)] # other batches' flushes, each fails on the missing doc
+go.set()
+owner.join()
+owner_told = isinstance(owner_flush[0], RuntimeError)
+
+# a failed flush leaves the bookmark where it was, so the chunk is read again with the same source
+from services.bulk_writer import stable_doc_id
+reread_db = FakeFirestore()
+reread_db.batch = lambda: FailingBatch(reread_db)
+reread_writer = IncidentWriter(reread_db)
+def sanitise_chunk_again(attempt):
+    for line_number in range(5):
+        reread_writer.create(stable_doc_id("auth.log", 42, 0, line_number), {"data": f"attempt-{attempt}"})
+    return reread_writer.flush()
+FailingBatch.failures_left = 1
+first_read = in_thread(lambda: sanitise_chunk_again(1)) # the creates stay queued for the timer to retry
+second_read = in_thread(lambda: sanitise_chunk_again(2))
+reread_docs = [data for (name, _), data in reread_db.docs.items() if name == "incidents"]
+print(f"After one failed commit: A raised {type(flush_a).__name__}, B wrote {flush_b}, statuses {analysed} (Expected: 2, both complete)")
+print(f"Update to a missing doc: dropped {flaky_writer.dropped} after {len(other_flushes)} failed commits, owner's flush raised: {owner_told}")
+print(f"Chunk re-read after a failed flush: first raised {type(first_read).__name__}, docs stored {len(reread_docs)} (Expected: 5, not 10)")
+
+if all(doc["risk_score"] == 7 and doc["data"].startswith("encrypted-") for doc in stored) and fake_db.rpcs == 6 \
+        and isinstance(flush_a, Exception) and flush_b == 2 and analysed == ["AI_Analysis_Complete"] * 2 \
+        and flaky_writer.dropped == 1 and owner_told and not flaky_writer.pending \
+        and isinstance(first_read, Exception) and len(reread_docs) == 5 and all(d["data"] == "attempt-2" for d in reread_docs):
+    print("[RESULT]: PASS! Creates and AI updates were committed in batches with pre-allocated IDs.")
+else:
+    print("[RESULT]: FAIL! Writes missing or not batched.")
+
+
+# ==========================================
+# UT-19: TEMPLATE CLUSTERING BEFORE THE LLM
+# ==========================================
+print("\n--- UT-19: TEMPLATE CLUSTERING ---")
+
+from processing.clustering import template_key, cluster_events
+
+brute_force = [
+    {"event_id": "a1", "raw_sanitised_text": "Dec 11 03:18:10 server sshd[4401]: Failed password for root from [EXTERNAL_IP_0] port 49202 ssh2"},
+    {"event_id": "a2", "raw_sanitised_text": "Dec 11 03:18:12 server sshd[4402]: Failed password for root from [EXTERNAL_IP_0] port 49206 ssh2"},
+    {"event_id": "a3", "raw_sanitised_text": "Dec 11 03:19:40 server sshd[4410]: Failed password for root from [EXTERNAL_IP_1] port 51002 ssh2"},
+    {"event_id": "b1", "raw_sanitised_text": "Dec 11 03:19:11 server sudo: admin : TTY=pts/0 ; COMMAND=/bin/rm -rf /var/log/auth.log"}
+]
+clusters = cluster_events(brute_force)
+print(f"Template: {template_key(brute_force[0]['raw_sanitised_text'])}")
+print(f"Clusters: {[(c['event_id'], c['occurrence_count']) for c in clusters]} (Expected: [('a1', 3), ('b1', 1)])")
+
+if [(c["event_id"], c["occurrence_count"]) for c in clusters] == [("a1", 3), ("b1", 1)] and \
+        [m["event_id"] for m in clusters[0]["cluster_members"]] == ["a1", "a2", "a3"]:
+    print("[RESULT]: PASS! Repeats of one attack collapse to a single representative that keeps every member.")
+else:
+    print("[RESULT]: FAIL! Clustering merged different events or split repeats.")
+
+
+# ==========================================
+# UT-20: LLM ANALYSIS CACHE (TTL + LRU)
+# ==========================================
+print("\n--- UT-20: LLM ANALYSIS CACHE ---")
+
+from services.analysis_cache import AnalysisCache, cache_key
+
+with tempfile.TemporaryDirectory() as cache_dir:
+    fake_now = [1000.0]
+    cache = AnalysisCache(os.path.join(cache_dir, "llm_cache.db"), ttl=3600, max_entries=2, clock=lambda: fake_now[0])
+
+    first_alert = "Dec 11 03:18:10 server sshd[4401]: Failed password for root from [EXTERNAL_IP_0] port 49202 ssh2"
+    repeat_alert = "Dec 11 04:52:31 server sshd[5120]: Failed password for root from [EXTERNAL_IP_0] port 50133 ssh2"
+    key = cache_key(first_alert, "business_owner prompt", "gemini-2.5-flash-lite")
+    cache.put(key, {"event_id": "a1", "risk_assessment": {"score": 7}})
+
+    repeat_hit = cache.get(cache_key(repeat_alert, "business_owner prompt", "gemini-2.5-flash-lite"))
+    other_persona = cache.get(cache_key(repeat_alert, "soc_analyst prompt", "gemini-2.5-flash-lite"))
+    fake_now[0] += 7200 # two hours later, past the TTL
+    expired = cache.get(key)
+
+    for i in range(3): # only 2 entries allowed, the oldest goes
+        fake_now[0] += 1
+        cache.put(f"key{i}", {"risk_assessment": {"score": i}})
+    evicted = cache.get("key0")
+    metrics = cache.metrics()
+    cache.close()
+
+    print(f"Repeat alert hit: {repeat_hit} (Expected: score 7, no event_id)")
+    print(f"Other persona: {other_persona}, after TTL: {expired}, LRU evicted: {evicted} (Expected: None x3)")
+    print(f"Counters: hits {metrics['hits']}, misses {metrics['misses']}, expired {metrics['expired']}, evicted {metrics['evicted']}")
+
+    if repeat_hit == {"risk_assessment": {"score": 7}} and other_persona is None and expired is None and evicted is None \
+            and metrics["hits"] == 1 and metrics["evicted"] == 1:
+        print("[RESULT]: PASS! Repeats hit the cache, persona changes, TTL and LRU all miss as expected.")
+    else:
+        print("[RESULT]: FAIL! Cache returned a stale or wrong analysis.")
+
+
+# ==========================================
+# UT-21: FORWARDER SETTINGS/USERS RAM CACHE
+# ==========================================
+print("\n--- UT-21: SETTINGS AND USERS LISTENER CACHE ---")
+
+from services.settings_cache import SettingsCache
+
+fake_db = FakeFirestore()
+fake_db.set_doc("settings", "global_config", {"tech_level": "it_support"})
+fake_db.set_doc("users", "u1", {"email": "owner@example.com", "notification_level": "critical"})
+settings_cache = SettingsCache(fake_db).start()
+
+levels = [settings_cache.tech_level() for _ in range(50)] # 50 batches
+fake_db.set_doc("settings", "global_config", {"tech_level": "soc_analyst"}) # changed on the Settings page
+fake_db.set_doc("users", "u2", {"email": "analyst@example.com", "notification_level": "all"})
+after_change = settings_cache.tech_level()
+emails = sorted(u["email"] for u in settings_cache.get_users())
+settings_cache.stop()
+
+print(f"Level before/after change: {levels[0]} / {after_change} (Expected: it_support / soc_analyst)")
+print(f"Users: {emails}, Firestore reads for 51 batches: {fake_db.reads} (Expected: 0)")
+
+if set(levels) == {"it_support"} and after_change == "soc_analyst" and len(emails) == 2 and fake_db.reads == 0:
+    print("[RESULT]: PASS! Settings and users are served from RAM and updated by push.")
+else:
+    print("[RESULT]: FAIL! Cache is stale or still reading from Firestore.")
+
+
+# ==========================================
+# UT-22: ADAPTIVE BATCH SIZING AND WAIT WINDOW
+# ==========================================
+print("\n--- UT-22: ADAPTIVE BATCHER ---")
+
+from processing.batcher import AdaptiveBatcher, is_high_priority, estimate_item_tokens
+
+fake_now = [1000.0]
+batcher = AdaptiveBatcher(max_prompt_tokens=1000, min_wait=5, max_wait=90, request_interval=4, clock=lambda: fake_now[0])
+
+items = [{"event_id": f"{i:08x}", "raw_sanitised_text": "x" * 384} for i in range(25)] # 100 tokens each
+batch_sizes = [len(b) for b in batcher.pack(items)]
+
+priority = [is_high_priority(t) for t in [
+    "[**] [1:2019401:3] ET SCAN Nmap [**] [Classification: Attempted Recon] [Priority: 1] {TCP}",
+    "Dec 11 03:17:22 DC01 EventID 1102: The audit log was cleared",
+    "[**] [1:2100498:7] GPL ATTACK_RESPONSE [**] [Priority: 2] {TCP}",
+    "EventID 4625: An account failed to log on"]]
+
+quiet_wait = batcher.wait_window(1) # nothing observed yet, a lone alert goes after the floor
+for _ in range(30): # steady traffic, one event (100 tokens) a second
+    fake_now[0] += 1
+    batcher.observe_arrivals(items[:1])
+steady_wait = round(batcher.wait_window(2)) # 800 tokens to go at ~100/s, worth waiting for
+fake_now[0] += 600 # traffic stops, the estimate decays with the idle time
+idle_wait = batcher.wait_window(1)
+
+batcher.record_analysed([fake_now[0] - s for s in range(1, 101)])
+metrics = batcher.metrics()
+
+print(f"Batch sizes at 1000 tokens: {batch_sizes} (Expected: [10, 10, 5])")
+print(f"High priority: {priority} (Expected: [True, True, False, False])")
+print(f"Wait quiet/steady/idle: {quiet_wait}s / {steady_wait}s / {idle_wait}s (Expected: 5 / 8 / 5)")
+print(f"Time to analysis p50 {metrics['p50_seconds']}s p99 {metrics['p99_seconds']}s (Expected: 51 / 100)")
+
+if batch_sizes == [10, 10, 5] and priority == [True, True, False, False] and quiet_wait == 5 and steady_wait == 8 \
+        and idle_wait == 5 and metrics["p50_seconds"] == 51 and metrics["p99_seconds"] == 100 and estimate_item_tokens(items[0]) == 100:
+    print("[RESULT]: PASS! Batches follow the token budget and the wait window follows the traffic.")
+else:
+    print("[RESULT]: FAIL! Batch sizing or wait window is off.")
+
+
+# ==========================================
+# UT-23: STREAMED LLM REPLY PARSING
+# ==========================================
+print("\n--- UT-23: INCREMENTAL JSON PARSER ---")
+
+from services.json_stream import JSONObjectStream
+
+reply = ('```json\n[{"event_id": "aaaa0001", "analysis": {"incident_overview": "brace } and quote \\" in text"}},\n'
+         ' {"event_id" "aaaa0002", "analysis": {}},\n' # missing colon
+         ' {"event_id": "aaaa0003", "mitigation_plan": [{"detailed_instructions": "check C:\\Windows\\System32"}]},\n'
+         ' {"event_id": "aaaa0004", "risk_assessment": {"score": 9}}]\n```')
+parser = JSONObjectStream()
+seen_after = [] # objects finished after each 7 char piece
+streamed = []
+for i in range(0, len(reply), 7):
+    streamed.extend(parser.feed(reply[i:i + 7]))
+    seen_after.append(len(streamed))
+truncated = parser.close()
+first_ready = seen_after.index(1) + 1 # pieces needed before the first object was usable
+
+cut_off = JSONObjectStream()
+partial = cut_off.feed(reply[:reply.index('{"event_id": "aaaa0004"') + 20])
+cut_off_truncated = cut_off.close()
+
+ids = [obj["event_id"] for obj in streamed]
+print(f"Parsed: {ids}, malformed {parser.malformed} (Expected: aaaa0001, aaaa0003, aaaa0004 / 1 malformed)")
+print(f"First object usable after {first_ready} of {len(seen_after)} pieces, unescaped path: {streamed[1]['mitigation_plan'][0]['detailed_instructions']}")
+print(f"Cut off mid-object: {len(partial)} parsed, truncated={cut_off_truncated} (Expected: 2 / True)")
+
+if ids == ["aaaa0001", "aaaa0003", "aaaa0004"] and parser.malformed == 1 and not truncated \
+        and first_ready < len(seen_after) // 2 and len(partial) == 2 and cut_off_truncated:
+    print("[RESULT]: PASS! Objects come out as soon as they close and a bad one doesn't lose the batch.")
+else:
+    print("[RESULT]: FAIL! Streaming parser dropped or mangled objects.")
+
+
+# ==========================================
+# UT-24: API INCIDENT CACHE APPLIES DELTAS
+# ==========================================
+print("\n--- UT-24: DELTA INCIDENT CACHE ---")
+
+import datetime
+from services.incident_cache import IncidentCache
+
+decrypt_calls = [0]
+def counting_decrypt(token):
+    decrypt_calls[0] += 1
+    return decrypt_payload(token)
+
+fake_db = FakeFirestore()
+base_time = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+for i in range(200):
+    fake_db.set_doc("incidents", f"doc{i:03d}", {
+        "data": encrypt_payload({"event_id": f"{i:08x}", "raw_sanitised_text": f"line {i}"}),
+        "timestamp": base_time + datetime.timedelta(seconds=i),
+        "analysis_status": "pending"
+    })
+
+incident_cache = IncidentCache(decrypt=counting_decrypt)
+watch = fake_db.collection("incidents").on_snapshot(incident_cache.on_snapshot)
+initial_calls = decrypt_calls[0]
+newest_first = [incident["id"] for incident in incident_cache.list()[:2]]
+
+decrypt_calls[0] = 0
+noted = dict(fake_db.docs[("incidents", "doc050")])
+noted["user_notes"] = [encrypt_payload("Blocked at the firewall")]
+fake_db.set_doc("incidents", "doc050", noted) # one note added
+note_calls = decrypt_calls[0]
+fake_db.delete_doc("incidents", "doc199")
+watch.unsubscribe()
+
+listing = incident_cache.list()
+print(f"Initial load decrypts: {initial_calls}, newest first: {newest_first} (Expected: 200, doc199/doc198)")
+print(f"Decrypts for one added note: {note_calls} (Expected: 2, the event and the note)")
+print(f"After delete: {len(listing)} incidents, first {listing[0]['id']}, note {incident_cache.get('doc050')['user_notes']}")
+
+if initial_calls == 200 and newest_first == ["doc199", "doc198"] and note_calls == 2 and len(listing) == 199 \
+        and listing[0]["id"] == "doc198" and incident_cache.get("doc050")["user_notes"] == ["Blocked at the firewall"]:
+    print("[RESULT]: PASS! Only changed incidents are decrypted and the order is kept.")
+else:
+    print("[RESULT]: FAIL! Cache rebuilt too much or lost an incident.")
+
+
+# ==========================================
+# UT-25: MEMOISED DECRYPTION AND BATCH CRYPTO
+# ==========================================
+print("\n--- UT-25: DECRYPT CACHE ---")
+
+from security.crypto import encrypt_many, decrypt_many, decrypt_cache, DecryptCache
+
+tokens = encrypt_many([{"note": f"Blocked IP {i}"} for i in range(3)])
+decrypt_cache.clear()
+before = decrypt_cache.metrics()
+first = decrypt_many(tokens + [tokens[0], "not-a-token"])
+second = decrypt_many(tokens)
+after = decrypt_cache.metrics()
+hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+small = DecryptCache(max_bytes=2000)
+for i in range(20):
+    small.put(f"digest{i}", {"summary": "x" * 100})
+small_metrics = small.metrics()
+
+print(f"Decrypted: {[v['note'] if v else v for v in first]}")
+print(f"Same object on a hit: {first[0] is second[0]}, hits {hits}, misses {misses} (Expected: True, 3, 4)")
+print(f"Bounded cache: {small_metrics['entries']} entries, {small_metrics['bytes']} bytes <= 2000, evicted {small_metrics['evicted']}, oldest gone: {small.get('digest0') is None}")
+
+if [v["note"] for v in first[:4]] == ["Blocked IP 0", "Blocked IP 1", "Blocked IP 2", "Blocked IP 0"] and first[4] is None \
+        and first[0] is second[0] and hits == 3 and misses == 4 and small_metrics["bytes"] <= 2000 \
+        and small_metrics["evicted"] > 0 and small.get("digest0") is None and small.get("digest19") is not None:
+    print("[RESULT]: PASS! Repeat ciphertexts skip the decrypt and the cache stays inside its memory budget.")
+else:
+    print("[RESULT]: FAIL! Decrypt cache returned wrong data or grew past its limit.")
+
+
+# ==========================================
+# UT-26: PARALLEL COLD START DECRYPT
+# ==========================================
+print("\n--- UT-26: PARALLEL SNAPSHOT DECRYPT ---")
+
+import services.incident_cache as incident_cache_module
+from fake_firestore import FakeChange, FakeSnapshot, ChangeType
+
+incident_cache_module.DECODE_START_METHOD = "fork" # this script has no __main__ guard for spawn to respect
+incident_cache_module.PARALLEL_MIN_DOCS = 100
+incident_cache_module.DECODE_CHUNK_DOCS = 40
+
+changes = [FakeChange(ChangeType.ADDED, FakeSnapshot(f"doc{i:03d}", {
+    "data": encrypt_payload({"event_id": f"{i:08x}"}),
+    "timestamp": base_time + datetime.timedelta(seconds=i)})) for i in range(250)]
+changes.append(FakeChange(ChangeType.ADDED, FakeSnapshot("broken", {"data": "not-a-token"})))
+pasted_note = encrypt_payload("Blocked at the firewall")
+changes[0].document.data["user_notes"] = [pasted_note, pasted_note] # same note added twice
+
+serial_cache = IncidentCache()
+serial_cache.on_snapshot(None, changes, None)
+decrypt_cache.clear() # the serial load filled it, the parallel one should fill it on its own
+parallel_cache = IncidentCache(workers=2)
+parallel_cache.on_snapshot(None, changes, None)
+seeded = decrypt_cache.metrics()["entries"]
+hits_before = decrypt_cache.metrics()["hits"]
+event_again = decrypt_payload(changes[0].document.data["data"])
+note_again = decrypt_payload(pasted_note)
+seeded_hits = decrypt_cache.metrics()["hits"] - hits_before
+
+same = [i["id"] for i in serial_cache.list()] == [i["id"] for i in parallel_cache.list()] \
+    and all(a["event"] == b["event"] for a, b in zip(serial_cache.list(), parallel_cache.list()))
+print(f"Serial {len(serial_cache)} / parallel {len(parallel_cache)} incidents, identical: {same} (Expected: 250 / 250, True)")
+print(f"Cold start recorded: {parallel_cache.cold_start_docs} docs in {parallel_cache.cold_start_seconds:.2f}s")
+print(f"Parent decrypt cache after the parallel load: {seeded} entries, {seeded_hits} hits re-reading doc000 (Expected: 251, 2)")
+print(f"Notes: {parallel_cache.get('doc000')['user_notes']}")
+
+if same and len(parallel_cache) == 250 and parallel_cache.cold_start_docs == 251 and seeded == 251 and seeded_hits == 2 \
+        and event_again is parallel_cache.get("doc000")["event"] and note_again == "Blocked at the firewall" \
+        and parallel_cache.get("doc000")["user_notes"] == ["Blocked at the firewall"] * 2:
+    print("[RESULT]: PASS! Worker processes decrypt the snapshot to the same cache and seed the parent's decrypt cache.")
+else:
+    print("[RESULT]: FAIL! Parallel decrypt lost or reordered incidents.")
+
+
+# ==========================================
+# UT-27: PAGINATED, FILTERED INCIDENT QUERIES
+# ==========================================
+print("\n--- UT-27: INCIDENT QUERY INDEXES ---")
+
+import random
+random.seed(27)
+incident_cache_module.BULK_REORDER_DOCS = 100 # so the 600 doc push below takes the bulk path
+statuses = ["pending", "AI_Analysis_Complete", "resolved"]
+docs = {}
+for i in range(600):
+    data = {"data": encrypt_payload({"event_id": f"{i:08x}", "original_filename": random.choice(["auth.log", "snort.ids"])}),
+            "timestamp": base_time + datetime.timedelta(seconds=random.randint(0, 5000)),
+            "analysis_status": random.choice(statuses), "assigned_to": random.choice(["", "alice", "bob"])}
+    if random.random() < 0.8:
+        data["ai_insights"] = [encrypt_payload({"summary": "s", "mitigation_steps": [], "risk_score": random.randint(1, 10)})]
+    docs[f"doc{i:03d}"] = data
+
+bulk_cache = IncidentCache() # one big push, indexes built in one pass
+bulk_cache.on_snapshot(None, [FakeChange(ChangeType.ADDED, FakeSnapshot(d, v)) for d, v in docs.items()], None)
+incremental_cache = IncidentCache() # small pushes, indexes kept with insort/removal
+for doc_id, data in docs.items():
+    incremental_cache.on_snapshot(None, [FakeChange(ChangeType.ADDED, FakeSnapshot(doc_id, data))], None)
+for doc_id in list(docs)[:50]: # some get resolved and reassigned later, some deleted
+    docs[doc_id] = dict(docs[doc_id], analysis_status="resolved", assigned_to="alice")
+    for cache in (bulk_cache, incremental_cache):
+        cache.on_snapshot(None, [FakeChange(ChangeType.MODIFIED, FakeSnapshot(doc_id, docs[doc_id]))], None)
+for doc_id in list(docs)[50:70]:
+    for cache in (bulk_cache, incremental_cache):
+        cache.on_snapshot(None, [FakeChange(ChangeType.REMOVED, FakeSnapshot(doc_id, docs[doc_id]))], None)
+
+def page_through(cache, **filters):
+    ids, cursor, pages = [], None, 0
+    while True:
+        page, cursor = cache.query(limit=25, cursor=cursor, **filters)
+        ids.extend(i["id"] for i in page)
+        pages += 1
+        if cursor is None:
+            return ids, pages
+
+def brute_force(cache, status=None, assigned_to=None, filename=None, risk_min=None, risk_max=None, since=None, until=None, newest_first=True):
+    matches = []
+    for incident in cache.list():
+        risk = incident_cache_module.index_values(incident)["risk"]
+        if (status is None or incident["analysis_status"] == status) and (assigned_to is None or incident["assigned_to"] == assigned_to) \
+                and (filename is None or incident["event"]["original_filename"] == filename) \
+                and (risk_min is None or (risk is not None and risk >= risk_min)) and (risk_max is None or (risk is not None and risk <= risk_max)) \
+                and (since is None or incident["timestamp"] >= since) and (until is None or incident["timestamp"] <= until):
+            matches.append(incident["id"])
+    return matches if newest_first else matches[::-1]
+
+cases = [
+    {},
+    {"status": "resolved"},
+    {"assigned_to": "alice", "filename": "auth.log"},
+    {"risk_min": 8},
+    {"risk_min": 3, "risk_max": 5, "status": "pending"},
+    {"since": base_time + datetime.timedelta(seconds=1000), "until": base_time + datetime.timedelta(seconds=2500)},
+    {"status": "AI_Analysis_Complete", "risk_max": 4, "newest_first": False},
+]
+mismatches = 0
+for filters in cases:
+    expected = brute_force(bulk_cache, **filters)
+    for cache in (bulk_cache, incremental_cache):
+        ids, pages = page_through(cache, **filters)
+        if ids != expected:
+            mismatches += 1
+            print(f"Mismatch for {filters}: got {len(ids)}, expected {len(expected)}")
+print(f"{len(cases)} filter combinations x 2 caches paged 25 at a time, mismatches: {mismatches} (Expected: 0)")
+
+bad_cursor = None
+try:
+    bulk_cache.query(cursor="not-a-cursor")
+except ValueError as e:
+    bad_cursor = str(e)
+print(f"Bad cursor: {bad_cursor}")
+
+if mismatches == 0 and len(bulk_cache) == 580 and bad_cursor is not None:
+    print("[RESULT]: PASS! Every page matches a full scan and cursors never skip or repeat an incident.")
+else:
+    print("[RESULT]: FAIL! Indexed queries disagree with a full scan.")
+
+
+# ==========================================
+# UT-28: INCREMENTAL ANALYTICS ROLLUPS
+# ==========================================
+print("\n--- UT-28: ANALYTICS ROLLUPS ---")
+
+from collections import Counter
+from services.analytics import severity
+
+random.seed(28)
+analytics_cache = IncidentCache()
+docs = {}
+for i in range(400):
+    data = {"data": encrypt_payload({"event_id": f"{i:08x}", "original_filename": random.choice(["auth.log", "snort.ids"]),
+                                     "threat_categories": random.sample(["AUTH_ATTACKS", "WEB_ATTACKS", "RECON"], random.randint(0, 2))}),
+            "timestamp": base_time + datetime.timedelta(minutes=random.randint(0, 3 * 24 * 60)),
+            "analysis_status": random.choice(statuses)}
+    if random.random() < 0.7:
+        data["ai_insights"] = [encrypt_payload({"summary": "s", "mitigation_steps": [], "risk_score": random.randint(1, 10)})]
+    docs[f"doc{i:03d}"] = data
+    analytics_cache.on_snapshot(None, [FakeChange(ChangeType.ADDED, FakeSnapshot(f"doc{i:03d}", data))], None)
+for doc_id in list(docs)[:40]: # resolved from the dashboard
+    docs[doc_id] = dict(docs[doc_id], analysis_status="resolved")
+    analytics_cache.on_snapshot(None, [FakeChange(ChangeType.MODIFIED, FakeSnapshot(doc_id, docs[doc_id]))], None)
+for doc_id in list(docs)[40:60]:
+    analytics_cache.on_snapshot(None, [FakeChange(ChangeType.REMOVED, FakeSnapshot(doc_id, docs.pop(doc_id)))], None)
+
+def scan_summary(incidents):
+    counts = Counter()
+    for incident in incidents:
+        values = incident_cache_module.index_values(incident)
+        counts["open" if values["status"] != "resolved" else "resolved"] += 1
+        if values["risk"] is not None:
+            counts["severity:" + severity(values["risk"])] += 1
+            if values["risk"] >= 8 and values["status"] != "resolved":
+                counts["critical"] += 1
+        for category in incident["event"]["threat_categories"]:
+            counts["category:" + category] += 1
+    return counts
+
+window_since, window_until = base_time + datetime.timedelta(days=1), base_time + datetime.timedelta(days=2) - datetime.timedelta(seconds=1)
+expected_all = scan_summary(analytics_cache.list())
+expected_window = scan_summary([i for i in analytics_cache.list() if window_since <= i["timestamp"] <= window_until])
+summary_all = analytics_cache.analytics_summary()
+summary_window = analytics_cache.analytics_summary(window_since, window_until)
+hourly = analytics_cache.analytics_histogram("hour")
+daily = analytics_cache.analytics_histogram("day")
+expected_daily = sorted(Counter(i["timestamp"].date().isoformat() for i in analytics_cache.list()).items())
+
+def matches(summary, expected):
+    return summary["total"] == summary["open"] + summary["resolved"] and summary["open"] == expected["open"] \
+        and summary["resolved"] == expected["resolved"] and summary["critical"] == expected["critical"] \
+        and all(summary["severity"].get(k[9:], 0) == v for k, v in expected.items() if k.startswith("severity:")) \
+        and all(summary["threat_categories"].get(k[9:], 0) == v for k, v in expected.items() if k.startswith("category:"))
+
+print(f"All time: {summary_all['total']} incidents, open {summary_all['open']}, critical {summary_all['critical']}, severity {summary_all['severity']}")
+print(f"Day 2 window: {summary_window['total']} incidents, categories {summary_window['threat_categories']}")
+print(f"Daily histogram: {[(b['bucket'][:10], b['count']) for b in daily]} (Expected: {expected_daily})")
+
+# the same window without a timezone (?since=2026-01-02T00:00:00) means UTC, even on a server that isn't
+old_tz = os.environ.get("TZ")
+os.environ["TZ"] = "America/New_York"
+time.tzset()
+naive_since, naive_until = window_since.replace(tzinfo=None), window_until.replace(tzinfo=None)
+naive_summary = analytics_cache.analytics_summary(naive_since, naive_until)
+naive_hours = analytics_cache.analytics_histogram("hour", naive_since, naive_until)
+naive_page, _ = analytics_cache.query(limit=500, since=naive_since, until=naive_until)
+aware_page, _ = analytics_cache.query(limit=500, since=window_since, until=window_until)
+if old_tz is None:
+    del os.environ["TZ"]
+else:
+    os.environ["TZ"] = old_tz
+time.tzset()
+naive_same = naive_summary == summary_window and naive_hours == analytics_cache.analytics_histogram("hour", window_since, window_until) \
+    and [i["id"] for i in naive_page] == [i["id"] for i in aware_page]
+print(f"Naive since/until on a New York clock: {naive_summary['total']} incidents, {len(naive_page)} in the query, same as UTC: {naive_same} (Expected: {summary_window['total']}, True)")
+
+if matches(summary_all, expected_all) and matches(summary_window, expected_window) and summary_all["total"] == 380 \
+        and sum(b["count"] for b in hourly) == 380 and [(b["bucket"][:10], b["count"]) for b in daily] == expected_daily \
+        and naive_same and summary_window["threat_categories"].get("AUTH_ATTACKS", 0) > 0:
+    print("[RESULT]: PASS! Rollups match a full scan after adds, updates and deletes.")
+else:
+    print("[RESULT]: FAIL! Rollups drifted from the incidents they summarise.")
+
+
+# ==========================================
+# UT-29: ETAGS, 304s AND COMPRESSED LISTINGS
+# ==========================================
+print("\n--- UT-29: CONDITIONAL GET ---")
+
+import warnings
+from fastapi import FastAPI, Request
+from services.responses import VersionedPayload, send_payload
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    from fastapi.testclient import TestClient
+
+# same wiring as fetch_incidents, over the UT-27 cache (api/incidents.py itself needs Firebase)
+listing_payload = VersionedPayload()
+test_app = FastAPI()
+@test_app.get("/listing")
+def listing(request: Request):
+    version, incidents = bulk_cache.list_versioned()
+    return send_payload(request, listing_payload.get(version, lambda: incidents))
+
+http = TestClient(test_app)
+first = http.get("/listing", headers={"Accept-Encoding": "gzip"})
+etag = first.headers["etag"]
+repeat = http.get("/listing", headers={"If-None-Match": etag, "Accept-Encoding": "gzip"})
+plain = http.get("/listing", headers={"Accept-Encoding": "identity"})
+builds_before_change = listing_payload.builds
+
+bulk_cache.on_snapshot(None, [FakeChange(ChangeType.REMOVED, FakeSnapshot(bulk_cache.list()[0]["id"], {}))], None)
+after_change = http.get("/listing", headers={"If-None-Match": etag})
+
+print(f"First: {first.status_code}, {first.headers.get('content-encoding')}, {len(first.json())} incidents, ETag {etag}")
+print(f"Repeat with If-None-Match: {repeat.status_code} (Expected: 304), builds for 3 requests: {builds_before_change} (Expected: 1)")
+print(f"After a change: {after_change.status_code}, new ETag: {after_change.headers['etag'] != etag}, builds: {listing_payload.builds}")
+
+if first.status_code == 200 and first.headers.get("content-encoding") == "gzip" and repeat.status_code == 304 \
+        and repeat.content == b"" and plain.json() == first.json() and after_change.status_code == 200 \
+        and after_change.headers["etag"] != etag and len(after_change.json()) == len(first.json()) - 1 \
+        and builds_before_change == 1 and listing_payload.builds == 2:
+    print("[RESULT]: PASS! Unchanged polls get a 304 and each cache version is serialised once.")
+else:
+    print("[RESULT]: FAIL! Conditional GET or per-version serialisation is wrong.")
+
+
+# ==========================================
+# UT-30: LIVE INCIDENT STREAM (SSE BROADCASTER)
+# ==========================================
+print("\n--- UT-30: INCIDENT STREAM FAN-OUT AND RESUME ---")
+
+import asyncio, threading
+import services.broadcaster as broadcaster_module
+from services.broadcaster import IncidentBroadcaster
+
+stream_broadcaster = IncidentBroadcaster()
+bulk_cache.subscribe(stream_broadcaster.publish) # same wiring as services/firestore.py
+live_ids = [incident["id"] for incident in bulk_cache.list() if incident["id"] in docs]
+
+def push_from_listener(changes):
+    # the Firestore callback runs on its own thread, not the server's event loop
+    listener = threading.Thread(target=bulk_cache.on_snapshot, args=(None, changes, None))
+    listener.start()
+    listener.join()
+
+def frame_event(frame):
+    return re.search(rb"^event: (\w+)", frame, re.MULTILINE).group(1).decode()
+
+def frame_id(frame):
+    return re.search(rb"^id: (\S+)", frame, re.MULTILINE).group(1).decode()
+
+async def stream_checks():
+    streams = [stream_broadcaster.stream() for _ in range(300)]
+    ready = [await stream.__anext__() for stream in streams]
+    resume_token = frame_id(ready[0])
+
+    modified = live_ids[0]
+    push_from_listener([FakeChange(ChangeType.MODIFIED, FakeSnapshot(modified, dict(docs[modified], assigned_to="bob")))])
+    push_from_listener([FakeChange(ChangeType.REMOVED, FakeSnapshot(live_ids[1], {}))])
+    received = [[await stream.__anext__(), await stream.__anext__()] for stream in streams]
+    fan_out_ok = all([frame_event(a), frame_event(b)] == ["upsert", "remove"] for a, b in received) \
+        and json.loads(received[0][0].split(b"data: ", 1)[1])["incident"]["assigned_to"] == "bob"
+
+    # reconnecting with the token from before the two changes replays exactly them
+    resumed = stream_broadcaster.subscribe(resume_token)
+    replayed = [frame_event(frame) for frame in resumed.backlog]
+    expired = stream_broadcaster.subscribe("0badc0de-12")
+    expired_events = [frame_event(frame) for frame in expired.backlog]
+
+    # a client that stops reading is cut off at its queue limit and told to reload, nobody else is held up
+    broadcaster_module.CLIENT_QUEUE_EVENTS = 5
+    slow_stream = stream_broadcaster.stream()
+    await slow_stream.__anext__() # ready
+    for doc_id in live_ids[2:12]:
+        push_from_listener([FakeChange(ChangeType.MODIFIED, FakeSnapshot(doc_id, docs[doc_id]))])
+    await asyncio.sleep(0) # let the scheduled deliveries run
+    lagging = frame_event(await slow_stream.__anext__())
+    broadcaster_module.CLIENT_QUEUE_EVENTS = 1000
+
+    for stream in streams + [slow_stream]:
+        await stream.aclose()
+    for subscription in (resumed, expired):
+        stream_broadcaster.unsubscribe(subscription)
+
+    # a client that disconnects before its response starts: the generator never runs, so nothing subscribed
+    subscribed_before = len(stream_broadcaster)
+    abandoned = stream_broadcaster.stream(resume_token)
+    abandoned_subscribed = len(stream_broadcaster) - subscribed_before
+    await abandoned.aclose()
+    return fan_out_ok, replayed, expired_events, lagging, len(stream_broadcaster), abandoned_subscribed
+
+fan_out_ok, replayed, expired_events, lagging, still_connected, abandoned_subscribed = asyncio.run(stream_checks())
+print(f"300 clients got upsert + remove in order: {fan_out_ok} (Expected: True)")
+print(f"Resume replay: {replayed} (Expected: ['upsert', 'remove']), unknown token: {expired_events} (Expected: ['reset'])")
+print(f"Slow client after 10 changes with a 5 event queue: {lagging} (Expected: reset), left subscribed: {still_connected} (Expected: 0)")
+print(f"Subscriptions from a stream closed before it started: {abandoned_subscribed} (Expected: 0)")
+
+if fan_out_ok and replayed == ["upsert", "remove"] and expired_events == ["reset"] and lagging == "reset" \
+        and still_connected == 0 and abandoned_subscribed == 0:
+    print("[RESULT]: PASS! Every client gets each change once and reconnects pick up where they left off.")
+else:
+    print("[RESULT]: FAIL! The stream dropped, reordered or failed to resume changes.")
+
+
+# ==========================================
+# UT-31: NON-BLOCKING AUDIT SINK
+# ==========================================
+print("\n--- UT-31: AUDIT SINK QUEUE, OVERFLOW AND SHUTDOWN FLUSH ---")
+
+from services.audit_sink import AuditSink
+from fake_firestore import FakeBatch
+
+audit_db = FakeFirestore(latency=0.05)
+audit_sink = AuditSink(audit_db, max_queue=100) # not started, so the queue fills up
+start = time.perf_counter()
+accepted = sum(audit_sink.record({"method": "PATCH", "path": f"/api/incidents/{i}/resolve"}) for i in range(150))
+record_time = time.perf_counter() - start
+audit_sink.close() # shutdown flush
+logged = [data for (name, _), data in audit_db.docs.items() if name == "audit_logs"]
+print(f"150 records in {record_time * 1000:.2f} ms (one Firestore round trip is 50 ms), accepted {accepted}, dropped {audit_sink.dropped} (Expected: 100, 50)")
+print(f"Written on close: {len(logged)} in {audit_db.commits} commit(s) (Expected: 100 in 1)")
+
+class FlakyBatch(FakeBatch):
+    failures_left = 2
+    def commit(self):
+        if FlakyBatch.failures_left > 0:
+            FlakyBatch.failures_left -= 1
+            raise Exception("503 Service Unavailable")
+        super().commit()
+
+flaky_db = FakeFirestore()
+flaky_db.batch = lambda: FlakyBatch(flaky_db)
+flaky_sink = AuditSink(flaky_db, flush_interval=0.05).start()
+for i in range(20):
+    flaky_sink.record({"method": "POST", "path": f"/api/incidents/{i}/notes"})
+time.sleep(0.5) # two failed commits, then the retry goes through without new entries arriving
+retried = flaky_sink.written
+flaky_sink.close()
+print(f"Commits failing twice: {retried} of 20 written by the flusher thread, failed {flaky_sink.failed} (Expected: 20, 0)")
+
+if accepted == 100 and audit_sink.dropped == 50 and len(logged) == 100 and audit_db.commits == 1 \
+        and record_time < 0.05 and retried == 20 and flaky_sink.failed == 0:
+    print("[RESULT]: PASS! Audit entries queue without a round trip, overflow is counted and nothing queued is lost.")
+else:
+    print("[RESULT]: FAIL! The audit sink blocked, lost entries or miscounted drops.")
+
+
+# ==========================================
+# UT-32: ASYNC INCIDENT MUTATIONS WITH OPTIMISTIC CACHE UPDATES
+# ==========================================
+print("\n--- UT-32: INCIDENT MUTATIONS OFF THE EVENT LOOP ---")
+
+import asyncio
+from services.mutations import IncidentMutator
+
+mutation_db = FakeFirestore(latency=0.05)
+for i in range(50):
+    mutation_db.docs[("incidents", f"inc{i:02d}")] = {"data": encrypt_payload({"event_id": f"{i:08x}"}),
+                                                     "timestamp": base_time + datetime.timedelta(seconds=i),
+                                                     "analysis_status": "pending", "assigned_to": ""}
+mutation_cache = IncidentCache()
+mutation_db.collection("incidents").on_snapshot(mutation_cache.on_snapshot) # the listener, echoes every write
+mutator = IncidentMutator(mutation_db, mutation_cache, workers=16)
+
+async def mutation_checks():
+    write = asyncio.create_task(mutator.update("inc00", {"assigned_to": "alice"}))
+    await asyncio.sleep(0.01) # write still in flight
+    seen_early = mutation_cache.get("inc00")["assigned_to"]
+    await write
+
+    del mutation_db.docs[("incidents", "inc01")] # deleted behind the cache's back, so the write fails
+    try:
+        await mutator.update("inc01", {"analysis_status": "resolved"})
+        failed = False
+    except KeyError:
+        failed = True
+    reverted = mutation_cache.get("inc01")["analysis_status"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(mutator.update(f"inc{i:02d}", {"analysis_status": "resolved"}) for i in range(2, 50)))
+    return seen_early, failed, reverted, time.perf_counter() - start
+
+seen_early, failed, reverted, concurrent_time = asyncio.run(mutation_checks())
+resolved = sum(incident["analysis_status"] == "resolved" for incident in mutation_cache.list())
+print(f"Cache during the write: assigned_to={seen_early!r} (Expected: 'alice'), after: {mutation_cache.get('inc00')['assigned_to']!r}")
+print(f"Failed write raised: {failed}, cache rolled back to: {reverted!r} (Expected: True, 'pending')")
+print(f"48 concurrent updates at 50 ms each: {concurrent_time:.2f}s (serial would be 2.4s), resolved in cache: {resolved} (Expected: 48)")
+mutator.close()
+
+if seen_early == "alice" and mutation_cache.get("inc00")["assigned_to"] == "alice" and failed and reverted == "pending" \
+        and resolved == 48 and concurrent_time < 1.0:
+    print("[RESULT]: PASS! Updates show up in the cache at once, run concurrently and roll back on failure.")
+else:
+    print("[RESULT]: FAIL! Mutations blocked, were lost or a failed write stayed in the cache.")
+
+
+# ==========================================
+# UT-33: BULK INCIDENT MUTATIONS
+# ==========================================
+print("\n--- UT-33: BULK RESOLVE AS CHUNKED BATCH WRITES ---")
+
+bulk_db = FakeFirestore()
+for i in range(1200):
+    bulk_db.docs[("incidents", f"wave{i:04d}")] = {"data": encrypt_payload({"event_id": f"{i:08x}"}),
+                                                   "timestamp": base_time + datetime.timedelta(seconds=i),
+                                                   "analysis_status": "pending", "assigned_to": ""}
+wave_cache = IncidentCache()
+bulk_db.collection("incidents").on_snapshot(wave_cache.on_snapshot)
+bulk_mutator = IncidentMutator(bulk_db, wave_cache)
+loop_thread_applies = [] # cache changes applied on the event loop's thread (should be none)
+wave_cache.subscribe(lambda changes: threading.current_thread() is threading.main_thread() and loop_thread_applies.append(len(changes)))
+
+class FailSecondBatch(FakeBatch):
+    commits_seen = 0
+    def commit(self):
+        FailSecondBatch.commits_seen += 1
+        if FailSecondBatch.commits_seen == 2:
+            raise Exception("503 Service Unavailable")
+        super().commit()
+
+wave_ids = [f"wave{i:04d}" for i in range(1200)] + ["wave0000", "missing-doc"] # a duplicate and an unknown id
+results = asyncio.run(bulk_mutator.update_many([(doc_id, {"analysis_status": "resolved"}, None) for doc_id in wave_ids]))
+commits_ok = bulk_db.commits
+bulk_db.batch = lambda: FailSecondBatch(bulk_db)
+failing = asyncio.run(bulk_mutator.update_many([(doc_id, {"assigned_to": "alice"}, None) for doc_id in wave_ids[:1200]]))
+bulk_mutator.close()
+
+statuses_written = Counter(data["analysis_status"] for (name, _), data in bulk_db.docs.items() if name == "incidents")
+failed_ids = [doc_id for doc_id, result in failing.items() if result != "ok"]
+still_alice = sum(incident["assigned_to"] == "alice" for incident in wave_cache.list())
+print(f"1202 ids: {Counter(results.values())} in {commits_ok} commits (Expected: 1200 ok, 1 not_found, 3 commits)")
+print(f"Firestore after: {dict(statuses_written)} (Expected: {{'resolved': 1200}})")
+print(f"Second of 3 chunks failing: {len(failed_ids)} errors, cache shows alice on {still_alice} (Expected: 500, 700)")
+print(f"Cache changes applied on the event loop: {loop_thread_applies} (Expected: [])")
+
+if Counter(results.values()) == {"ok": 1200, "not_found": 1} and commits_ok == 3 and statuses_written == {"resolved": 1200} \
+        and len(failed_ids) == 500 and all(failing[doc_id].startswith("error") for doc_id in failed_ids) and still_alice == 700 \
+        and loop_thread_applies == []:
+    print("[RESULT]: PASS! Bulk updates go out 500 per commit with per-id results, a failed chunk only rolls back itself.")
+else:
+    print("[RESULT]: FAIL! Bulk updates were miscounted, written per doc or rolled back the wrong incidents.")
+
+
+# ==========================================
+# UT-34: FULL-TEXT SEARCH INDEX
+# ==========================================
+print("\n--- UT-34: INCIDENT SEARCH INDEX ---")
+
+from services.search_index import SearchIndex, incident_terms
+from services.incident_cache import order_key
+
+random.seed(34)
+search_cache = IncidentCache()
+search_index = SearchIndex(search_cache.get, order_key)
+search_cache.subscribe(search_index.on_change) # same wiring as services/firestore.py
+words = ["failed", "password", "admin", "root", "scan", "nmap", "sql", "injection", "sudo", "escalation", "firewall"]
+search_docs = {}
+for i in range(400):
+    text = " ".join(random.sample(words, 4)) + f" from 10.0.{i % 7}.{i % 50}"
+    data = {"data": encrypt_payload({"event_id": f"{i:08x}", "raw_sanitised_text": text}),
+            "timestamp": base_time + datetime.timedelta(seconds=random.randint(0, 5000))}
+    if i % 2:
+        data["ai_insights"] = [encrypt_payload({"summary": " ".join(random.sample(words, 2)), "risk_score": 5})]
+    if i % 9 == 0:
+        data["user_notes"] = [encrypt_payload(random.choice(words))]
+    search_docs[f"s{i:03d}"] = data
+search_cache.on_snapshot(None, [FakeChange(ChangeType.ADDED, FakeSnapshot(d, v)) for d, v in search_docs.items()], None)
+
+def brute_force_search(query):
+    terms = query.split()
+    matches = []
+    for incident in search_cache.list():
+        indexed = incident_terms(incident)
+        if all(term in indexed for term in terms[:-1]) and any(t.startswith(terms[-1]) for t in indexed):
+            matches.append(incident["id"])
+    return set(matches)
+
+mismatches = 0
+for query in ["failed", "failed password", "admin sql", "nmap scan fire", "esc", "10.0.3", "10.0.3.4 root", "nosuchword"]:
+    results = search_index.search(query, limit=1000)
+    keys = [(score, order_key(search_cache.get(doc_id))) for doc_id, score in results]
+    ranked = all(a[0] > b[0] or (a[0] == b[0] and a[1] < b[1]) for a, b in zip(keys, keys[1:]))
+    if {doc_id for doc_id, _ in results} != brute_force_search(query) or not ranked:
+        mismatches += 1
+        print(f"Mismatch for {query!r}")
+
+# summary hits outrank log text hits for the same word
+top = search_index.search("firewall ", limit=5)
+top_is_summary = all(incident_terms(search_cache.get(doc_id))["firewall"] == 3 for doc_id, _ in top)
+
+# incremental: a new note and a deleted doc
+noted = dict(search_docs["s001"], user_notes=[encrypt_payload("Quarantined by Zeta team")])
+search_cache.on_snapshot(None, [FakeChange(ChangeType.MODIFIED, FakeSnapshot("s001", noted))], None)
+search_cache.on_snapshot(None, [FakeChange(ChangeType.REMOVED, FakeSnapshot("s003", {}))], None)
+found_note = [doc_id for doc_id, _ in search_index.search("quarantined zeta")]
+deleted_gone = all(doc_id != "s003" for doc_id, _ in search_index.search("from", limit=1000))
+print(f"8 queries vs brute force, mismatches: {mismatches} (Expected: 0); top 'firewall' hits all from summaries: {top_is_summary}")
+print(f"New note searchable: {found_note} (Expected: ['s001']), deleted doc gone: {deleted_gone}, indexed: {len(search_index)} (Expected: 399)")
+
+if mismatches == 0 and top_is_summary and found_note == ["s001"] and deleted_gone and len(search_index) == 399:
+    print("[RESULT]: PASS! Search matches a full scan, ranks by field and follows listener changes.")
+else:
+    print("[RESULT]: FAIL! Search results, ranking or incremental updates are wrong.")
+
+
+# ==========================================
+# UT-35: STREAM AUTH FOR EVENTSOURCE CLIENTS
+# ==========================================
+print("\n--- UT-35: STREAM TOKEN INSTEAD OF THE API KEY HEADER ---")
+
+from fastapi import APIRouter, Depends
+import security.auth as auth_module
+from security.auth import get_api_key, get_stream_access, issue_stream_token
+
+auth_module.EXPECTED_API_KEY = "ut-35-key"
+
+# same wiring as main.py, the stream has its own router and auth check (api/incidents.py needs Firebase)
+keyed_router = APIRouter()
+open_stream_router = APIRouter()
+@keyed_router.post("/api/incidents/stream/token")
+def token_route():
+    token, expires_in = issue_stream_token()
+    return {"token": token, "expires_in": expires_in}
+@open_stream_router.get("/api/incidents/stream")
+def stream_route():
+    return {"streaming": True}
+
+auth_app = FastAPI()
+auth_app.include_router(keyed_router, dependencies=[Depends(get_api_key)])
+auth_app.include_router(open_stream_router, dependencies=[Depends(get_stream_access)])
+auth_http = TestClient(auth_app)
+
+no_key_token = auth_http.post("/api/incidents/stream/token").status_code
+stream_token = auth_http.post("/api/incidents/stream/token", headers={"X-API-Key": "ut-35-key"}).json()["token"]
+with_token = auth_http.get("/api/incidents/stream", params={"token": stream_token}).status_code # what EventSource sends
+with_header = auth_http.get("/api/incidents/stream", headers={"X-API-Key": "ut-35-key"}).status_code
+bare = auth_http.get("/api/incidents/stream").status_code
+expiry, _, signature = stream_token.partition(".")
+tampered = auth_http.get("/api/incidents/stream", params={"token": f"{int(expiry) + 3600}.{signature}"}).status_code
+raw_key = auth_http.get("/api/incidents/stream", params={"token": "ut-35-key"}).status_code
+auth_module.STREAM_TOKEN_SECONDS = -1 # already expired when issued
+expired_token = issue_stream_token()[0]
+expired = auth_http.get("/api/incidents/stream", params={"token": expired_token}).status_code
+auth_module.STREAM_TOKEN_SECONDS = 60
+
+print(f"Token without the key: {no_key_token} (Expected: 403); stream with ?token=: {with_token}, with header: {with_header} (Expected: 200, 200)")
+print(f"No credentials: {bare}, extended expiry: {tampered}, key as token: {raw_key}, expired: {expired} (Expected: 403 each)")
+
+if no_key_token == 403 and with_token == 200 and with_header == 200 and [bare, tampered, raw_key, expired] == [403] * 4:
+    print("[RESULT]: PASS! EventSource can open the stream with a short lived token, the API key stays out of the URL.")
+else:
+    print("[RESULT]: FAIL! Stream auth accepted a bad token or rejected a good one.")
+
+
+# ==========================================
+# UT-36: RELEASED BATCH WAKES AN IDLE WATCHER
+# ==========================================
+print("\n--- UT-36: WATCHER WAKE ON RELEASE ---")
+
+import threading
+from processing.spool import EventSpool
+from processing.watcher import PollingWatcher, InotifyWatcher
+
+with tempfile.TemporaryDirectory() as watch_dir, tempfile.TemporaryDirectory() as idle_spool_dir:
+    idle_spool = EventSpool(os.path.join(idle_spool_dir, "llm_spool.db")) # not in the watched folder, its writes would wake it
+    idle_spool.push_many([{"event_id": f"evt{i}", "doc_id": f"doc{i}"} for i in range(4)])
+    in_flight = idle_spool.take_batch(50) # everything claimed, so log_watcher sleeps with no timeout
+
+    wake_results = {}
+    watchers = [PollingWatcher(watch_dir, interval=30)] # a long interval, only wake() can end it in time
+    if sys.platform.startswith("linux"):
+        watchers.append(InotifyWatcher(watch_dir))
+    for idle_watcher in watchers:
+        def dispatcher_fails_batch():
+            time.sleep(0.2)
+            idle_spool.release([e["spool_seq"] for e in in_flight]) # what release_batch does...
+            idle_watcher.wake() # ...before waking the main loop
+        failing = threading.Thread(target=dispatcher_fails_batch)
+        start = time.perf_counter()
+        failing.start()
+        idle_watcher.wait(None if idle_watcher.kind == "inotify" else 30)
+        wake_results[idle_watcher.kind] = (round(time.perf_counter() - start, 1), idle_spool.pending_count())
+        failing.join()
+        idle_watcher.close()
+        in_flight = idle_spool.take_batch(50)
+    idle_spool.close()
+
+print(f"Seconds until the idle watcher woke, pending events then: {wake_results} (Expected: about 0.2s, 4 each)")
+if wake_results and all(seconds < 2 and pending == 4 for seconds, pending in wake_results.values()):
+    print("[RESULT]: PASS! A batch released on a dispatcher thread wakes the main loop straight away.")
+else:
+    print("[RESULT]: FAIL! The watcher kept sleeping after a batch was put back in the spool.")
+
+
+# ==========================================
+# UT-37: BULK SELECTION VALIDATION
+# ==========================================
+print("\n--- UT-37: BULK REQUESTS NEED IDS OR A FILTER, NOT BOTH ---")
+
+from api.models import BulkSelection, BulkNoteRequest
+
+# the real bulk routes need Firebase, a stand-in route with the same body models does the validating
+selection_router = APIRouter()
+@selection_router.patch("/api/incidents/bulk/resolve")
+def selection_route(selection: BulkSelection):
+    return {"ids": selection.ids, "filter": selection.filter.model_dump(exclude_none=True) if selection.filter else None}
+@selection_router.post("/api/incidents/bulk/notes")
+def selection_note_route(body: BulkNoteRequest):
+    return {"ids": body.ids}
+
+selection_app = FastAPI()
+selection_app.include_router(selection_router)
+selection_http = TestClient(selection_app)
+
+empty_ids = selection_http.patch("/api/incidents/bulk/resolve", json={"ids": []}).status_code
+both = selection_http.patch("/api/incidents/bulk/resolve", json={"ids": ["inc01"], "filter": {"status": "pending"}}).status_code
+both_note = selection_http.post("/api/incidents/bulk/notes", json={"ids": ["inc01"], "filter": {"status": "pending"}, "note": "x"}).status_code
+just_ids = selection_http.patch("/api/incidents/bulk/resolve", json={"ids": ["inc01"]})
+just_filter = selection_http.patch("/api/incidents/bulk/resolve", json={"filter": {"status": "pending"}})
+
+print(f"ids=[]: {empty_ids}, ids + filter: {both}, bulk note with both: {both_note} (Expected: 422 each)")
+print(f"Only ids: {just_ids.status_code} {just_ids.json()}, only a filter: {just_filter.status_code} {just_filter.json()}")
+
+if [empty_ids, both, both_note] == [422] * 3 and just_ids.status_code == 200 and just_filter.status_code == 200 \
+        and just_ids.json()["ids"] == ["inc01"] and just_filter.json()["filter"] == {"status": "pending"}:
+    print("[RESULT]: PASS! Empty or ambiguous bulk selections are rejected before anything is written.")
+else:
+    print("[RESULT]: FAIL! A bulk request with no ids, or with ids and a filter, got through.")
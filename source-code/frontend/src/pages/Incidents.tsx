@@ -33,7 +33,7 @@ interface Incident {
   id: string;
   event: IncidentEvent;
   ai_insights: AIInsight[] | null;
-  analysis_status: "AI_Analysis_Complete" | "pending" | "resolved";
+  analysis_status: "AI_Analysis_Complete" | "AI_Analysis_Failed" | "pending" | "resolved";
   timestamp?: any; 
   user_notes?: string[]; 
   completed_steps?: number[];
@@ -584,6 +584,8 @@ export default function Incidents() {
         return "bg-blue-100 border-blue-300 text-blue-700";
       case "pending":
         return "bg-yellow-100 border-yellow-300 text-yellow-700";
+      case "AI_Analysis_Failed":
+        return "bg-red-100 border-red-300 text-red-700";
       default:
         return "bg-gray-100 border-gray-300 text-gray-700";
     }
@@ -967,7 +969,7 @@ export default function Incidents() {
               <div>
                 <h4 className="text-xs font-black text-gray-400 uppercase tracking-wider mb-3">Status</h4>
                 <div className="flex flex-wrap gap-2">
-                  {['AI_Analysis_Complete', 'pending', 'resolved'].map((status) => (
+                  {['AI_Analysis_Complete', 'AI_Analysis_Failed', 'pending', 'resolved'].map((status) => (
                     <button
                       key={status}
                       onClick={() => toggleStatusFilter(status)}